@@ -8,13 +8,14 @@
 
 import locale
 import gettext
-import os, sys
+from gettext import gettext as _
+import os, sys, time
 from os.path import join
 import gtk, gobject
 gdk = gtk.gdk
-from lib import brush, helpers, mypaintlib
+from lib import brush, helpers, mypaintlib, journal
 import filehandling, keyboard, brushmanager, windowing, document, layout
-import brushmodifier, linemode
+import brushmodifier, linemode, backgroundwindow
 import colors
 from colorwindow import BrushColorManager
 from overlays import LastPaintPosOverlay, ScaleOverlay
@@ -22,6 +23,35 @@ from buttonmap import ButtonMapping
 
 import pygtkcompat
 
+#: Seconds between checks whether the crash recovery journal needs compaction
+JOURNAL_COMPACT_CHECK_INTERVAL = 60
+
+#: Print how long each phase of startup took (for profiling)
+startup_trace_enabled = bool(os.environ.get('MYPAINT_STARTUP_TRACE'))
+
+
+class StartupTrace:
+    """Prints per-phase timings of application startup, if enabled.
+
+    Each call to `phase()` reports the time since the previous one and
+    since the trace was started.
+    """
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = startup_trace_enabled
+        self.enabled = enabled
+        self.t0 = self.last = time.time()
+
+    def phase(self, name):
+        if not self.enabled:
+            return
+        t = time.time()
+        print 'startup: %-26s %8.1f ms  (total %8.1f ms)' % (
+            name, (t - self.last)*1000, (t - self.t0)*1000)
+        self.last = t
+
+
 class Application: # singleton
     """
     This class serves as a global container for everything that needs
@@ -48,6 +78,7 @@ class Application: # singleton
         """
         self.confpath = confpath
         self.datapath = datapath
+        self.startup_trace = trace = StartupTrace()
 
         # create config directory, and subdirs where the user might drop files
         # TODO make scratchpad dir something pulled from preferences #PALETTE1
@@ -86,6 +117,7 @@ class Application: # singleton
 
         self.ui_manager = self.builder.get_object("app_ui_manager")
         signal_callback_objs = []
+        trace.phase('icons and ui definitions')
 
         gdk.set_program_class('MyPaint')
 
@@ -106,6 +138,7 @@ class Application: # singleton
 
         self.preferences = {}
         self.load_settings()
+        trace.phase('settings')
 
         self.scratchpad_filename = ""
         self.kbm = keyboard.KeyboardManager(self)
@@ -113,9 +146,14 @@ class Application: # singleton
         signal_callback_objs.append(self.doc)
         signal_callback_objs.append(self.doc.modes)
         self.scratchpad_doc = document.Document(self, leader=self.doc)
+        trace.phase('documents')
         self.brushmanager = brushmanager.BrushManager(join(datapath, 'brushes'), join(confpath, 'brushes'), self)
+        trace.phase('brush manager')
         self.filehandler = filehandling.FileHandler(self)
         signal_callback_objs.append(self.filehandler)
+        # crash recovery, started in at_application_start()
+        self.journal = journal.Journal(self.doc.model, join(confpath, 'journal'))
+        self.journal.error_observers.append(self.journal_error_cb)
         self.brushmodifier = brushmodifier.BrushModifier(self)
         self.line_mode_settings = linemode.LineModeSettings(self)
 
@@ -134,6 +172,7 @@ class Application: # singleton
         self.brush_color_manager.set_data_path(datapath)
 
         self.init_brush_adjustments()
+        trace.phase('file handling and input')
 
         self.layout_manager = layout.LayoutManager(
             prefs=self.preferences["layout.window_positions"],
@@ -141,6 +180,7 @@ class Application: # singleton
             factory_opts=[self]  )
         self.drawWindow = self.layout_manager.get_widget_by_role("main-window")
         self.layout_manager.show_all()
+        trace.phase('main window and panels')
 
         signal_callback_objs.append(self.drawWindow)
 
@@ -153,21 +193,23 @@ class Application: # singleton
         self.filehandler.filename = None
         pygtkcompat.gtk.accel_map_load(join(self.confpath, 'accelmap.conf'))
 
-        # Load the background settings window.
-        # FIXME: this line shouldn't be needed, but we need to load this up
-        # front to get any non-default background that the user has configured
-        # from the preferences.
-        self.layout_manager.get_subwindow_by_role("backgroundWindow")
+        # The background and brush settings windows are built when first
+        # shown; only the user's default background is needed now.
+        backgroundwindow.load_default_background(self)
+        trace.phase('signals and background')
 
-        # And the brush settings window, or things like eraser mode will break.
-        # FIXME: brush_adjustments should not be dependent on this
-        self.layout_manager.get_subwindow_by_role("brushSettingsWindow")
+        if trace.enabled:
+            self.__trace_first_draw()
 
         def at_application_start(*junk):
             col = self.brush_color_manager.get_color()
             self.brushmanager.select_initial_brush()
             self.brush_color_manager.set_color(col)
-            if filenames:
+            trace.phase('initial brush')
+            recovered = self.filehandler.recover_from_journal()
+            if not recovered:
+                self.journal.start()
+            if filenames and not recovered:
                 # Open only the first file, no matter how many has been specified
                 # If the file does not exist just set it as the file to save to
                 fn = filenames[0].replace('file:///', '/') # some filebrowsers do this (should only happen with outdated mypaint.desktop)
@@ -175,6 +217,7 @@ class Application: # singleton
                     self.filehandler.filename = fn
                 else:
                     self.filehandler.open_file(fn)
+            trace.phase('journal and files')
 
             # Load last scratchpad
             if not self.preferences["scratchpad.last_opened_scratchpad"]:
@@ -187,12 +230,26 @@ class Application: # singleton
                     print "Scratchpad widget isn't initialised yet, so cannot centre"
 
 
+            trace.phase('scratchpad')
+
             self.apply_settings()
             if not self.pressure_devices:
                 print 'No pressure sensitive devices found.'
             self.drawWindow.present()
+            trace.phase('settings applied')
 
         gobject.idle_add(at_application_start)
+        gobject.timeout_add_seconds(JOURNAL_COMPACT_CHECK_INTERVAL,
+                                    self.journal.compact_if_needed)
+
+    def __trace_first_draw(self):
+        tdw = self.doc.tdw
+        signal = pygtkcompat.USE_GTK3 and "draw" or "expose-event"
+        handler_ids = []
+        def first_draw_cb(*junk):
+            tdw.disconnect(handler_ids.pop())
+            self.startup_trace.phase('first canvas draw')
+        handler_ids.append(tdw.connect_after(signal, first_draw_cb))
 
     def save_settings(self):
         """Saves the current settings to persistent storage."""
@@ -271,6 +328,9 @@ class Application: # singleton
             'brushmanager.selected_groups' : [],
             'frame.color_rgba': (0.12, 0.12, 0.12, 0.92),
             'misc.context_restores_color': True,
+            'color.pick_mode': 'mean',
+            'color.pick_from_document': True,
+            'color.pick_layers': 'all',
 
             "scratchpad.last_opened_scratchpad": "",
 
@@ -366,12 +426,28 @@ class Application: # singleton
                 return result
 
     def init_brush_adjustments(self):
-        """Initializes all the brush adjustments for the current brush"""
+        """Initializes all the brush adjustments for the current brush
+
+        The adjustments and the brush's base values are kept in sync here,
+        so widgets sharing them work whether or not the brush settings
+        window has been built.
+        """
         self.brush_adjustment = {}
         from brushlib import brushsettings
         for i, s in enumerate(brushsettings.settings_visible):
             adj = gtk.Adjustment(value=s.default, lower=s.min, upper=s.max, step_incr=0.01, page_incr=0.1)
+            adj.connect('value-changed', self.brush_adjustment_changed_cb, s.cname)
             self.brush_adjustment[s.cname] = adj
+        self.brush.observers.append(self.brush_settings_changed_cb)
+
+    def brush_adjustment_changed_cb(self, adj, cname):
+        self.brush.set_base_value(cname, adj.get_value())
+
+    def brush_settings_changed_cb(self, settings):
+        for cname in settings:
+            adj = self.brush_adjustment.get(cname)
+            if adj is not None:
+                adj.set_value(self.brush.get_base_value(cname))
 
     def update_button_mapping(self):
         self.button_mapping.update(self.preferences["input.button_mapping"])
@@ -526,6 +602,12 @@ class Application: # singleton
         pygtkcompat.gtk.accel_map_save(join(self.confpath, 'accelmap.conf'))
         self.save_settings()
 
+    def journal_error_cb(self, error):
+        self.message_dialog(_('The crash recovery journal could not be written. '
+                              'Crash protection is off until you save or open a document.'),
+                            type=gtk.MESSAGE_ERROR,
+                            secondary_text=helpers.escape(error))
+
     def message_dialog(self, text, type=gtk.MESSAGE_INFO, flags=0,
                        secondary_text=None, long_text=None, title=None):
         """Utility function to show a message/information dialog.
@@ -558,13 +640,39 @@ class Application: # singleton
         """Set the brush colour from the current pointer position on screen.
 
         This is a wrapper for `gui.colors.get_color_at_pointer()`, and
-        additionally sets the current brush colour.
+        additionally sets the current brush colour. If the widget is a
+        canvas and the pointer is over it, the colour is sampled from its
+        document with `gui.colors.get_color_in_document()` instead; a fully
+        transparent sample leaves the brush colour unchanged.
 
         """
-        color = colors.get_color_at_pointer(widget.get_display(), size)
+        mode = self.preferences.get('color.pick_mode', 'mean')
+        if self.preferences.get('color.pick_from_document', True):
+            if self.__pick_color_in_document(widget, size, mode):
+                return
+        color = colors.get_color_at_pointer(widget.get_display(), size, mode)
         self.brush_color_manager.set_color(color)
 
 
+    def __pick_color_in_document(self, widget, size, mode):
+        # Returns False if the pointer isn't over a canvas widget
+        doc = getattr(widget, "doc", None)
+        if doc is None or not hasattr(widget, "display_to_model"):
+            return False
+        x, y = widget.get_pointer()   # FIXME: deprecated in GTK3
+        alloc = widget.get_allocation()
+        if not (0 <= x < alloc.width and 0 <= y < alloc.height):
+            return False
+        model_x, model_y = widget.display_to_model(x, y)
+        layers = self.preferences.get('color.pick_layers', 'all')
+        color = colors.get_color_in_document(doc, model_x, model_y,
+                                             size / widget.scale, mode,
+                                             layers)
+        if color is not None:
+            self.brush_color_manager.set_color(color)
+        return True
+
+
 class DeviceUseMonitor (object):
     """Monitors device uses and detects changes.
     """
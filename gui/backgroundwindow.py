@@ -18,6 +18,35 @@ N = tiledsurface.N
 
 RESPONSE_SAVE_AS_DEFAULT = 1
 
+
+def is_supported_background(pixbuf):
+    """Whether a pixbuf can be used as a background image."""
+    w, h = pixbuf.get_width(), pixbuf.get_height()
+    if pixbuf.get_has_alpha():
+        return False
+    return w % N == 0 and h % N == 0 and w != 0 and h != 0
+
+
+def load_default_background(app):
+    """Sets the user's default background, without building the window.
+
+    Returns the pixbuf used, or None if there is no usable default.png.
+    """
+    for path in [app.confpath, app.datapath]:
+        filename = os.path.join(path, 'backgrounds', 'default.png')
+        if not os.path.isfile(filename):
+            continue
+        try:
+            pixbuf = gdk.pixbuf_new_from_file(filename)
+        except Exception, ex:
+            print ex
+            continue
+        if not is_supported_background(pixbuf):
+            continue
+        app.doc.model.set_background(pixbuf, make_default=True)
+        return pixbuf
+    return None
+
 class Window(windowing.Dialog):
     def __init__(self, app):
         flags = gtk.DIALOG_DESTROY_WITH_PARENT
@@ -29,6 +58,7 @@ class Window(windowing.Dialog):
 
         #set up window
         self.connect('response', self.on_response)
+        self.current_background_pixbuf = None
 
         notebook = self.nb = gtk.Notebook()
         self.vbox.pack_start(notebook)
@@ -126,25 +156,22 @@ class BackgroundList(pixbuflist.PixbufList):
                     _('Gdk-Pixbuf couldn\'t load "{filename}", and reported "{error}"').format(
                     filename=filename, error=repr(ex)))
                 continue
-            supported = True
-            if pixbuf.get_has_alpha():
-                load_errors.append(
-                    _('"%s" has an alpha channel. Background images with '
-                      'transparency are not supported.')
-                    % filename)
-                supported = False
-            w, h = pixbuf.get_width(), pixbuf.get_height()
-            if w % N != 0 or h % N != 0 or w == 0 or h == 0:
-                load_errors.append(
-                    _('{filename} has an unsupported size. Background images '
-                      'must have widths and heights which are multiples '
-                      'of {number} pixels.').format(filename=filename, number=N))
-                supported = False
-            if not supported:
+            if not is_supported_background(pixbuf):
+                if pixbuf.get_has_alpha():
+                    load_errors.append(
+                        _('"%s" has an alpha channel. Background images with '
+                          'transparency are not supported.')
+                        % filename)
+                else:
+                    load_errors.append(
+                        _('{filename} has an unsupported size. Background images '
+                          'must have widths and heights which are multiples '
+                          'of {number} pixels.').format(filename=filename, number=N))
                 continue
 
             if os.path.basename(filename).lower() == 'default.png':
-                self.win.set_background(pixbuf)
+                # already applied at startup by load_default_background()
+                self.win.current_background_pixbuf = pixbuf
                 continue
 
             self.backgrounds.append(pixbuf)
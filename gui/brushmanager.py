@@ -12,13 +12,14 @@ This module does file management for brushes and brush groups.
 
 import pygtkcompat
 import dialogs
-import gtk
+import gtk, gobject
 from gtk import gdk # only for gdk.pixbuf
 from gettext import gettext as _
-import os, zipfile
+import os, zipfile, time
 from os.path import basename
 import urllib
 from lib.brush import BrushInfo
+from lib import helpers
 from warnings import warn
 
 preview_w = 128
@@ -34,6 +35,9 @@ DEVBRUSH_NAME_PREFIX = "devbrush_"
 BRUSH_HISTORY_NAME_PREFIX = "history_"
 BRUSH_HISTORY_SIZE = 5
 NUM_BRUSHKEYS = 10
+PREVIEW_ATLAS_COLUMNS = 16
+PREVIEW_ATLAS_VERSION = 1
+BRUSH_CATALOGUE_VERSION = 1
 
 def devbrush_quote(device_name, prefix=DEVBRUSH_NAME_PREFIX):
     """
@@ -104,6 +108,163 @@ def parse_order_conf(file_content):
         groups[curr_group].append(name)
     return groups
 
+class BrushCatalogue:
+    """Persistent cache of the brush directory listings and group files.
+
+    Each directory's list of brushes and subdirectories is stored with
+    the directory's mtime, and only directories whose mtime changed are
+    listed again. Adding, removing or renaming a brush changes the mtime
+    of the directory containing it, so a start with an unchanged library
+    stats the directories and reads nothing else. Parsed `order.conf`
+    files are cached the same way.
+
+    Entries younger than a couple of seconds are not trusted, because a
+    change within the same mtime tick would go unnoticed.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.dirs = {}   # path -> [mtime, brush names, subdir names]
+        self.orders = {} # path -> [mtime, parsed groups]
+        self.dirty = False
+        try:
+            data = helpers.json_loads(open(filename).read())
+        except (IOError, ValueError):
+            return
+        if data.get('version') != BRUSH_CATALOGUE_VERSION:
+            return
+        self.dirs = data['dirs']
+        self.orders = data['orders']
+
+    def _get_mtime(self, path):
+        mtime = os.path.getmtime(path)
+        if time.time() - mtime < 2.0:
+            return None # too recent to be trusted
+        return mtime
+
+    def list_brushes(self, path):
+        """Returns the names of the brushes below `path`.
+
+        Names are relative to path, using slashes for subdirectories on
+        all platforms.
+        """
+        assert isinstance(path, unicode) # make sure we get unicode filenames
+        mtime = self._get_mtime(path)
+        entry = self.dirs.get(path)
+        if mtime is None or entry is None or entry[0] != mtime:
+            brushes, subdirs = [], []
+            for name in os.listdir(path):
+                assert isinstance(name, unicode)
+                if name.endswith('.myb'):
+                    brushes.append(name[:-4])
+                elif os.path.isdir(os.path.join(path, name)):
+                    subdirs.append(name)
+            entry = [mtime, brushes, subdirs]
+            self.dirs[path] = entry
+            self.dirty = True
+        mtime, brushes, subdirs = entry
+        l = list(brushes)
+        for name in subdirs:
+            for name2 in self.list_brushes(os.path.join(path, name)):
+                l.append(name + '/' + name2)
+        return l
+
+    def read_order_conf(self, filename):
+        """Returns the parsed groups of an order.conf file, or {}."""
+        if not os.path.exists(filename):
+            return {}
+        mtime = self._get_mtime(filename)
+        entry = self.orders.get(filename)
+        if mtime is None or entry is None or entry[0] != mtime:
+            entry = [mtime, parse_order_conf(open(filename).read())]
+            self.orders[filename] = entry
+            self.dirty = True
+        groups = entry[1]
+        return dict((group, list(names)) for group, names in groups.iteritems())
+
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'version': BRUSH_CATALOGUE_VERSION,
+                'dirs': self.dirs,
+                'orders': self.orders}
+        try:
+            open(self.filename, 'w').write(helpers.json_dumps(data))
+        except IOError, e:
+            print 'Failed to save brush catalogue: %s' % e
+        self.dirty = False
+
+
+class PreviewAtlas:
+    """Persistent cache of the previews of one brush group.
+
+    All previews of a group are packed into the cells of one PNG, with a
+    JSON index listing the brush name and the mtime of the `_prev.png`
+    each cell was made from. Loading a group's previews then takes one
+    image decode instead of one per brush. A cell is only used while its
+    mtime still matches the file on disk.
+    """
+
+    def __init__(self, dirname, group):
+        quoted = urllib.quote_plus(group.encode('utf-8'), safe='')
+        self.prefix = os.path.join(dirname, quoted)
+        self.entries = {} # brush name -> (pixbuf, mtime)
+        self.dirty = False
+
+    def load(self):
+        try:
+            index = helpers.json_loads(open(self.prefix + '.json').read())
+            if index.get('version') != PREVIEW_ATLAS_VERSION:
+                return
+            atlas = gdk.pixbuf_new_from_file(self.prefix + '.png')
+        except (IOError, ValueError, gobject.GError):
+            return
+        columns = index['columns']
+        for i, (name, mtime) in enumerate(index['brushes']):
+            x = (i % columns) * preview_w
+            y = (i / columns) * preview_h
+            if pygtkcompat.USE_GTK3:
+                pixbuf = atlas.new_subpixbuf(x, y, preview_w, preview_h)
+            else:
+                pixbuf = atlas.subpixbuf(x, y, preview_w, preview_h)
+            self.entries[name] = (pixbuf, mtime)
+
+    def lookup(self, name, mtime):
+        """Returns the cached preview, if it was made from this mtime."""
+        entry = self.entries.get(name)
+        if entry is None or entry[1] != mtime:
+            return None
+        return entry[0]
+
+    def store(self, name, pixbuf, mtime):
+        self.entries[name] = (pixbuf, mtime)
+        self.dirty = True
+
+    def save(self, names):
+        """Writes the atlas, with cells in the order of `names`."""
+        names = [n for n in names if n in self.entries]
+        rows = max(1, (len(names) + PREVIEW_ATLAS_COLUMNS - 1) / PREVIEW_ATLAS_COLUMNS)
+        atlas = pygtkcompat.gdk.pixbuf.new(gdk.COLORSPACE_RGB, True, 8,
+                                           PREVIEW_ATLAS_COLUMNS * preview_w,
+                                           rows * preview_h)
+        atlas.fill(0xffffff00)
+        index = []
+        for i, name in enumerate(names):
+            pixbuf, mtime = self.entries[name]
+            if pixbuf.get_width() != preview_w or pixbuf.get_height() != preview_h:
+                pixbuf = pixbuf.scale_simple(preview_w, preview_h, gdk.INTERP_BILINEAR)
+            x = (i % PREVIEW_ATLAS_COLUMNS) * preview_w
+            y = (i / PREVIEW_ATLAS_COLUMNS) * preview_h
+            pixbuf.copy_area(0, 0, preview_w, preview_h, atlas, x, y)
+            index.append([name, mtime])
+        pygtkcompat.gdk.pixbuf.save(atlas, self.prefix + '.png', 'png')
+        index = {'version': PREVIEW_ATLAS_VERSION,
+                 'columns': PREVIEW_ATLAS_COLUMNS,
+                 'brushes': index}
+        open(self.prefix + '.json', 'w').write(helpers.json_dumps(index))
+        self.dirty = False
+
+
 class BrushManager:
     def __init__(self, stock_brushpath, user_brushpath, app):
         self.stock_brushpath = stock_brushpath
@@ -124,7 +285,16 @@ class BrushManager:
 
         if not os.path.isdir(self.user_brushpath):
             os.mkdir(self.user_brushpath)
+        self.preview_atlas_path = os.path.join(app.confpath, 'brushpreviews')
+        if not os.path.isdir(self.preview_atlas_path):
+            os.mkdir(self.preview_atlas_path)
+        self.preview_atlases = {}
+        self.preview_atlas_groups = {} # brush name -> group of its atlas
+        self.preview_atlas_save_queued = False
+        catalogue_file = os.path.join(app.confpath, 'brushcatalogue.json')
+        self.catalogue = BrushCatalogue(catalogue_file)
         self.load_groups()
+        self.catalogue.save()
 
         # Retreive which groups were last open, or default to a nice/sane set.
         last_active_groups = self.app.preferences['brushmanager.selected_groups']
@@ -214,28 +384,40 @@ class BrushManager:
         self.contexts = [None for i in xrange(NUM_BRUSHKEYS)]
         self.history = [None for i in xrange(BRUSH_HISTORY_SIZE)]
 
+        # Directory listings come from the catalogue, so constructing
+        # the brushes below needs no per-file checks.
+        stock_names = self.catalogue.list_brushes(self.stock_brushpath)
+        user_names = self.catalogue.list_brushes(self.user_brushpath)
+        stock_name_set = set(stock_names)
+        user_name_set = set(user_names)
+
         brush_by_name = {}
         def get_brush(name, **kwargs):
             if name not in brush_by_name:
-                b = ManagedBrush(self, name, persistent=True, **kwargs)
+                if name in user_name_set:
+                    prefix = os.path.join(self.user_brushpath, name)
+                elif name in stock_name_set:
+                    prefix = os.path.join(self.stock_brushpath, name)
+                else:
+                    raise IOError, 'brush "' + name + '" not found'
+                b = ManagedBrush(self, name, persistent=True,
+                                 fileprefix=prefix, **kwargs)
                 brush_by_name[name] = b
             return brush_by_name[name]
 
         def read_groups(filename):
-            groups = {}
-            if os.path.exists(filename):
-                groups = parse_order_conf(open(filename).read())
-                # replace brush names with ManagedBrush instances
-                for group, names in groups.items():
-                    brushes = []
-                    for name in names:
-                        try:
-                            b = get_brush(name)
-                        except IOError, e:
-                            print e, '(removed from group)'
-                            continue
-                        brushes.append(b)
-                    groups[group] = brushes
+            groups = self.catalogue.read_order_conf(filename)
+            # replace brush names with ManagedBrush instances
+            for group, names in groups.items():
+                brushes = []
+                for name in names:
+                    try:
+                        b = get_brush(name)
+                    except IOError, e:
+                        print e, '(removed from group)'
+                        continue
+                    brushes.append(b)
+                groups[group] = brushes
             return groups
 
         # tree-way-merge of brush groups (for upgrading)
@@ -280,25 +462,9 @@ class BrushManager:
             open(os.path.join(self.user_brushpath,  'order_default.conf'), 'w').write(data)
 
         # check for brushes that are in the brush directory, but not in any group
-
-        def listbrushes(path):
-            # Return a list of brush names relative to path, using
-            # slashes for subirectories on all platforms.
-            path += '/'
-            l = []
-            assert isinstance(path, unicode) # make sure we get unicode filenames 
-            for name in os.listdir(path):
-                assert isinstance(name, unicode)
-                if name.endswith('.myb'):
-                    l.append(name[:-4])
-                elif os.path.isdir(path+name):
-                    for name2 in listbrushes(path+name):
-                        l.append(name + '/' + name2)
-            return l
-
         # Distinguish between brushes in the brushlist and those that are not;
         # handle lost-and-found ones.
-        for name in listbrushes(self.stock_brushpath) + listbrushes(self.user_brushpath):
+        for name in stock_names + user_names:
             if name.startswith('context'):
                 b = get_brush(name)
                 i = int(name[-2:])
@@ -319,6 +485,12 @@ class BrushManager:
                     brushes = self.groups.setdefault(FOUND_BRUSHES_GROUP, [])
                     brushes.insert(0, b)
 
+        # Each brush's preview is cached in the atlas of the first group
+        # listing it.
+        for group in sorted(self.groups):
+            for b in self.groups[group]:
+                self.preview_atlas_groups.setdefault(b.name, group)
+
         # Sensible defaults for brushkeys and history: clone the first few
         # brushes from a normal group if we need to and if we can.
         # Try the default startup group first.
@@ -339,7 +511,7 @@ class BrushManager:
                 c = ManagedBrush(self, name=c_name, persistent=False)
                 group_idx = idx % len(default_group)
                 b = default_group[group_idx]
-                b.clone_into(c, c_name)
+                c.clone_lazily_from(b)
                 self.contexts[i] = c
         for i in xrange(BRUSH_HISTORY_SIZE):
             if self.history[i] is None:
@@ -347,7 +519,7 @@ class BrushManager:
                 h = ManagedBrush(self, name=h_name, persistent=False)
                 group_i = i % len(default_group)
                 b = default_group[group_i]
-                b.clone_into(h, h_name)
+                h.clone_lazily_from(b)
                 self.history[i] = h
 
         # clean up legacy stuff
@@ -630,6 +802,52 @@ class BrushManager:
         self.app.preferences['brushmanager.selected_groups'] = groups
         for f in self.groups_observers: f()
 
+    def get_cached_preview(self, brush, mtime):
+        """Returns a brush's preview from its group's atlas, or None.
+
+        The atlas of a group is read in full the first time any of its
+        brushes asks for a preview.
+        """
+        atlas = self._get_preview_atlas(brush.name)
+        if atlas is None:
+            return None
+        return atlas.lookup(brush.name, mtime)
+
+    def cache_preview(self, brush, pixbuf, mtime):
+        """Stores a preview loaded from disk, for rewriting the atlas."""
+        atlas = self._get_preview_atlas(brush.name)
+        if atlas is None:
+            return
+        atlas.store(brush.name, pixbuf, mtime)
+        if not self.preview_atlas_save_queued:
+            self.preview_atlas_save_queued = True
+            gobject.idle_add(self._save_preview_atlases)
+
+    def _get_preview_atlas(self, name):
+        group = self.preview_atlas_groups.get(name)
+        if group is None:
+            return None
+        atlas = self.preview_atlases.get(group)
+        if atlas is None:
+            atlas = PreviewAtlas(self.preview_atlas_path, group)
+            atlas.load()
+            self.preview_atlases[group] = atlas
+        return atlas
+
+    def _save_preview_atlases(self):
+        self.preview_atlas_save_queued = False
+        for group, atlas in self.preview_atlases.iteritems():
+            if not atlas.dirty:
+                continue
+            names = [b.name for b in self.groups.get(group, [])
+                     if self.preview_atlas_groups.get(b.name) == group]
+            try:
+                atlas.save(names)
+            except (IOError, OSError, gobject.GError), e:
+                print 'Failed to save brush preview atlas %r: %s' % (group, e)
+                atlas.dirty = False
+        return False
+
     def get_group_brushes(self, group, make_active=False):
         if group not in self.groups:
             brushes = []
@@ -672,7 +890,8 @@ class BrushManager:
 
 class ManagedBrush(object):
     '''Represents a brush, but cannot be selected or painted with directly.'''
-    def __init__(self, brushmanager, name=None, persistent=False):
+    def __init__(self, brushmanager, name=None, persistent=False,
+                 fileprefix=None):
         self.bm = brushmanager
         self._preview = None
         self.name = name
@@ -683,12 +902,31 @@ class ManagedBrush(object):
         self.settings_mtime = None
         self.preview_mtime = None
 
-        if persistent:
+        # (name, prefix) as last resolved by get_fileprefix()
+        self._fileprefix = None
+        # brush to copy settings and preview from when first needed
+        self._clone_source = None
+
+        if fileprefix is not None:
+            # already located by the brush catalogue
+            self._fileprefix = (name, fileprefix)
+        elif persistent:
             # we load the files later, but throw an exception now if they don't exist
             self.get_fileprefix()
 
+    def clone_lazily_from(self, source):
+        """Makes this brush a copy of `source`, made when first used."""
+        self._clone_source = source
+
+    def _finish_clone(self):
+        source = self._clone_source
+        self._clone_source = None
+        source.clone_into(self, self.name)
+
     # load preview pixbuf on demand
     def get_preview(self):
+        if self._clone_source is not None:
+            self._finish_clone()
         if self._preview is None and self.name:
             self._load_preview()
         if self._preview is None:
@@ -698,15 +936,19 @@ class ManagedBrush(object):
             self.preview.fill(0xffffffff) # white
         return self._preview
     def set_preview(self, pixbuf):
+        self._clone_source = None
         self._preview = pixbuf
     preview = property(get_preview, set_preview)
 
     # load brush settings on demand
     def get_brushinfo(self):
+        if self._clone_source is not None:
+            self._finish_clone()
         if self.persistent and not self.settings_loaded:
             self._load_settings()
         return self._brushinfo
     def set_brushinfo(self, brushinfo):
+        self._clone_source = None
         self._brushinfo = brushinfo
     brushinfo = property(get_brushinfo, set_brushinfo)
 
@@ -744,11 +986,15 @@ class ManagedBrush(object):
                 d = os.path.dirname(prefix)
                 if not os.path.isdir(d):
                     os.makedirs(d)
+            self._fileprefix = (self.name, prefix)
             return prefix
+        if self._fileprefix is not None and self._fileprefix[0] == self.name:
+            return self._fileprefix[1]
         if not os.path.isfile(prefix + '.myb'):
             prefix = os.path.join(self.bm.stock_brushpath, self.name)
         if not os.path.isfile(prefix + '.myb'):
             raise IOError, 'brush "' + self.name + '" not found'
+        self._fileprefix = (self.name, prefix)
         return prefix
 
     def clone(self, name):
@@ -772,6 +1018,7 @@ class ManagedBrush(object):
         if os.path.isfile(prefix + '.myb'):
             os.remove(prefix + '_prev.png')
             os.remove(prefix + '.myb')
+            self._fileprefix = None
             try:
                 self.load()
             except IOError:
@@ -824,9 +1071,14 @@ class ManagedBrush(object):
         prefix = self.get_fileprefix()
 
         filename = prefix + '_prev.png'
-        pixbuf = gdk.pixbuf_new_from_file(filename)
+        mtime = os.path.getmtime(filename)
+        pixbuf = self.bm.get_cached_preview(self, mtime)
+        if pixbuf is None:
+            pixbuf = gdk.pixbuf_new_from_file(filename)
+            self.bm.cache_preview(self, pixbuf, mtime)
         self._preview = pixbuf
-        self.remember_mtimes()
+        self.preview_mtime = mtime
+        self.settings_mtime = os.path.getmtime(prefix + '.myb')
 
     def _load_settings(self):
         """Loads the brush settings/dynamics from disk."""
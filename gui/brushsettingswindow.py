@@ -33,6 +33,7 @@ class Window(windowing.SubWindow):
         self.set_default_size(450, 500)
 
         self.app.brush.observers.append(self.brush_modified_cb)
+        self.update_settings(set(self.visible_settings))
 
     def init_ui(self):
         """Construct and pack widgets."""
@@ -140,7 +141,6 @@ class Window(windowing.SubWindow):
                 l.set_tooltip_text(s.tooltip)
 
                 adj = self.app.brush_adjustment[s.cname]
-                adj.connect('value-changed', self.value_changed_cb, cname)
                 self.adj[cname] = adj
                 h = gtk.HScale(adj)
                 h.set_digits(2)
@@ -183,16 +183,14 @@ class Window(windowing.SubWindow):
         self.header_button.show()
         self.live_update.show()
 
-    def value_changed_cb(self, adj, cname):
-        value = adj.get_value()
-        self.app.brush.set_base_value(cname, value)
-
     def update_settings(self, settings):
-        """Update adjustment and button labels"""
+        """Update button labels
+
+        The adjustments themselves are kept in sync with the brush by the
+        application, see `Application.init_brush_adjustments()`.
+        """
         for cname in settings.intersection(self.visible_settings):
-            # Update slider
             adj = self.adj[cname]
-            adj.set_value(self.app.brush.get_base_value(cname))
 
             # Make the "input value mapping" button reflect whether
             # this brush already has a mapping or not
@@ -13,6 +13,7 @@
 from adjbases import ColorManager, ColorAdjuster, PreviousCurrentColorAdjuster
 from combined import CombinedColorAdjuster
 from picker import ColorPickerButton, get_color_at_pointer
+from picker import get_color_in_document
 from hsvtriangle import HSVTriangle
 from uicolor import RGBColor, HSVColor, HCYColor
 
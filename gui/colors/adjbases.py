@@ -20,7 +20,9 @@ from gtk import gdk
 import gobject
 import cairo
 from gettext import gettext as _
+import numpy
 
+from lib.helpers import LRUCache
 from util import *
 from uicolor import *
 from bases import CachedBgDrawingArea
@@ -31,6 +33,26 @@ from uimisc import *
 PREFS_KEY_CURRENT_COLOR = 'colors.current'
 PREFS_KEY_COLOR_HISTORY = 'colors.history'
 
+#: Number of rendered gradient images kept for reuse by sliders and wheels
+GRADIENT_CACHE_SIZE = 16
+
+_gradient_cache = LRUCache(GRADIENT_CACHE_SIZE)
+
+
+def get_cached_gradient(key, render):
+    """Returns a gradient surface from the shared cache, or renders it.
+
+    The `key` must capture everything the image depends on, typically the
+    adjuster class, its size, and the quantized channels it holds fixed.
+    `render()` may return None, which is not cached.
+    """
+    surf = _gradient_cache.get(key)
+    if surf is None:
+        surf = render()
+        if surf is not None:
+            _gradient_cache[key] = surf
+    return surf
+
 
 class ColorManager (gobject.GObject):
     """Manages updates to a shared `UIColor` from lots of `ColorAdjuster`s.
@@ -712,19 +734,25 @@ class SliderColorAdjuster (ColorAdjusterWidget):
         b_w = wd-b-b-1
         b_h = ht-b-b-1
 
-        # Build the gradient
-        if self.vertical:
-            bar_gradient = cairo.LinearGradient(0, b, 0, b+bar_length)
+        # Sample every pixel if the subclass can, otherwise approximate
+        # with a gradient.
+        bar_image = self.__get_bar_image(int(b_w+1), int(b_h+1))
+        if bar_image is not None:
+            bar_gradient = cairo.SurfacePattern(bar_image)
+            bar_gradient.set_matrix(cairo.Matrix(x0=-b, y0=-b))
         else:
-            bar_gradient = cairo.LinearGradient( b, 0, b+bar_length, 0)
-        samples = self.samples + 2
-        for s in xrange(samples+1):
-            p = float(s)/samples
-            col = self.get_color_for_bar_amount(p)
-            r, g, b = col.get_rgb()
             if self.vertical:
-                p = 1 - p
-            bar_gradient.add_color_stop_rgb(p, r, g, b)
+                bar_gradient = cairo.LinearGradient(0, b, 0, b+bar_length)
+            else:
+                bar_gradient = cairo.LinearGradient( b, 0, b+bar_length, 0)
+            samples = self.samples + 2
+            for s in xrange(samples+1):
+                p = float(s)/samples
+                col = self.get_color_for_bar_amount(p)
+                r, g, b = col.get_rgb()
+                if self.vertical:
+                    p = 1 - p
+                bar_gradient.add_color_stop_rgb(p, r, g, b)
 
         # Paint bar with Tango-like edges
         cr.set_line_join(cairo.LINE_JOIN_ROUND)
@@ -746,6 +774,54 @@ class SliderColorAdjuster (ColorAdjusterWidget):
             cr.stroke()
 
 
+    def __get_bar_image(self, wd, ht):
+        if wd <= 0 or ht <= 0:
+            return None
+        length = self.vertical and ht or wd
+        key = (self.__class__.__name__, self.vertical, wd, ht,
+               self.get_gradient_key())
+        def render():
+            amts = (numpy.arange(length) + 0.5) / length
+            if self.vertical:
+                amts = 1.0 - amts
+            rgb = self.get_rgb_array_for_bar_amounts(amts)
+            if rgb is None:
+                return None
+            if self.vertical:
+                rgb = rgb[:, numpy.newaxis, :].repeat(wd, axis=1)
+            else:
+                rgb = rgb[numpy.newaxis, :, :].repeat(ht, axis=0)
+            return rgb_array_to_surface(rgb)
+        return get_cached_gradient(key, render)
+
+
+    def get_gradient_key(self):
+        """Returns a hashable token identifying the bar's colours.
+
+        This implementation samples the bar at a few points, so it does not
+        change when the managed colour moves along the bar.
+        """
+        key = []
+        for amt in (0.0, 0.25, 0.5, 0.75, 1.0):
+            rgb = self.get_color_for_bar_amount(amt).get_rgb()
+            key.extend([int(c * 1000) for c in rgb])
+        return tuple(key)
+
+
+    def get_background_validity(self):
+        return self.get_gradient_key()
+
+
+    def get_rgb_array_for_bar_amounts(self, amts):
+        """Vectorized `get_color_for_bar_amount()`, for a NumPy array.
+
+        Returns an array of RGB triples, one per amount, or None if the
+        subclass does not implement this. The bar is then approximated
+        with a linear gradient.
+        """
+        return None
+
+
     def get_bar_amount_for_color(self, color):
         """Bar amount for a given `UIColor`; subclasses must implement.
         """
@@ -940,46 +1016,53 @@ class HueSaturationWheelMixin:
         cr.set_source_rgba(*self.outline_rgba)
         cr.stroke()
 
-        # Each slice in turn
-        cr.save()
-        cr.set_line_width(1.0)
-        cr.set_line_join(cairo.LINE_JOIN_ROUND)
-        step_angle = 2.0*math.pi/steps
-        for ih in xrange(steps+1): # overshoot by 1, no solid bit for final
-            h = float(ih)/steps
-            edge_col = self.color_at_normalized_polar_pos(1.0, h)
-            rgb = edge_col.get_rgb()
-            if ih > 0:
-                # Backwards gradient
-                cr.arc_negative(0, 0, radius, 0, -step_angle)
-                x, y = cr.get_current_point()
-                cr.line_to(0, 0)
-                cr.close_path()
-                lg = cairo.LinearGradient(radius, 0, float(x+radius)/2, y)
-                lg.add_color_stop_rgba(0, rgb[0], rgb[1], rgb[2], 1.0)
-                lg.add_color_stop_rgba(1, rgb[0], rgb[1], rgb[2], 0.0)
-                cr.set_source(lg)
-                cr.fill()
-            if ih < steps:
-                # Forward solid
-                cr.arc(0, 0, radius, 0, step_angle)
-                x, y = cr.get_current_point()
-                cr.line_to(0, 0)
-                cr.close_path()
-                cr.set_source_rgb(*rgb)
-                cr.stroke_preserve()
-                cr.fill()
-            cr.rotate(step_angle)
-        cr.restore()
+        wheel_image = self.__get_wheel_image(radius)
+        if wheel_image is not None:
+            # Every pixel sampled exactly
+            n = int(radius) + 1
+            cr.set_source_surface(wheel_image, -n, -n)
+            cr.paint()
+        else:
+            # Each slice in turn
+            cr.save()
+            cr.set_line_width(1.0)
+            cr.set_line_join(cairo.LINE_JOIN_ROUND)
+            step_angle = 2.0*math.pi/steps
+            for ih in xrange(steps+1): # overshoot by 1, no solid bit for final
+                h = float(ih)/steps
+                edge_col = self.color_at_normalized_polar_pos(1.0, h)
+                rgb = edge_col.get_rgb()
+                if ih > 0:
+                    # Backwards gradient
+                    cr.arc_negative(0, 0, radius, 0, -step_angle)
+                    x, y = cr.get_current_point()
+                    cr.line_to(0, 0)
+                    cr.close_path()
+                    lg = cairo.LinearGradient(radius, 0, float(x+radius)/2, y)
+                    lg.add_color_stop_rgba(0, rgb[0], rgb[1], rgb[2], 1.0)
+                    lg.add_color_stop_rgba(1, rgb[0], rgb[1], rgb[2], 0.0)
+                    cr.set_source(lg)
+                    cr.fill()
+                if ih < steps:
+                    # Forward solid
+                    cr.arc(0, 0, radius, 0, step_angle)
+                    x, y = cr.get_current_point()
+                    cr.line_to(0, 0)
+                    cr.close_path()
+                    cr.set_source_rgb(*rgb)
+                    cr.stroke_preserve()
+                    cr.fill()
+                cr.rotate(step_angle)
+            cr.restore()
 
-        # Cheeky approximation of the right desaturation gradients
-        rg = cairo.RadialGradient(0,0, 0,  0,0,  radius)
-        add_distance_fade_stops(rg, ref_grey.get_rgb(),
-                                nstops=sat_slices,
-                                gamma=1.0/sat_gamma)
-        cr.set_source(rg)
-        cr.arc(0, 0, radius, 0, 2*math.pi)
-        cr.fill()
+            # Cheeky approximation of the right desaturation gradients
+            rg = cairo.RadialGradient(0,0, 0,  0,0,  radius)
+            add_distance_fade_stops(rg, ref_grey.get_rgb(),
+                                    nstops=sat_slices,
+                                    gamma=1.0/sat_gamma)
+            cr.set_source(rg)
+            cr.arc(0, 0, radius, 0, 2*math.pi)
+            cr.fill()
 
         # Tangoesque inner border 
         cr.set_source_rgba(*self.edge_highlight_rgba)
@@ -1009,6 +1092,30 @@ class HueSaturationWheelMixin:
         cr.restore()
 
 
+    def __get_wheel_image(self, radius):
+        """The disc of the wheel, centred in a square image of side 2n.
+        """
+        # The disc depends only on the lightness of its central grey.
+        grey = self.color_at_normalized_polar_pos(0, 0)
+        key = (self.__class__.__name__, radius, self.sat_gamma,
+               int(max(grey.get_rgb()) * 1000))
+        def render():
+            n = int(radius) + 1
+            d = numpy.arange(2*n) - n + 0.5
+            dx = d[numpy.newaxis, :]
+            dy = d[:, numpy.newaxis]
+            dist = numpy.hypot(dx, dy)
+            # Same mapping as get_color_at_position()
+            r = numpy.minimum(dist / radius, 1.0) ** self.sat_gamma
+            theta = (1.25 - numpy.arctan2(dx, dy) / (2*math.pi)) % 1.0
+            rgb = self.get_rgb_array_at_normalized_polar_pos(r, theta)
+            if rgb is None:
+                return None
+            alpha = radius + 0.5 - dist  # antialiased edge
+            return rgb_array_to_surface(rgb, alpha)
+        return get_cached_gradient(key, render)
+
+
     def color_at_normalized_polar_pos(self, r, theta):
         """Get the colour represented by a polar position.
     
@@ -1017,6 +1124,16 @@ class HueSaturationWheelMixin:
         raise NotImplementedError
 
 
+    def get_rgb_array_at_normalized_polar_pos(self, r, theta):
+        """Vectorized `color_at_normalized_polar_pos()`, for NumPy arrays.
+
+        Returns an array of RGB triples with the shape of `r` and `theta`,
+        or None if the subclass does not implement this. The wheel is then
+        approximated with per-slice gradients.
+        """
+        return None
+
+
     def get_normalized_polar_pos_for_color(self, col):
         """Inverse of `color_at_normalized_polar_pos`.
         """
@@ -80,10 +80,14 @@ class CombinedAdjusterPage (ColorAdjuster):
 
 class CombinedColorAdjuster (gtk.VBox, ColorAdjuster):
     """Composite colour adjuster consisting of several tabbed pages.
+
+    Only the tabs are created up front. Each page's content is built the
+    first time it is shown, or when something asks for it, so startup
+    cost does not grow with the number of pages.
     """
 
     __adjusters = None
-    __palette_page = None
+    __palette_page_index = None
 
 
     def __init__(self):
@@ -94,7 +98,6 @@ class CombinedColorAdjuster (gtk.VBox, ColorAdjuster):
         import sliders
         import paletteview
         palette_class = paletteview.PalettePage
-        palette_page = None
         page_classes = (hcywheel.HCYAdjusterPage,
                         hsvwheel.HSVAdjusterPage,
                         palette_class,
@@ -105,81 +108,95 @@ class CombinedColorAdjuster (gtk.VBox, ColorAdjuster):
 
         gtk.VBox.__init__(self)
         self.__adjusters = []
+        self.__pages = [None for c in page_classes]
         nb = self.__notebook = gtk.Notebook()
         nb.set_property("scrollable", True)
-        page_index = 0
-        for page_class in page_classes:
+        for page_index, page_class in enumerate(page_classes):
             icon_name = page_class.get_page_icon_name()
             icon_img = gtk.Image()
             icon_img.set_from_icon_name(icon_name, gtk.ICON_SIZE_SMALL_TOOLBAR)
             icon_img.connect("query-tooltip", self.__tab_tooltip_query_cb,
                              page_class)
             icon_img.set_property("has-tooltip", True)
-            page_title = page_class.get_page_title()
-            page = page_class()
-            page_table = page.get_page_widget()
-
-            picker = ColorPickerButton()
-            comparator = PreviousCurrentColorAdjuster()
-            bookmark_btn = borderless_button(
-                        icon_name="bookmark-new",
-                        tooltip=_("Add color to Palette"))
-            bookmark_btn.connect("clicked", self.__bookmark_button_clicked_cb)
-            properties_desc = page_class.get_properties_description()
-            if properties_desc is not None:
-                properties_btn = borderless_button(
-                        stock_id=gtk.STOCK_PROPERTIES,
-                        tooltip=properties_desc)
-                properties_btn.connect("clicked",
-                        self.__properties_button_clicked_cb,
-                        page)
-            else:
-                properties_btn = borderless_button(
-                        stock_id=gtk.STOCK_PROPERTIES)
-                properties_btn.set_sensitive(False)
-
-            # Common footer
-            hbox = gtk.HBox()
-            hbox.set_spacing(3)
-            hbox.pack_start(picker, False, False)
-            hbox.pack_start(comparator, True, True)
-            hbox.pack_start(bookmark_btn, False, False)
-            hbox.pack_start(properties_btn, False, False)
-
-            # Full page layout
+
+            # Full page layout, filled in by __get_page()
             vbox = gtk.VBox()
             vbox.set_spacing(3)
             vbox.set_border_width(3)
-            vbox.pack_start(page_table, True, True)
-            vbox.pack_start(hbox, False, False)
-            vbox.__page = page
-
+            vbox.__page_class = page_class
             nb.append_page(vbox, icon_img)
 
-            self.__adjusters.append(page)
-            self.__adjusters.append(comparator)
-            self.__adjusters.append(picker)
-
             # Bookmark button writes colours here
             if page_class is palette_class:
-                self.__palette_page = page
                 self.__palette_page_index = page_index
-            page_index += 1
 
         self.__shown = False
         self.connect("show", self.__first_show_cb)
         self.pack_start(nb, True, True)
 
 
+    def __get_page(self, page_num):
+        """Returns the page at an index, building its widgets if needed.
+        """
+        page = self.__pages[page_num]
+        if page is not None:
+            return page
+        vbox = self.__notebook.get_nth_page(page_num)
+        page_class = vbox.__page_class
+        page = page_class()
+        page_table = page.get_page_widget()
+
+        picker = ColorPickerButton()
+        comparator = PreviousCurrentColorAdjuster()
+        bookmark_btn = borderless_button(
+                    icon_name="bookmark-new",
+                    tooltip=_("Add color to Palette"))
+        bookmark_btn.connect("clicked", self.__bookmark_button_clicked_cb)
+        properties_desc = page_class.get_properties_description()
+        if properties_desc is not None:
+            properties_btn = borderless_button(
+                    stock_id=gtk.STOCK_PROPERTIES,
+                    tooltip=properties_desc)
+            properties_btn.connect("clicked",
+                    self.__properties_button_clicked_cb,
+                    page)
+        else:
+            properties_btn = borderless_button(
+                    stock_id=gtk.STOCK_PROPERTIES)
+            properties_btn.set_sensitive(False)
+
+        # Common footer
+        hbox = gtk.HBox()
+        hbox.set_spacing(3)
+        hbox.pack_start(picker, False, False)
+        hbox.pack_start(comparator, True, True)
+        hbox.pack_start(bookmark_btn, False, False)
+        hbox.pack_start(properties_btn, False, False)
+
+        vbox.pack_start(page_table, True, True)
+        vbox.pack_start(hbox, False, False)
+        vbox.show_all()
+
+        self.__pages[page_num] = page
+        manager = self.get_color_manager()
+        for adj in (page, comparator, picker):
+            self.__adjusters.append(adj)
+            if manager is not None:
+                adj.set_color_manager(manager)
+        return page
+
+
     def get_palette_view(self):
         """Returns the palette view adjuster.
         """
-        return self.__palette_page.get_page_widget()
+        page = self.__get_page(self.__palette_page_index)
+        return page.get_page_widget()
 
 
     def show_palette_view(self):
         """Switches to the palette view tab.
         """
+        self.__get_page(self.__palette_page_index)
         self.__notebook.set_current_page(self.__palette_page_index)
 
 
@@ -192,17 +209,19 @@ class CombinedColorAdjuster (gtk.VBox, ColorAdjuster):
         if PREFS_KEY_CURRENT_TAB in prefs:
             prev_tab_icon_name = prefs[PREFS_KEY_CURRENT_TAB]
             for page_num, page_vbox in enumerate(nb):
-                page = page_vbox.__page
-                icon_name = page.get_page_icon_name()
+                page_class = page_vbox.__page_class
+                icon_name = page_class.get_page_icon_name()
                 if icon_name == prev_tab_icon_name:
                     nb.set_current_page(page_num)
                     break
+        self.__get_page(nb.get_current_page())
         nb.connect("switch-page", self.__notebook_switch_page_cb)
 
 
     def __bookmark_button_clicked_cb(self, widget):
         col = self.get_managed_color()
-        self.__palette_page.add_color_to_palette(col)
+        palette_page = self.__get_page(self.__palette_page_index)
+        palette_page.add_color_to_palette(col)
         self.show_palette_view()
 
 
@@ -231,8 +250,8 @@ class CombinedColorAdjuster (gtk.VBox, ColorAdjuster):
                                   page_num):
         page_vbox = notebook.get_nth_page(page_num)
         #  GPointers are not usable in pygtk
-        page = page_vbox.__page
-        icon_name = page.get_page_icon_name()
+        self.__get_page(page_num)
+        icon_name = page_vbox.__page_class.get_page_icon_name()
         prefs = self.get_color_manager()._get_prefs()
         prefs[PREFS_KEY_CURRENT_TAB] = icon_name
 
@@ -364,6 +364,10 @@ class HCYHueChromaWheelMixin:
         col.c = r
         return col
 
+    def get_rgb_array_at_normalized_polar_pos(self, r, theta):
+        col = HCYColor(color=self.get_managed_color())
+        return HCY_to_RGB_array(theta, r, col.y)
+
 
 class HCYHueChromaWheel (MaskableWheelMixin,
                          HCYHueChromaWheelMixin,
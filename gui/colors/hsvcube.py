@@ -13,9 +13,11 @@
 import gtk
 from gtk import gdk
 from gettext import gettext as _
+import numpy
 
 from util import *
 from uicolor import *
+from adjbases import get_cached_gradient
 from adjbases import ColorAdjusterWidget
 from adjbases import ColorAdjuster
 from adjbases import SliderColorAdjuster
@@ -118,6 +120,12 @@ class HSVCubeSlider (SliderColorAdjuster):
         setattr(col, f0, amt)
         return col
 
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HSVColor(color=self.get_managed_color())
+        hsv = dict(h=col.h, s=col.s, v=col.v)
+        hsv[self.__cube._faces[0]] = amts
+        return hsv_to_rgb_array(hsv['h'], hsv['s'], hsv['v'])
+
     def get_bar_amount_for_color(self, col):
         f0 = self.__cube._faces[0]
         amt = getattr(col, f0)
@@ -149,30 +157,29 @@ class HSVCubeSlice (IconRenderableColorAdjusterWidget):
             b = self.border
         eff_wd = int(wd - 2*b)
         eff_ht = int(ht - 2*b)
+        f0 = self.__cube._faces[0]
         f1, f2 = self.__get_faces()
 
-        step = max(1, int(float(eff_wd)/128))
-
         rect_x, rect_y = int(b)+0.5, int(b)+0.5
         rect_w, rect_h = int(eff_wd)-1, int(eff_ht)-1
 
-        # Paint the central area offscreen
-        cr.push_group()
-        for x in xrange(0, eff_wd, step):
-            amt = float(x)/eff_wd
-            amt = 1.0 - amt
-            setattr(col, f1, amt)
-            setattr(col, f2, 1.0)
-            top_luma = max(0.2, 1-col.get_luma())
-            lg = cairo.LinearGradient(b+x, b, b+x, b+eff_ht)
-            lg.add_color_stop_rgb(*([0.0] + list(col.get_rgb())))
-            setattr(col, f2, 0.0)
-            bot_luma = max(0.2, 1-col.get_luma())
-            lg.add_color_stop_rgb(*([1.0] + list(col.get_rgb())))
-            cr.rectangle(b+x, b, step, eff_ht)
-            cr.set_source(lg)
-            cr.fill()
-        slice_patt = cr.pop_group()
+        # The central area: every pixel sampled, as get_color_at_position()
+        # maps them.
+        key = (self.__class__.__name__, eff_wd, eff_ht, f0, f1,
+               int(getattr(col, f0) * 1000))
+        def render():
+            f1_amts = 1.0 - (numpy.arange(eff_wd) + 0.5) / eff_wd
+            f2_amts = 1.0 - (numpy.arange(eff_ht) + 0.5) / eff_ht
+            hsv = dict(h=col.h, s=col.s, v=col.v)
+            hsv[f1] = f1_amts[numpy.newaxis, :]
+            hsv[f2] = f2_amts[:, numpy.newaxis]
+            rgb = hsv_to_rgb_array(hsv['h'], hsv['s'], hsv['v'])
+            return rgb_array_to_surface(rgb)
+        slice_patt = None
+        if eff_wd > 0 and eff_ht > 0:
+            slice_img = get_cached_gradient(key, render)
+            slice_patt = cairo.SurfacePattern(slice_img)
+            slice_patt.set_matrix(cairo.Matrix(x0=-b, y0=-b))
 
         # Tango-like outline
         cr.set_line_join(cairo.LINE_JOIN_ROUND)
@@ -182,8 +189,10 @@ class HSVCubeSlice (IconRenderableColorAdjusterWidget):
         cr.stroke()
 
         # The main area
-        cr.set_source(slice_patt)
-        cr.paint()
+        if slice_patt is not None:
+            cr.rectangle(b, b, eff_wd, eff_ht)
+            cr.set_source(slice_patt)
+            cr.fill()
 
         # Tango-like highlight over the top
         cr.rectangle(rect_x, rect_y, rect_w, rect_h)
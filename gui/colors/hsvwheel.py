@@ -21,6 +21,7 @@ from adjbases import ColorAdjusterWidget
 from adjbases import HueSaturationWheelAdjuster
 from sliders import HSVValueSlider
 from uicolor import HSVColor
+from uicolor import hsv_to_rgb_array
 from util import clamp
 from combined import CombinedAdjusterPage
 
@@ -62,6 +63,11 @@ class HSVHueSaturationWheel (HueSaturationWheelAdjuster):
         return col
 
 
+    def get_rgb_array_at_normalized_polar_pos(self, r, theta):
+        col = HSVColor(color=self.get_managed_color())
+        return hsv_to_rgb_array(theta, r, col.v)
+
+
 class HSVAdjusterPage (CombinedAdjusterPage):
     """Page details for the HSV wheel.
     """
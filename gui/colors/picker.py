@@ -18,15 +18,16 @@ import gobject
 from gettext import gettext as _
 
 from adjbases import ColorAdjuster
-from uicolor import RGBColor
+from uicolor import RGBColor, average_rgb_array
 from uimisc import borderless_button
 
 
-def get_color_at_pointer(display, size=3):
+def get_color_at_pointer(display, size=3, mode='mean'):
     """Returns the colour at the current pointer position.
 
     :param display: the gdk.Display holding the pointer to use
     :param size: integer defining a square over which to sample
+    :param mode: averaging mode, see `uicolor.average_rgb_array()`
     :rtype: `uicolor.RGBColor`.
 
     The colour returned is averaged over a square of `size`x`size` centred at
@@ -52,10 +53,10 @@ def get_color_at_pointer(display, size=3):
         win = screen.get_root_window()
         ptr_x = ptr_x_root
         ptr_y = ptr_y_root
-    return get_color_in_window(win, ptr_x, ptr_y, size)
+    return get_color_in_window(win, ptr_x, ptr_y, size, mode)
 
 
-def get_color_in_window(win, x, y, size=3):
+def get_color_in_window(win, x, y, size=3, mode='mean'):
     """Attempts to get the color from a position within a GDK window.
     """
 
@@ -80,7 +81,31 @@ def get_color_in_window(win, x, y, size=3):
         errcol = RGBColor(1, 0, 0)
         print "warning: failed to get pixbuf from screen; returning", errcol
         return errcol
-    return RGBColor.new_from_pixbuf_average(pixbuf)
+    return RGBColor.new_from_pixbuf_average(pixbuf, mode)
+
+
+def get_color_in_document(doc, x, y, size=3, mode='mean', layers='all'):
+    """Returns the colour of a document's rendered image at a point.
+
+    :param doc: the `lib.document.Document` to sample
+    :param x: model X coordinate of the centre
+    :param y: model Y coordinate of the centre
+    :param size: diameter of the sampled area, in model pixels
+    :param mode: averaging mode, see `uicolor.average_rgb_array()`
+    :param layers: which layers to sample, see `Document.pick_color()`
+    :rtype: `uicolor.RGBColor`, or None if the area is fully transparent.
+
+    Only the tiles under the sampled area are composited, straight from the
+    document's layers. Unlike `get_color_at_pointer()`, this needs no
+    round trip to the display server, and is unaffected by the view's zoom,
+    rotation and overlays.
+
+    """
+    rgb, alpha = doc.get_pick_samples(x, y, size/2.0, layers)
+    avg = average_rgb_array(rgb, alpha, mode)
+    if avg is None:
+        return None
+    return RGBColor(rgb=avg)
 
 
 class ColorPickerButton (gtk.EventBox, ColorAdjuster):
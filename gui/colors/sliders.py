@@ -144,6 +144,9 @@ class RGBRedSlider (SliderColorAdjuster):
         col = RGBColor(color=self.get_managed_color())
         col.r = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        r, g, b = self.get_managed_color().get_rgb()
+        return stack_rgb_arrays(amts, g, b)
     def get_bar_amount_for_color(self, col):
         return col.r
 
@@ -157,6 +160,9 @@ class RGBGreenSlider (SliderColorAdjuster):
         col = RGBColor(color=self.get_managed_color())
         col.g = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        r, g, b = self.get_managed_color().get_rgb()
+        return stack_rgb_arrays(r, amts, b)
     def get_bar_amount_for_color(self, col):
         return col.g
 
@@ -170,6 +176,9 @@ class RGBBlueSlider (SliderColorAdjuster):
         col = RGBColor(color=self.get_managed_color())
         col.b = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        r, g, b = self.get_managed_color().get_rgb()
+        return stack_rgb_arrays(r, g, amts)
     def get_bar_amount_for_color(self, col):
         return col.b
 
@@ -181,6 +190,9 @@ class HSVHueSlider (SliderColorAdjuster):
         col = HSVColor(color=self.get_managed_color())
         col.h = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HSVColor(color=self.get_managed_color())
+        return hsv_to_rgb_array(amts, col.s, col.v)
     def get_bar_amount_for_color(self, col):
         return col.h
 
@@ -190,6 +202,9 @@ class HSVSaturationSlider (SliderColorAdjuster):
         col = HSVColor(color=self.get_managed_color())
         col.s = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HSVColor(color=self.get_managed_color())
+        return hsv_to_rgb_array(col.h, amts, col.v)
     def get_bar_amount_for_color(self, col):
         return col.s
 
@@ -199,6 +214,9 @@ class HSVValueSlider (SliderColorAdjuster):
         col = HSVColor(color=self.get_managed_color())
         col.v = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HSVColor(color=self.get_managed_color())
+        return hsv_to_rgb_array(col.h, col.s, amts)
     def get_bar_amount_for_color(self, col):
         return col.v
 
@@ -210,6 +228,9 @@ class HCYHueSlider (SliderColorAdjuster):
         col = HCYColor(color=self.get_managed_color())
         col.h = amt
         return col
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HCYColor(color=self.get_managed_color())
+        return HCY_to_RGB_array(amts, col.c, col.y)
     def get_bar_amount_for_color(self, col):
         col = HCYColor(color=col)
         return col.h
@@ -222,6 +243,10 @@ class HCYChromaSlider (SliderColorAdjuster):
         col.c = amt
         return col
 
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HCYColor(color=self.get_managed_color())
+        return HCY_to_RGB_array(col.h, amts, col.y)
+
     def get_bar_amount_for_color(self, col):
         col = HCYColor(color=col)
         return col.c
@@ -241,6 +266,10 @@ class HCYLumaSlider (SliderColorAdjuster):
         col.y = amt
         return col
 
+    def get_rgb_array_for_bar_amounts(self, amts):
+        col = HCYColor(color=self.get_managed_color())
+        return HCY_to_RGB_array(col.h, col.c, amts)
+
     def get_bar_amount_for_color(self, col):
         col = HCYColor(color=col)
         return col.y
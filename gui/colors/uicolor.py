@@ -24,10 +24,13 @@ import re
 from colorsys import *
 import struct
 
+import numpy
+
 import gtk
 from gtk import gdk
 
 from util import clamp
+from lib.helpers import gdkpixbuf2numpy
 
 
 ##
@@ -306,8 +309,13 @@ class UIColor (object):
 
 
     @classmethod
-    def new_from_pixbuf_average(class_, pixbuf):
-        """Returns the the average of all colours in a pixbuf."""
+    def new_from_pixbuf_average(class_, pixbuf, mode='mean'):
+        """Returns the the average of all colours in a pixbuf.
+
+        Pixels are weighted by their alpha, if the pixbuf has any. See
+        `average_rgb_array()` for the meaning of `mode`.
+
+        """
         assert pixbuf.get_colorspace() == gdk.COLORSPACE_RGB
         assert pixbuf.get_bits_per_sample() == 8
         n_channels = pixbuf.get_n_channels()
@@ -316,21 +324,16 @@ class UIColor (object):
             assert not pixbuf.get_has_alpha()
         else:
             assert pixbuf.get_has_alpha()
-        data = pixbuf.get_pixels()
-        w, h = pixbuf.get_width(), pixbuf.get_height()
-        rowstride = pixbuf.get_rowstride()
-        n_pixels = w*h
-        r = g = b = 0
-        for y in xrange(h):
-            for x in xrange(w):
-                offs = y*rowstride + x*n_channels
-                r += ord(data[offs])
-                g += ord(data[offs+1])
-                b += ord(data[offs+2])
-        r = float(r) / n_pixels
-        g = float(g) / n_pixels
-        b = float(b) / n_pixels
-        return RGBColor(r/255, g/255, b/255)
+        arr = gdkpixbuf2numpy(pixbuf)
+        rgb = arr[..., :3] / 255.0
+        alpha = None
+        if n_channels == 4:
+            alpha = arr[..., 3] / 255.0
+        avg = average_rgb_array(rgb, alpha, mode)
+        if avg is None:
+            # Entirely transparent: average the colour channels as they are
+            avg = average_rgb_array(rgb, None, mode)
+        return RGBColor(rgb=avg)
 
 
 class RGBColor (UIColor):
@@ -908,6 +911,143 @@ def HCY_to_RGB(hcy):
     return r_, g_, b_
 
 
+## Vectorized conversions.
+
+# These take NumPy arrays (or scalars, which are broadcast) for each input
+# component, and return float arrays with a trailing axis holding R, G and B.
+# They are used for rendering the backgrounds of adjusters in one go.
+
+def stack_rgb_arrays(r, g, b):
+    """Stacks component arrays into an array of RGB triples.
+
+      >>> stack_rgb_arrays([0.1, 0.2], 0.5, 1).tolist()
+      [[0.1, 0.5, 1.0], [0.2, 0.5, 1.0]]
+    """
+    r, g, b = numpy.broadcast_arrays(r, g, b)
+    rgb = numpy.empty(r.shape + (3,), dtype='float')
+    rgb[..., 0] = r
+    rgb[..., 1] = g
+    rgb[..., 2] = b
+    return rgb
+
+
+def hsv_to_rgb_array(h, s, v):
+    """Vectorized `colorsys.hsv_to_rgb()`.
+
+      >>> hsv_to_rgb_array([0.0, 0.5], 1.0, 1.0).tolist()
+      [[1.0, 0.0, 0.0], [0.0, 1.0, 1.0]]
+    """
+    h, s, v = numpy.broadcast_arrays(*[numpy.asarray(c, dtype='float')
+                                       for c in (h, s, v)])
+    h6 = (h % 1.0) * 6.0
+    i = numpy.floor(h6)
+    f = h6 - i
+    i = i.astype('int') % 6
+    p = v * (1.0 - s)
+    q = v * (1.0 - s*f)
+    t = v * (1.0 - s*(1.0 - f))
+    r = numpy.choose(i, [v, q, p, p, t, v])
+    g = numpy.choose(i, [t, v, v, q, p, p])
+    b = numpy.choose(i, [p, p, t, v, v, q])
+    return stack_rgb_arrays(r, g, b)
+
+
+def HCY_to_RGB_array(h, c, y):
+    """Vectorized `HCY_to_RGB()`.
+
+      >>> rgb = HCY_to_RGB_array([0.3, 0.9], 0.5, 0.4)
+      >>> numpy.allclose(rgb[0], HCY_to_RGB((0.3, 0.5, 0.4)))
+      True
+      >>> numpy.allclose(rgb[1], HCY_to_RGB((0.9, 0.5, 0.4)))
+      True
+    """
+    h, c, y = numpy.broadcast_arrays(*[numpy.asarray(x, dtype='float')
+                                       for x in (h, c, y)])
+    r_weight = _SVGFX_RED_WEIGHT
+    g_weight = _SVGFX_GREEN_WEIGHT
+    b_weight = _SVGFX_BLUE_WEIGHT
+
+    h6 = (h % 1.0) * 6.0
+    H_sec = numpy.floor(h6).astype('int') % 6
+    H_insec = h6 - numpy.floor(h6)
+    H2 = h6 - (H_sec // 2) * 2
+
+    # Luma of the most saturated colour of each hue
+    peak_start = numpy.array([r_weight, 1-b_weight, g_weight,
+                              1-r_weight, b_weight, 1-g_weight])
+    peak_end = numpy.array([1-b_weight, g_weight, 1-r_weight,
+                            b_weight, 1-g_weight, r_weight])
+    Y_peak = peak_start[H_sec] + H_insec * (peak_end[H_sec] - peak_start[H_sec])
+    c = numpy.where(y < Y_peak, c * y / Y_peak, c * (1.0 - y) / (1.0 - Y_peak))
+
+    X = c * (1.0 - numpy.abs(H2 - 1.0))
+    r = numpy.choose(H_sec, [c, X, 0, 0, X, c])
+    g = numpy.choose(H_sec, [X, c, c, X, 0, 0])
+    b = numpy.choose(H_sec, [0, 0, X, c, c, X])
+
+    m = y - (r_weight * r + g_weight * g + b_weight * b)
+    return stack_rgb_arrays(r + m, g + m, b + m)
+
+
+#: Ways of reducing an area of pixels to one colour.
+#: See `average_rgb_array()`.
+AVERAGE_MODES = ('mean', 'median', 'dominant')
+
+#: Levels per channel used for finding the dominant colour
+_DOMINANT_LEVELS = 16
+
+
+def average_rgb_array(rgb, weights=None, mode='mean'):
+    """Reduces an array of RGB triples to a single colour.
+
+    :param rgb: array of shape (..., 3), straight colour in 0.0 to 1.0
+    :param weights: optional per-pixel weights, typically alpha
+    :param mode: one of `AVERAGE_MODES`
+    :returns: an ``(r, g, b)`` tuple, or None if no pixel has any weight
+
+    The "mean" is the weighted mean, and the "median" is taken per channel.
+    The "dominant" colour is the mean of the most heavily weighted bucket
+    after quantizing each channel to a few levels, which ignores
+    antialiasing and stray pixels at the edge of a stroke.
+
+      >>> average_rgb_array([[1, 0, 0], [0, 0, 1]], [3, 1])
+      (0.75, 0.0, 0.25)
+      >>> average_rgb_array([[.1, 0, 0], [.5, 0, 0], [.9, 1, 1]], mode='median')
+      (0.5, 0.0, 0.0)
+      >>> average_rgb_array([[1, 0, 0], [0, 0, 1], [1, 0, .02]], mode='dominant')
+      (1.0, 0.0, 0.01)
+      >>> average_rgb_array([[1, 0, 0]], [0]) is None
+      True
+    """
+    assert mode in AVERAGE_MODES
+    rgb = numpy.asarray(rgb, dtype='float').reshape(-1, 3)
+    if weights is None:
+        weights = numpy.ones(len(rgb))
+    else:
+        weights = numpy.asarray(weights, dtype='float').reshape(-1)
+    if not weights.sum() > 0:
+        return None
+    if mode == 'median':
+        return tuple(float(_weighted_median(rgb[:, i], weights))
+                     for i in xrange(3))
+    if mode == 'dominant':
+        n = _DOMINANT_LEVELS
+        q = numpy.clip((rgb * n).astype('int'), 0, n-1)
+        buckets = (q[:, 0] * n + q[:, 1]) * n + q[:, 2]
+        selected = buckets == numpy.bincount(buckets, weights).argmax()
+        rgb = rgb[selected]
+        weights = weights[selected]
+    mean = (rgb * weights[:, numpy.newaxis]).sum(axis=0) / weights.sum()
+    return tuple(float(c) for c in mean)
+
+
+def _weighted_median(values, weights):
+    order = numpy.argsort(values)
+    cumulative = numpy.cumsum(weights[order])
+    i = numpy.searchsorted(cumulative, cumulative[-1] / 2.0)
+    return values[order][i]
+
+
 ## Improved HLS colour space.
 
 # Pretty much HCY without the cylindrical expansion.
@@ -13,6 +13,8 @@
 import cairo
 import math
 
+import numpy
+
 
 def clamp(v, bottom, top):
     """Returns `v`, clamped to within a particular range.
@@ -53,3 +55,25 @@ def draw_marker_circle(cr, x, y, size=2):
     cr.stroke()
     cr.restore()
 
+
+def rgb_array_to_surface(rgb, alpha=None):
+    """Converts an array of RGB triples to a Cairo image surface.
+
+    The components of `rgb`, an array of shape ``(height, width, 3)``, and
+    of the optional `alpha` array of shape ``(height, width)``, are floats
+    in the range 0 to 1. The surface keeps a reference to its pixels.
+    """
+    ht, wd = rgb.shape[:2]
+    rgb = numpy.clip(rgb, 0.0, 1.0)
+    if alpha is None:
+        alpha = numpy.ones((ht, wd))
+    else:
+        alpha = numpy.clip(alpha, 0.0, 1.0)
+        rgb = rgb * alpha[..., numpy.newaxis]  # premultiply
+    a = (alpha * 255 + 0.5).astype('uint32')
+    rgb = (rgb * 255 + 0.5).astype('uint32')
+    # FORMAT_ARGB32 pixels are native-endian 32-bit words
+    pixels = (a << 24) | (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+    pixels = numpy.ascontiguousarray(pixels, dtype='uint32')
+    return cairo.ImageSurface.create_for_data(pixels, cairo.FORMAT_ARGB32,
+                                              wd, ht, wd*4)
@@ -18,7 +18,7 @@ from gtk import gdk
 from gettext import gettext as _
 
 import lib.document
-from lib import command, helpers, layer, tiledsurface
+from lib import command, helpers, layer, tiledsurface, brush
 import tileddrawwidget, stategroup
 from brushmanager import ManagedBrush
 import dialogs
@@ -127,6 +127,31 @@ class CanvasController (object):
 
 
 
+class ClipboardContents:
+    """Layer pixels copied to the clipboard by MyPaint.
+
+    The copy is a snapshot of the layer's readonly tiles, which are shared
+    rather than duplicated, so copying and pasting a large layer within
+    MyPaint costs no pixel copies. An 8-bit pixbuf is only rendered when
+    another application asks for the data.
+
+    """
+
+    def __init__(self, sshot, bbox):
+        self.snapshot = sshot   #: See `tiledsurface.Surface.save_snapshot()`
+        self.bbox = bbox        #: Document bbox at the time of copying
+        self._pixbuf = None
+
+    def get_pixbuf(self):
+        """Renders the copied pixels as a pixbuf covering `bbox`."""
+        if self._pixbuf is None:
+            s = tiledsurface.Surface()
+            s.load_snapshot(self.snapshot)
+            self._pixbuf = s.render_as_pixbuf(*self.bbox)
+        return self._pixbuf
+
+
+
 class Document (CanvasController):
     """Manipulation of a loaded document via the the GUI.
 
@@ -145,6 +170,10 @@ class Document (CanvasController):
     # Layers have this attr set temporarily if they don't have a name yet
     _NONAME_LAYER_REFNUM_ATTR = "_document_noname_ref_number"
 
+    # What this process last put on the clipboard, while it still owns it.
+    # Shared by all documents so the scratchpad can paste into the canvas.
+    _clipboard_contents = None
+
 
     def __init__(self, app, leader=None):
         self.app = app
@@ -341,13 +370,40 @@ class Document (CanvasController):
         if bbox.w == 0 or bbox.h == 0:
             print "WARNING: empty document, nothing copied"
             return
-        else:
-            pixbuf = self.model.layer.render_as_pixbuf(*bbox)
+        sshot = self.model.layer.save_surface_snapshot()
+        contents = ClipboardContents(sshot, bbox)
         cb = self._get_clipboard()
-        cb.set_image(pixbuf)
+        if pygtkcompat.USE_GTK3:
+            # set_with_data() is not usable through introspection
+            cb.set_image(contents.get_pixbuf())
+            return
+        targets = gtk.target_list_add_image_targets(info=0, writable=True)
+        if cb.set_with_data(targets, self._clipboard_get_cb,
+                            self._clipboard_clear_cb, contents):
+            Document._clipboard_contents = contents
+
+
+    @staticmethod
+    def _clipboard_get_cb(clipboard, selection_data, info, contents):
+        # Another application wants the data: only now render the pixels
+        selection_data.set_pixbuf(contents.get_pixbuf())
+
+
+    @staticmethod
+    def _clipboard_clear_cb(clipboard, contents):
+        if Document._clipboard_contents is contents:
+            Document._clipboard_contents = None
 
 
     def paste_cb(self, action):
+        contents = Document._clipboard_contents
+        if contents is not None:
+            # Copied by us: share the tiles. Like an external image, the
+            # copied bbox goes to the upper left of our doc bbox.
+            x, y, w, h = self.model.get_bbox()
+            self.model.load_layer_from_surface_snapshot(
+                    contents.snapshot, x - contents.bbox.x, y - contents.bbox.y)
+            return
         cb = self._get_clipboard()
         def callback(clipboard, pixbuf, junk):
             if not pixbuf:
@@ -392,7 +448,8 @@ class Document (CanvasController):
 
     def restore_brush_from_stroke_info(self, strokeinfo):
         mb = ManagedBrush(self.app.brushmanager)
-        mb.brushinfo.load_from_string(strokeinfo.brush_string)
+        cached = brush.brush_cache.get_brushinfo(strokeinfo.brush_string)
+        mb.brushinfo.load_from_brushinfo(cached)
         self.app.brushmanager.select_brush(mb)
         self.app.brushmodifier.restore_context_of_selected_brush()
 
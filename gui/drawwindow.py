@@ -17,7 +17,6 @@ MYPAINT_VERSION="1.1.0+git"
 
 import os
 import time
-import webbrowser
 from warnings import warn
 from gettext import gettext as _
 
@@ -26,16 +25,13 @@ from gtk import gdk, keysyms
 
 import colorselectionwindow, historypopup, stategroup, windowing, layout, toolbar
 import dialogs
-from lib import helpers
+from lib import helpers, tiledsurface
 import canvasevent
 from colors import RGBColor
 
 import pygtkcompat
 import xml.etree.ElementTree as ET
 
-# palette support
-from lib.scratchpad_palette import GimpPalette, hatch_squiggle, squiggle, draw_palette
-
 from overlays import LastPaintPosOverlay, ScaleOverlay
 from symmetry import SymmetryOverlay
 
@@ -292,6 +288,15 @@ class Window (windowing.MainWindow, layout.MainWindow):
     def print_memory_leak_cb(self, action):
         helpers.record_memory_leak_status(print_diff = True)
 
+    def print_tile_pool_stats_cb(self, action):
+        pool = tiledsurface.tile_pool
+        if pool is None:
+            print 'Tile deduplication is disabled (run with MYPAINT_TILE_POOL=1)'
+            return
+        stats = pool.get_stats()
+        print 'Tile pool: %(pooled)d tiles pooled, %(interned)d interned,' \
+              ' %(hits)d duplicates, dedup ratio %(dedup_ratio).2f' % stats
+
     def run_garbage_collector_cb(self, action):
         helpers.run_garbage_collector()
 
@@ -726,6 +731,7 @@ class Window (windowing.MainWindow, layout.MainWindow):
             self.app.scratchpad_doc.model.set_background(bg)
 
     def draw_palette_cb(self, action):
+        from lib.scratchpad_palette import GimpPalette, hatch_squiggle, draw_palette
         # test functionality:
         file_filters = [
         (_("Gimp Palette Format"), ("*.gpl",)),
@@ -751,6 +757,7 @@ class Window (windowing.MainWindow, layout.MainWindow):
             dialog.destroy()
 
     def draw_sat_spectrum_cb(self, action):
+        from lib.scratchpad_palette import GimpPalette, draw_palette
         g = GimpPalette()
         hsv = self.app.brush.get_color_hsv()
         g.append_sat_spectrum(hsv)
@@ -785,6 +792,7 @@ class Window (windowing.MainWindow, layout.MainWindow):
         if not self.app.filehandler.confirm_destructive_action(title=_('Quit'), question=_('Really Quit?')):
             return True
 
+        self.app.journal.remove()
         gtk.main_quit()
         return False
 
@@ -806,6 +814,7 @@ class Window (windowing.MainWindow, layout.MainWindow):
     def download_brush_pack_cb(self, *junk):
         url = 'http://wiki.mypaint.info/index.php?title=Brush_Packages/redirect_mypaint_1.1_gui'
         print 'URL:', url
+        import webbrowser
         webbrowser.open(url)
 
     def import_brush_pack_cb(self, *junk):
@@ -14,7 +14,7 @@ import gtk
 from gettext import gettext as _
 from gettext import ngettext
 
-from lib import document, helpers, tiledsurface
+from lib import document, helpers, tiledsurface, journal, thumbnails
 import drawwindow
 import pygtkcompat
 
@@ -74,6 +74,7 @@ class FileHandler(object):
         self.file_opened_observers = []
         self.active_scrap_filename = None
         self.lastsavefailed = False
+        self.thumbnails = thumbnails.ThumbnailService()
         self.set_recent_items()
 
         self.file_filters = [ #(name, patterns)
@@ -217,6 +218,7 @@ class FileHandler(object):
         self.set_recent_items()
         self.app.doc.reset_view(True, True, True)
         self.app.doc.clear_saved_view()
+        self.app.journal.start()
 
     @staticmethod
     def gtk_main_tick():
@@ -228,12 +230,15 @@ class FileHandler(object):
 
     @drawwindow.with_wait_cursor
     def open_file(self, filename):
+        self.app.journal.stop() # don't journal the loading itself
         try:
             self.doc.model.load(filename, feedback_cb=self.gtk_main_tick)
         except document.SaveLoadError, e:
             self.app.message_dialog(str(e),type=gtk.MESSAGE_ERROR)
+            self.app.journal.start()
         else:
             self.filename = os.path.abspath(filename)
+            self.app.journal.start(self.filename)
             for func in self.file_opened_observers:
                 func(self.filename)
             print 'Loaded from', self.filename
@@ -244,6 +249,42 @@ class FileHandler(object):
             if si:
                 self.doc.restore_brush_from_stroke_info(si)
 
+    def recover_from_journal(self):
+        """Offers to recover unsaved painting after a crash.
+
+        Returns True if the document was restored from the crash recovery
+        journal, which then continues from a checkpoint of the result.
+
+        """
+        if not self.app.journal.is_recoverable():
+            return False
+        d = gtk.MessageDialog(self.app.drawWindow, gtk.DIALOG_MODAL,
+                              gtk.MESSAGE_QUESTION, gtk.BUTTONS_NONE)
+        d.set_markup("<b>%s</b>" % _('Recover unsaved painting?'))
+        d.format_secondary_text(_('MyPaint was not closed properly. The '
+                                  'painting of the last session can be '
+                                  'restored from the recovery journal.'))
+        b = d.add_button(gtk.STOCK_DISCARD, gtk.RESPONSE_CANCEL)
+        b.set_image(gtk.image_new_from_stock(gtk.STOCK_DELETE, gtk.ICON_SIZE_BUTTON))
+        d.add_button(_("_Recover"), gtk.RESPONSE_OK)
+        d.set_default_response(gtk.RESPONSE_OK)
+        response = d.run()
+        d.destroy()
+        if response != gtk.RESPONSE_OK:
+            return False
+        try:
+            filename = self.app.journal.recover(feedback_cb=self.gtk_main_tick)
+        except (journal.JournalError, document.SaveLoadError), e:
+            self.app.message_dialog(_('Unable to recover: %s') % str(e),
+                                    type=gtk.MESSAGE_ERROR)
+            self.doc.model.clear()
+            return False
+        self.filename = filename
+        self.app.doc.reset_view(True, True, True)
+        self.app.doc.clear_saved_view()
+        self.app.journal.compact()
+        return True
+
     def open_scratchpad(self, filename):
         try:
             self.app.scratchpad_doc.model.load(filename, feedback_cb=self.gtk_main_tick)
@@ -268,6 +309,8 @@ class FileHandler(object):
             return
         if not export:
             self.filename = os.path.abspath(filename)
+            if not self.lastsavefailed:
+                self.app.journal.document_saved(self.filename)
             recent_mgr = pygtkcompat.gtk.recent_manager_get_default()
             uri = helpers.filename2uri(self.filename)
             recent_data = dict(app_name='mypaint',
@@ -282,7 +325,7 @@ class FileHandler(object):
                 recent_mgr.add_full(uri, recent_data)
         if not thumbnail_pixbuf:
             thumbnail_pixbuf = self.doc.model.render_thumbnail()
-        helpers.freedesktop_thumbnail(filename, thumbnail_pixbuf)
+        self.thumbnails.store(filename, thumbnail_pixbuf)
 
     @drawwindow.with_wait_cursor
     def save_scratchpad(self, filename, export=False, **options):
@@ -318,9 +361,13 @@ class FileHandler(object):
 
     def update_preview_cb(self, file_chooser, preview):
         filename = file_chooser.get_preview_filename()
-        if filename:
-            filename = filename.decode('utf-8')
-            pixbuf = helpers.freedesktop_thumbnail(filename)
+        if not filename:
+            return
+        filename = filename.decode('utf-8')
+
+        def thumbnail_cb(thumb_filename, pixbuf):
+            if thumb_filename != preview.preview_filename:
+                return # the selection has changed meanwhile
             if pixbuf:
                 # if pixbuf is smaller than 256px in width, copy it onto a transparent 256x256 pixbuf
                 pixbuf = helpers.pixbuf_thumbnail(pixbuf, 256, 256, True)
@@ -330,6 +377,14 @@ class FileHandler(object):
                 #TODO display "no preview available" image
                 pass
 
+        if getattr(preview, 'preview_filename', None) is None:
+            # first request for this dialog's preview
+            preview.connect('destroy', self.thumbnails.cancel)
+        preview.preview_filename = filename
+        # thumbnails are loaded in the background; the preview group makes
+        # fast scrolling through a folder only load the latest selection
+        self.thumbnails.request(filename, thumbnail_cb, group=preview)
+
     def get_open_dialog(self, filename=None, start_in_folder=None, file_filters=[]):
         dialog = gtk.FileChooserDialog(_("Open..."), self.app.drawWindow,
                                        gtk.FILE_CHOOSER_ACTION_OPEN,
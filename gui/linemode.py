@@ -15,6 +15,7 @@ from gettext import gettext as _
 import gobject
 
 import canvasevent
+from lib import layer
 
 # internal name, displayed name, constant, minimum, default, maximum, tooltip
 line_mode_settings_list = [
@@ -25,6 +26,10 @@ line_mode_settings_list = [
     ['line_tail', _('Tail'), False, 0.0001, 0.75, 1.0, _("Stroke trail-off beginning")],
     ]
 
+#: Brush settings which make dabs depend on the pixels already on the layer.
+#: Any use of them, however small, rules out previewing in an empty overlay.
+PIXEL_DEPENDENT_SETTINGS = ['eraser', 'smudge', 'lock_alpha', 'colorize']
+
 
 class LineModeSettings:
     """Manage GtkAdjustments for tweaking LineMode settings.
@@ -133,6 +138,7 @@ class LineModeBase (canvasevent.SwitchableModeMixin,
         self.last_line_data = None
         self.idle_srcid = None
         self._line_possible = False
+        self.preview_layer = None
 
 
     ##
@@ -221,6 +227,7 @@ class LineModeBase (canvasevent.SwitchableModeMixin,
         self.done = False
         self.model.split_stroke() # split stroke here
         self.snapshot = self.model.layer.save_snapshot()
+        self.start_preview()
 
         x, y, kbmods = self.local_mouse_state()
         # ignore the modifier used to start this action (don't make it change the action)
@@ -283,12 +290,49 @@ class LineModeBase (canvasevent.SwitchableModeMixin,
             else:
                 self.sx, self.sy = self.tdw.last_painting_pos
 
+    def start_preview(self):
+        """Starts drawing provisional shapes into a temporary overlay layer.
+
+        The overlay is shown above the current layer, so each update only
+        redraws the area which the old and new shapes cover, and the
+        document's layer is left alone until `stop_command()` draws the
+        final stroke. Brushes which interact with the pixels already on the
+        layer still draw their provisional shapes into it directly.
+
+        """
+        info = self.model.brush.brushinfo
+        for cname in PIXEL_DEPENDENT_SETTINGS:
+            if info.get_base_value(cname) > 0 or not info.has_only_base_value(cname):
+                return
+        current = self.model.layer
+        preview = layer.Layer()
+        preview.opacity = current.opacity
+        preview.compositeop = current.compositeop
+        preview.set_symmetry_axis(self.model.get_symmetry_axis())
+        preview.content_observers.append(self.tdw.renderer.canvas_modified_cb)
+        self.preview_layer = preview
+        self.tdw.overlay_layer = preview
+
+    def stop_preview(self):
+        """Removes the overlay layer, if any, from the canvas."""
+        if self.preview_layer is None:
+            return
+        self.tdw.overlay_layer = None
+        self._clear_preview()
+        self.preview_layer = None
+
+    def _clear_preview(self):
+        # Clearing an empty layer would announce a full redraw
+        if not self.preview_layer.is_empty():
+            self.preview_layer.clear()
+
     def update_position(self, x, y):
         self.lx, self.ly = self.tdw.display_to_model(x, y)
 
     def stop_command(self):
     # End mode
         self.done = True
+        self.stop_preview()
         x, y = self.process_line()
         self.model.split_stroke()
         cmd = self.mode
@@ -529,7 +573,10 @@ class LineModeBase (canvasevent.SwitchableModeMixin,
         brush = self.model.brush
         if not self.done:
             # stroke without setting undo
-            self.model.layer.stroke_to(brush, x, y, pressure, 0.0, 0.0, duration)
+            target = self.preview_layer
+            if target is None:
+                target = self.model.layer
+            target.stroke_to(brush, x, y, pressure, 0.0, 0.0, duration)
         else:
             self.model.stroke_to(duration, x, y, pressure, 0.0, 0.0)
 
@@ -537,6 +584,12 @@ class LineModeBase (canvasevent.SwitchableModeMixin,
         # Send brush to where the stroke will begin
         self.model.brush.reset()
         brush = self.model.brush
+        if not self.done and self.preview_layer is not None:
+            # Only the overlay needs to be wiped; the layer is untouched
+            self._clear_preview()
+            self.preview_layer.stroke_to(brush, sx, sy, 0.0, 0.0, 0.0, 10.0)
+            self._clear_preview()
+            return
         self.model.layer.stroke_to(brush, sx, sy, 0.0, 0.0, 0.0, 10.0)
         self.model.layer.load_snapshot(self.snapshot)
 
@@ -49,6 +49,10 @@ def main(datadir, extradata, default_confpath):
     def run():
         print 'confpath =', options.config
 
+        # Python threads (e.g. the crash recovery journal writer) must be
+        # able to run while the main loop waits for events.
+        gobject.threads_init()
+
         app = application.Application(datadir, extradata, options.config, args)
         if options.fullscreen:
             def f():
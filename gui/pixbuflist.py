@@ -108,6 +108,8 @@ class PixbufList(gtk.DrawingArea):
         self.item_w = item_w
         self.item_h = item_h
         self.thumbnails = {}
+        self.cells = [] # thumbnail currently composited into each cell
+        self.layout = None
 
     def motion_notify_cb(self, widget, event):
         over_item = False
@@ -204,7 +206,12 @@ class PixbufList(gtk.DrawingArea):
 
     def update(self, width = None, height = None):
         """
-        Redraws the widget from scratch.
+        Redraws the cells of the widget whose thumbnail changed.
+
+        The cell pixbuf is reused while the number of columns stays the
+        same, so adding, removing or reordering a few items, or a resize
+        which does not change the layout, only re-composites the cells
+        affected.
         """
         self.total_border = self.border_visible + self.spacing_inside + self.spacing_outside
         self.total_w = self.item_w + 2*self.total_border
@@ -215,29 +222,63 @@ class PixbufList(gtk.DrawingArea):
             width = self.pixbuf.get_width()
             height = self.pixbuf.get_height()
         width = max(width, self.total_w)
-        self.tiles_w = max(1, int( width / self.total_w ))
-        self.tiles_h = max(1, int( ceil( float(len(self.itemlist)) / self.tiles_w ) ))
+        tiles_w = max(1, int( width / self.total_w ))
+        self.tiles_h = max(1, int( ceil( float(len(self.itemlist)) / tiles_w ) ))
 
         height = self.tiles_h * self.total_h
         self.set_size_request(self.total_w, height)
 
-        self.pixbuf = pygtkcompat.gdk.pixbuf.new(gdk.COLORSPACE_RGB, True,
-                                                 8, width, height)
-        self.pixbuf.fill(0xffffff00) # transparent
+        old = self.pixbuf
+        layout = (width, tiles_w, self.total_w, self.total_h)
+        if old is None or layout != self.layout:
+            self.cells = []
+            old = None
+        self.layout = layout
+        self.tiles_w = tiles_w
+        if old is None or old.get_height() != height:
+            self.pixbuf = pygtkcompat.gdk.pixbuf.new(gdk.COLORSPACE_RGB, True,
+                                                     8, width, height)
+            self.pixbuf.fill(0xffffff00) # transparent
+            if old is not None:
+                h = min(height, old.get_height())
+                old.copy_area(0, 0, width, h, self.pixbuf, 0, 0)
+                del self.cells[self.tiles_h*self.tiles_w:]
+
+        thumbnails = {}
+        cells = []
         for i, item in enumerate(self.itemlist):
-            x = (i % self.tiles_w) * self.total_w
-            y = (i / self.tiles_w) * self.total_h
-            x += self.total_border
-            y += self.total_border
-
             pixbuf = self.pixbuffunc(item)
-            if pixbuf not in self.thumbnails:
-                self.thumbnails[pixbuf] = helpers.pixbuf_thumbnail(pixbuf, self.item_w, self.item_h)
-            pixbuf = self.thumbnails[pixbuf]
-            pixbuf.composite(self.pixbuf, x, y, self.item_w, self.item_h, x, y, 1, 1, gdk.INTERP_BILINEAR, 255)
+            thumbnail = self.thumbnails.get(pixbuf)
+            if thumbnail is None:
+                thumbnail = helpers.pixbuf_thumbnail(pixbuf, self.item_w, self.item_h)
+            thumbnails[pixbuf] = thumbnail
+            cells.append(thumbnail)
+            if i < len(self.cells) and self.cells[i] is thumbnail:
+                continue
+            x, y = self.get_cell_position(i)
+            if i < len(self.cells):
+                self.clear_cell(x, y)
+            thumbnail.composite(self.pixbuf, x, y, self.item_w, self.item_h, x, y, 1, 1, gdk.INTERP_BILINEAR, 255)
+        for i in xrange(len(cells), len(self.cells)):
+            x, y = self.get_cell_position(i)
+            self.clear_cell(x, y)
+        self.cells = cells
+        self.thumbnails = thumbnails
 
         self.queue_draw()
 
+    def get_cell_position(self, i):
+        x = (i % self.tiles_w) * self.total_w + self.total_border
+        y = (i / self.tiles_w) * self.total_h + self.total_border
+        return x, y
+
+    def clear_cell(self, x, y):
+        if pygtkcompat.USE_GTK3:
+            cell = self.pixbuf.new_subpixbuf(x, y, self.item_w, self.item_h)
+        else:
+            cell = self.pixbuf.subpixbuf(x, y, self.item_w, self.item_h)
+        cell.fill(0xffffff00) # transparent
+
     def set_selected(self, item):
         self.selected = item
         self.queue_draw()
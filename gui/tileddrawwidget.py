@@ -14,14 +14,23 @@ from gtk import gdk
 
 import os
 import random
-from math import floor, ceil, log, exp
+import time
+from math import floor, ceil, log, exp, hypot
 from numpy import isfinite
 from warnings import warn
 import weakref
 
-from lib import helpers, tiledsurface, pixbufsurface
+from lib import helpers, tiledsurface, pixbufsurface, mypaintlib
 import cursor
 
+#: Canvas modifications are collected and redrawn at most this often,
+#: about once per frame at 60 Hz.
+REDRAW_INTERVAL_MS = 16
+
+#: Modified areas covering more visible tiles than this, like layer-wide
+#: changes, are invalidated as one area instead of tile by tile.
+MAX_DIRTY_TILES = 64
+
 def _make_testbed_model():
     warn("Creating standalone model for testing", RuntimeWarning, 2)
     import lib.brush, lib.document
@@ -436,6 +445,13 @@ class DrawCursorMixin:
 
 
 
+def device_clip_extents(cr):
+    cr.save()
+    cr.identity_matrix()
+    extents = cr.clip_extents()
+    cr.restore()
+    return extents
+
 def tile_is_visible(cr, tx, ty, clip_region, sparse, translation_only):
     if not sparse:
         return True
@@ -515,6 +531,11 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
         self.model_overlays = []
         self.display_overlays = []
 
+        # Model tiles waiting to be invalidated, see canvas_modified_cb()
+        self._dirty_tiles = set()
+        self._flush_redraws_srcid = None
+        self.reset_redraw_stats()
+
     def state_changed_cb(self, widget, oldstate):
         # Keeps track of the sensitivity state, and regenerates
         # the snapshot pixbuf on entering it.
@@ -541,19 +562,93 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
 
 
     def canvas_modified_cb(self, x, y, w, h):
+        """Accumulates modified areas, redrawing them at most once a frame.
+
+        The brush engine notifies every batch of dabs. Instead of a redraw
+        for each, the modified tiles are collected and invalidated together
+        by `_flush_redraws()`. Areas are clipped to the visible part of the
+        model first, and big ones are invalidated right away as a whole.
+        """
         if not self.get_window():
             return
+        self._redraw_stats['notifications'] += 1
 
         if w == 0 and h == 0:
             # Full redraw (used when background has changed).
             #print 'full redraw'
+            self._dirty_tiles.clear()
             self.queue_draw()
             return
 
-        # Create an expose event with the event bbox rotated/zoomed.
-        corners = [(x, y), (x+w, y), (x, y+h), (x+w, y+h)]
-        corners = [self.model_to_display(x, y) for (x, y) in corners]
-        self.queue_draw_area(*helpers.rotated_rectangle_bbox(corners))
+        # Only the part on screen needs a redraw
+        alloc = self.get_allocation()
+        view_model = self._get_model_view_transformation()
+        view_model.invert()
+        corners = [(0, 0), (alloc.width, 0), (0, alloc.height),
+                   (alloc.width, alloc.height)]
+        corners = [view_model.transform_point(cx, cy) for (cx, cy) in corners]
+        vx, vy, vw, vh = helpers.rotated_rectangle_bbox(corners)
+        x0, y0 = max(x, vx), max(y, vy)
+        x1, y1 = min(x+w, vx+vw), min(y+h, vy+vh)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        N = tiledsurface.N
+        tx0, ty0 = int(floor(float(x0)/N)), int(floor(float(y0)/N))
+        tx1, ty1 = int(ceil(float(x1)/N)), int(ceil(float(y1)/N))
+        if (tx1-tx0) * (ty1-ty0) > MAX_DIRTY_TILES:
+            corners = [(x0, y0), (x1, y0), (x0, y1), (x1, y1)]
+            corners = [self.model_to_display(cx, cy) for (cx, cy) in corners]
+            self.queue_draw_area(*helpers.rotated_rectangle_bbox(corners))
+            return
+        for ty in xrange(ty0, ty1):
+            for tx in xrange(tx0, tx1):
+                self._dirty_tiles.add((tx, ty))
+        if self._flush_redraws_srcid is None:
+            self._flush_redraws_srcid = gobject.timeout_add(
+                    REDRAW_INTERVAL_MS, self._flush_redraws)
+
+    def _flush_redraws(self):
+        self._flush_redraws_srcid = None
+        if not self._dirty_tiles or not self.get_window():
+            return False
+        self._redraw_stats['flushes'] += 1
+        # Runs of horizontally adjacent tiles become one area each
+        N = tiledsurface.N
+        rows = {}
+        for tx, ty in self._dirty_tiles:
+            rows.setdefault(ty, []).append(tx)
+        self._dirty_tiles = set()
+        for ty, txs in rows.iteritems():
+            txs.sort()
+            start = prev = txs[0]
+            for tx in txs[1:] + [None]:
+                if tx == prev + 1:
+                    prev = tx
+                    continue
+                # Create an expose event with the run's bbox rotated/zoomed.
+                x, y, w, h = start*N, ty*N, (prev-start+1)*N, N
+                corners = [(x, y), (x+w, y), (x, y+h), (x+w, y+h)]
+                corners = [self.model_to_display(x, y) for (x, y) in corners]
+                self.queue_draw_area(*helpers.rotated_rectangle_bbox(corners))
+                start = prev = tx
+        return False
+
+    def reset_redraw_stats(self):
+        self._redraw_stats = {'notifications': 0, 'flushes': 0, 'repaints': 0}
+        self._redraw_stats_t0 = time.time()
+
+    def get_redraw_stats(self):
+        """Returns counts and per-second rates since `reset_redraw_stats()`.
+
+        ``notifications`` are calls of `canvas_modified_cb()`, ``flushes``
+        batches of invalidated areas, and ``repaints`` handled exposes.
+        """
+        dt = max(time.time() - self._redraw_stats_t0, 1e-6)
+        stats = dict(self._redraw_stats)
+        for key in self._redraw_stats:
+            stats[key + '_per_sec'] = self._redraw_stats[key] / dt
+        return stats
 
     def model_structure_changed_cb(self, doc):
         # Reflect layer locked and visible flag changes
@@ -649,6 +744,7 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
         return layers
 
     def repaint(self, cr, device_bbox=None):
+        self._redraw_stats['repaints'] += 1
         cr, surface, sparse, mipmap_level, clip_region = self.render_prepare(cr, device_bbox)
         self.render_execute(cr, surface, sparse, mipmap_level, clip_region)
         # Model coordinate space:
@@ -792,7 +888,25 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
             layers.insert(idx+1, self.overlay_layer)
 
         # Composite
-        tiles = [(tx, ty) for tx, ty in surface.get_tiles() if tile_is_visible(cr, tx, ty, clip_region, sparse, translation_only)]
+        if translation_only:
+            tiles = [(tx, ty) for tx, ty in surface.get_tiles() if tile_is_visible(cr, tx, ty, clip_region, sparse, translation_only)]
+        else:
+            # Only the tiles covered by the rotated clip rectangle. The
+            # surface covers its bbox, which is up to twice as large.
+            device_x1, device_y1, device_x2, device_y2 = device_clip_extents(cr)
+            corners = [(device_x1, device_y1), (device_x2, device_y1),
+                       (device_x2, device_y2), (device_x1, device_y2)]
+            corners = [cr.device_to_user(x, y) for (x, y) in corners]
+            # grow by a pixel or so for interpolation at the border
+            cx = sum(x for (x, y) in corners) / 4.0
+            cy = sum(y for (x, y) in corners) / 4.0
+            grown = []
+            for x, y in corners:
+                d = max(hypot(x-cx, y-cy), 1e-6)
+                grown.append((x + 2*(x-cx)/d, y + 2*(y-cy)/d))
+            available = set(surface.get_tiles())
+            tiles = [t for t in helpers.tiles_in_convex_polygon(grown, tiledsurface.N)
+                     if t in available]
         self.doc.render_into(surface, tiles, mipmap_level, layers, background)
 
         if translation_only and not pygtkcompat.USE_GTK3:
@@ -800,6 +914,8 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
             x, y = cr.user_to_device(surface.x, surface.y)
             self.window.draw_pixbuf(None, surface.pixbuf, 0, 0, int(x), int(y),
                                     dither=gdk.RGB_DITHER_MAX)
+        elif not translation_only:
+            self.render_resampled(cr, surface)
         else:
             #print 'Position (screen coordinates):', cr.user_to_device(surface.x, surface.y)
             if pygtkcompat.USE_GTK3:
@@ -843,6 +959,42 @@ class CanvasRenderer(gtk.DrawingArea, DrawCursorMixin):
             cr.set_source_rgba(0, 0, random.random(), 0.4)
             cr.paint()
 
+    def render_resampled(self, cr, surface):
+        """Paints a rendered surface through a rotated or zoomed view.
+
+        The surface is resampled in C straight into a buffer the size of the
+        clip rectangle, instead of painting a transformed cairo pattern
+        (FILTER_BILINEAR measured 3.1s for paint_rotated).
+        """
+        x1, y1, x2, y2 = device_clip_extents(cr)
+        x1, y1 = int(floor(x1)), int(floor(y1))
+        x2, y2 = int(ceil(x2)), int(ceil(y2))
+        if x2 <= x1 or y2 <= y1:
+            return
+        pixbuf = pygtkcompat.gdk.pixbuf.new(gdk.COLORSPACE_RGB, True, 8,
+                                            x2-x1, y2-y1)
+        dst = helpers.gdkpixbuf2numpy(pixbuf)
+        src = helpers.gdkpixbuf2numpy(surface.epixbuf)
+
+        # buffer pixel centres -> user space -> surface pixel centres
+        to_user = cr.get_matrix()
+        to_user.invert()
+        matrix = cairo.Matrix(x0=x1+0.5, y0=y1+0.5).multiply(to_user)
+        matrix = matrix.multiply(cairo.Matrix(x0=-surface.ex-0.5,
+                                              y0=-surface.ey-0.5))
+        # pixelize at high zoom-in levels
+        bilinear = self.scale <= 2.8
+        mypaintlib.resample_affine_rgba8(src, dst, *(tuple(matrix) + (bilinear,)))
+
+        cr.save()
+        cr.identity_matrix()
+        if pygtkcompat.USE_GTK3:
+            gdk.cairo_set_source_pixbuf(cr, pixbuf, x1, y1)
+        else:
+            cr.set_source_pixbuf(pixbuf, x1, y1)
+        cr.paint()
+        cr.restore()
+
     def scroll(self, dx, dy):
         self.translation_x -= dx
         self.translation_y -= dy
@@ -11,6 +11,8 @@ from brushlib import brushsettings
 import helpers
 import urllib, copy, math
 import json
+import contextlib
+import numpy
 
 string_value_settings = set(("parent_brush_name", "group"))
 current_brushfile_version = 2
@@ -448,6 +450,9 @@ class Brush(mypaintlib.PythonBrush):
     def __init__(self, brushinfo):
         mypaintlib.PythonBrush.__init__(self)
         self.brushinfo = brushinfo
+        # What the C brush has been told: {cname: [base, {input: points}]}.
+        # Mappings start out with no points.
+        self._c_settings = {}
         brushinfo.observers.append(self.update_brushinfo)
         self.update_brushinfo(all_settings)
 
@@ -458,32 +463,99 @@ class Brush(mypaintlib.PythonBrush):
         self.stroke_to = self.python_stroke_to
 
     def update_brushinfo(self, settings):
-        """Mirror changed settings into the BrushInfo tracking this Brush."""
+        """Mirror changed settings into the BrushInfo tracking this Brush.
 
+        Only base values and mappings which differ from what the C brush
+        has already got are sent, all in one `set_all_mappings()` call.
+        """
+        records = []
         for cname in settings:
             setting = brushsettings.settings_dict.get(cname)
             if not setting:
                 continue
 
+            c_setting = self._c_settings.get(cname)
+            if c_setting is None:
+                c_setting = self._c_settings[cname] = [None, {}]
             base = self.brushinfo.get_base_value(cname)
-            self.set_base_value(setting.index, base)
+            if base != c_setting[0]:
+                records += [setting.index, -1, base]
+                c_setting[0] = base
 
+            c_points = c_setting[1]
             for input in brushsettings.inputs:
                 points = self.brushinfo.get_points(cname, input.name, readonly=True)
-
                 assert len(points) != 1
+                points = tuple(tuple(p) for p in points)
+                if points == c_points.get(input.name, ()):
+                    continue
                 #if len(points) > 2:
                 #    print 'set_points[%s](%s, %s)' % (cname, input.name, points)
+                records += [setting.index, input.index, len(points)]
+                for x, y in points:
+                    records += [x, y]
+                c_points[input.name] = points
 
-                self.set_mapping_n(setting.index, input.index, len(points))
-                for i, (x, y) in enumerate(points):
-                    self.set_mapping_point(setting.index, input.index, i, x, y)
+        if records:
+            self.set_all_mappings(numpy.array(records, 'float32'))
 
     def get_stroke_bbox(self):
         bbox = self.stroke_bbox
         return bbox.x, bbox.y, bbox.w, bbox.h
 
 
+class BrushCache:
+    """LRU cache of parsed and fully configured brushes.
+
+    Parsing a settings string and pushing all its mappings down into the C
+    brush is slow compared to replaying a short stroke. Brushes are keyed
+    by their settings string. A cached brush is handed out to one user at a
+    time, with its state cleared; note that the C brush keeps its random
+    number generator going from the previous use.
+
+    """
+
+    def __init__(self, max_items=16):
+        self._brushes = helpers.LRUCache(max_items)
+        self._brushinfos = helpers.LRUCache(max_items)
+
+    @contextlib.contextmanager
+    def brush(self, settings_str):
+        """Context manager lending a configured Brush for `settings_str`.
+
+        Its brushinfo must not be modified.
+        """
+        b = self._brushes.pop(settings_str)
+        if b is None:
+            info = self.get_brushinfo(settings_str)
+            b = Brush(info)
+            # The shared info never changes, and observing it would keep
+            # evicted brushes alive for as long as the info is cached.
+            info.observers.remove(b.update_brushinfo)
+        else:
+            # not reset(), which would only happen on the next stroke_to()
+            # and clobber any state set by the caller meanwhile
+            states = b.get_state()
+            states[:] = 0
+            b.set_state(states)
+            b.new_stroke()
+        try:
+            yield b
+        finally:
+            self._brushes[settings_str] = b
+
+    def get_brushinfo(self, settings_str):
+        """Returns a parsed BrushInfo, shared with the cache: don't modify it."""
+        info = self._brushinfos.get(settings_str)
+        if info is None:
+            info = BrushInfo(settings_str)
+            self._brushinfos[settings_str] = info
+        return info
+
+#: Cache used for replaying strokes and picking brushes from strokes
+brush_cache = BrushCache()
+
+
 if __name__ == "__main__":
     import doctest
     doctest.testmod()
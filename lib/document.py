@@ -25,6 +25,14 @@ import brush
 N = tiledsurface.N
 LOAD_CHUNK_SIZE = 64*1024
 
+#: Sample the composite of all visible layers, see `Document.pick_color()`
+PICK_ALL_LAYERS = 'all'
+#: Sample only the current layer, see `Document.pick_color()`
+PICK_CURRENT_LAYER = 'current'
+#: Number of tile positions whose composites are kept for reuse, see
+#: `get_flattened_tile()`
+FLATTENED_TILE_CACHE_SIZE = 256
+
 from layer import DEFAULT_COMPOSITE_OP, VALID_COMPOSITE_OPS
 
 
@@ -70,6 +78,10 @@ class Document():
         self.symmetry_observers = []  #: See `set_symmetry_axis()`
         self.__symmetry_axis = None
         self.default_background = (255, 255, 255)
+        # (tx, ty) -> {layer or tuple of layers: tile}
+        self._tile_cache = helpers.LRUCache(FLATTENED_TILE_CACHE_SIZE)
+        self.canvas_observers.append(self._tile_cache_invalidate_cb)
+        self.doc_observers.append(self._tile_cache_prune_cb)
         self.clear(True)
 
         self._frame = [0, 0, 0, 0]
@@ -145,6 +157,7 @@ class Document():
         self.set_background(self.default_background)
         self.layers = []
         self.layer_idx = None
+        self._tile_cache.clear()
         self.add_layer(0)
         # disallow undo of the first layer
         self.command_stack.clear()
@@ -246,7 +259,9 @@ class Document():
             self.stroke = stroke.Stroke()
             self.stroke.start_recording(self.brush)
             self.snapshot_before_stroke = self.layer.save_snapshot()
-        self.stroke.record_event(dtime, x, y, pressure, xtilt, ytilt)
+        # the brush must get the rounded values, as replays will
+        dtime, x, y, pressure, xtilt, ytilt = \
+            self.stroke.record_event(dtime, x, y, pressure, xtilt, ytilt)
 
         split = self.layer.stroke_to(self.brush, x, y,
                                 pressure, xtilt, ytilt, dtime)
@@ -351,6 +366,12 @@ class Document():
 
     def render_into(self, surface, tiles, mipmap_level=0, layers=None, background=None):
 
+        if mipmap_level > 0:
+            # regenerate the dirty mipmap tiles of the whole area in one go
+            tiles = list(tiles)
+            for layer in (self.layers if layers is None else layers):
+                layer.update_mipmaps(tiles, mipmap_level)
+
         # TODO: move this loop down in C/C++
         for tx, ty in tiles:
             with surface.tile_request(tx, ty, readonly=False) as dst:
@@ -378,11 +399,147 @@ class Document():
         if dst_8bit is not None:
             mypaintlib.tile_convert_rgbu16_to_rgbu8(dst, dst_8bit)
 
+    def pick_color(self, x, y, radius, layers=PICK_ALL_LAYERS):
+        """Returns the average colour around a point in model coordinates.
+
+        :param x: model X coordinate of the centre
+        :param y: model Y coordinate of the centre
+        :param radius: radius of the sampled disc, in model pixels
+        :param layers: `PICK_ALL_LAYERS` or `PICK_CURRENT_LAYER`
+        :returns: an ``(r, g, b)`` tuple in the range 0.0 to 1.0, or None
+            if the sampled area is fully transparent
+
+        Pixels are weighted by their alpha. All-layers picks sample the
+        visible image including the background; current-layer picks sample
+        the current layer alone, even when it is hidden.
+
+        """
+        rgb, alpha = self.get_pick_samples(x, y, radius, layers)
+        total = alpha.sum()
+        if not total > 0:
+            return None
+        mean = (rgb * alpha[:, numpy.newaxis]).sum(axis=0) / total
+        return tuple(float(c) for c in mean)
+
+    def get_pick_samples(self, x, y, radius, layers=PICK_ALL_LAYERS):
+        """Returns the pixels around a point, for colour picking.
+
+        :returns: ``(rgb, alpha)``, float arrays of straight colour and
+            alpha with one row per pixel
+
+        Arguments are as for `pick_color()`. Only the tiles under the disc
+        are read, and they are cached (see `get_flattened_tile()`), so
+        repeated picks while dragging don't composite the layer stack again.
+
+        """
+        if layers == PICK_CURRENT_LAYER:
+            source = self.layer
+        else:
+            assert layers == PICK_ALL_LAYERS
+            source = None
+        x0 = int(numpy.floor(x - radius))
+        y0 = int(numpy.floor(y - radius))
+        x1 = max(x0, int(numpy.floor(x + radius))) + 1
+        y1 = max(y0, int(numpy.floor(y + radius))) + 1
+        region = numpy.empty((y1-y0, x1-x0, 4), dtype='uint16')
+        for ty in xrange(y0 // N, (y1-1) // N + 1):
+            for tx in xrange(x0 // N, (x1-1) // N + 1):
+                tile = self._get_pick_tile(source, tx, ty)
+                sx0, sx1 = max(x0, tx*N), min(x1, (tx+1)*N)
+                sy0, sy1 = max(y0, ty*N), min(y1, (ty+1)*N)
+                region[sy0-y0:sy1-y0, sx0-x0:sx1-x0] = \
+                    tile[sy0-ty*N:sy1-ty*N, sx0-tx*N:sx1-tx*N]
+
+        # Pixel centres inside the disc, plus the pixel under the point
+        py, px = numpy.mgrid[y0:y1, x0:x1]
+        inside = (px + 0.5 - x)**2 + (py + 0.5 - y)**2 <= radius**2
+        inside |= (px == int(numpy.floor(x))) & (py == int(numpy.floor(y)))
+        pixels = region[inside] / float(1<<15)
+
+        if source is None:
+            # The flattened image is opaque; its alpha channel is undefined
+            return pixels[:, :3], numpy.ones(len(pixels))
+        alpha = pixels[:, 3]
+        rgb = pixels[:, :3] / numpy.maximum(alpha, 1.0/(1<<15))[:, numpy.newaxis]
+        return numpy.clip(rgb, 0.0, 1.0), alpha
+
+    def _get_pick_tile(self, source, tx, ty):
+        if source is None:
+            return self.get_flattened_tile(self.layers, tx, ty)
+        tile = self._get_cached_tile(source, tx, ty)
+        if tile is None:
+            tile = numpy.empty((N, N, 4), dtype='uint16')
+            source.blit_tile_into(tile, True, tx, ty)
+            self._set_cached_tile(source, tx, ty, tile)
+        return tile
+
+    def get_flattened_tile(self, layers, tx, ty):
+        """Returns one tile of some layers composited over the background.
+
+        :param layers: the layers to composite, bottom first
+        :returns: an opaque (N, N, 4) uint16 array, which must not be
+            modified by the caller
+
+        Results are kept per tile and layer stack until the canvas changes
+        under them (see `layer_modified_cb()`), so merging, layer mode
+        conversion and colour picking share their composites instead of
+        rendering the stack again each time.
+
+        """
+        layers = tuple(layers)
+        tile = self._get_cached_tile(layers, tx, ty)
+        if tile is None:
+            tile = numpy.empty((N, N, 4), dtype='uint16')
+            self.blit_tile_into(tile, False, tx, ty, layers=list(layers))
+            self._set_cached_tile(layers, tx, ty, tile)
+        return tile
+
+    def _get_cached_tile(self, source, tx, ty):
+        entries = self._tile_cache.get((tx, ty))
+        if entries is None:
+            return None
+        return entries.get(source)
+
+    def _set_cached_tile(self, source, tx, ty, tile):
+        entries = self._tile_cache.get((tx, ty))
+        if entries is None:
+            entries = self._tile_cache[(tx, ty)] = {}
+        entries[source] = tile
+
+    def _tile_cache_invalidate_cb(self, x, y, w, h):
+        if w == 0 and h == 0:
+            self._tile_cache.clear()
+            return
+        tx0, ty0 = x // N, y // N
+        tx1, ty1 = (x + w - 1) // N, (y + h - 1) // N
+        if (tx1-tx0+1) * (ty1-ty0+1) > len(self._tile_cache):
+            positions = [(tx, ty) for (tx, ty) in self._tile_cache.keys()
+                         if tx0 <= tx <= tx1 and ty0 <= ty <= ty1]
+        else:
+            positions = [(tx, ty) for ty in xrange(ty0, ty1+1)
+                         for tx in xrange(tx0, tx1+1)]
+        for pos in positions:
+            self._tile_cache.pop(pos)
+
+    def _tile_cache_prune_cb(self, doc):
+        # Composites of removed layers are of no use, and would keep the
+        # layers alive until evicted.
+        layers = set(self.layers)
+        for entries in self._tile_cache.values():
+            for source in entries.keys():
+                if isinstance(source, tuple):
+                    if not layers.issuperset(source):
+                        del entries[source]
+                elif source not in layers:
+                    del entries[source]
+
     def get_rendered_image_behind_current_layer(self, tx, ty):
-        dst = numpy.empty((N, N, 4), dtype='uint16')
-        l = self.layers[0:self.layer_idx]
-        self.blit_tile_into(dst, False, tx, ty, layers=l)
-        return dst
+        """Returns the flattened tile of all layers below the current one.
+
+        See `get_flattened_tile()`: the array is shared, and read only.
+
+        """
+        return self.get_flattened_tile(self.layers[0:self.layer_idx], tx, ty)
 
 
     def add_layer(self, insert_idx=None, after=None, name=''):
@@ -415,6 +572,25 @@ class Document():
         return bbox
 
 
+    def load_layer_from_surface_snapshot(self, sshot, dx=0, dy=0):
+        """Loads the current layer from a surface snapshot (undoable).
+
+        The snapshot's tiles (see `Layer.save_surface_snapshot()`) are
+        shared with the layer, not copied, unless the pixels are moved by
+        (dx, dy) to a position off the tile grid.
+
+        """
+        s = tiledsurface.Surface()
+        s.load_snapshot(sshot)
+        if dx or dy:
+            move = s.get_move(0, 0)
+            move.update(dx, dy)
+            move.process(n=-1)
+            move.cleanup()
+        self.do(command.LoadLayer(self, s))
+        return s.get_bbox()
+
+
     def load_layer_from_png(self, filename, x=0, y=0, feedback_cb=None):
         s = tiledsurface.Surface()
         bbox = s.load_from_png(filename, x, y, feedback_cb)
@@ -587,6 +763,14 @@ class Document():
         return pixbuf
 
     def save_png(self, filename, alpha=False, multifile=False, **kwargs):
+        """Save the document as one or more PNG files.
+
+        Besides ``feedback_cb``, `kwargs` may contain ``compression_level``
+        (zlib level, 0-9; low values are much faster, e.g. for autosaves)
+        and ``parallel_deflate`` (compress the image data on all cores).
+        They are passed on to `pixbufsurface.save_as_png()`.
+
+        """
         doc_bbox = self.get_effective_bbox()
         if multifile:
             self.save_multifile_png(filename, **kwargs)
@@ -595,7 +779,7 @@ class Document():
                 tmp_layer = layer.Layer()
                 for l in self.layers:
                     l.merge_into(tmp_layer)
-                tmp_layer.save_as_png(filename, *doc_bbox)
+                tmp_layer.save_as_png(filename, *doc_bbox, **kwargs)
             else:
                 pixbufsurface.save_as_png(self, filename, *doc_bbox, alpha=False, **kwargs)
 
@@ -651,6 +835,12 @@ class Document():
     save_jpeg = save_jpg
 
     def save_ora(self, filename, options=None, **kwargs):
+        """Save the document as an OpenRaster file.
+
+        The layer PNGs are written with `kwargs`, so the PNG options of
+        `save_png()` (``compression_level``, ``parallel_deflate``) apply.
+
+        """
         print 'save_ora:'
         t0 = time.time()
         tempdir = tempfile.mkdtemp('mypaint')
@@ -1,10 +1,29 @@
 #define PNG_SKIP_SETJMP_CHECK
 #include "png.h"
 #include "lcms2.h"
+#include "zlib.h"
+
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+#include <vector>
 
 #ifndef SWIG
+// libpng's error pointer while writing. The row data is compressed with
+// the GIL released, so an error callback must reacquire it before it can
+// set the Python exception.
+typedef struct {
+  PyThreadState *saved_thread_state;
+} PngWriteErrorState;
+
 static void png_write_error_callback(png_structp png_save_ptr, png_const_charp error_msg)
 {
+  PngWriteErrorState *state = (PngWriteErrorState *)png_get_error_ptr(png_save_ptr);
+  if (state && state->saved_thread_state) {
+    PyEval_RestoreThread(state->saved_thread_state);
+    state->saved_thread_state = NULL;
+  }
   // we don't trust libpng to call the error callback only once, so
   // check for already-set error
   if (!PyErr_Occurred()) {
@@ -16,14 +35,212 @@ static void png_write_error_callback(png_structp png_save_ptr, png_const_charp e
   }
   longjmp (png_jmpbuf(png_save_ptr), 1);
 }
+
+
+// Parallel deflate for the PNG writer, pigz style.
+//
+// Scanlines are SUB-filtered here instead of in libpng and collected into
+// strips of roughly STRIP_BYTES. A batch of strips (one per OpenMP thread)
+// is compressed concurrently as raw deflate data. Each strip gets the last
+// 32KiB of its predecessor as preset dictionary, and all but the final one
+// end with Z_SYNC_FLUSH on a byte boundary, so the concatenation is a
+// single valid zlib stream. Each strip is written as one IDAT chunk.
+//
+// Without OpenMP the strips are compressed one after the other.
+
+class PNGParallelDeflater {
+public:
+  static const int STRIP_BYTES = 256*1024;
+  static const int WINDOW_SIZE = 32*1024;
+
+  PNGParallelDeflater(int w, bool has_alpha, int level) {
+    this->w = w;
+    this->bpp = has_alpha ? 4 : 3;
+    this->level = level;
+    row_bytes = 1 + w*bpp;
+    strip_rows = STRIP_BYTES / row_bytes;
+    if (strip_rows < 1) strip_rows = 1;
+    int n_threads = 1;
+#ifdef _OPENMP
+    n_threads = omp_get_max_threads();
 #endif
+    strips.resize(n_threads);
+    for (int i=0; i<n_threads; i++) {
+      strips[i].in.reserve(strip_rows * row_bytes);
+    }
+    strips_used = 0;
+    header_written = false;
+    adler = adler32(0L, Z_NULL, 0);
+  }
+
+  // Filter and append one rgba or rgbu scanline (rgbu loses the filler).
+  // Returns true when a full batch of strips is ready for flush().
+  bool add_row(const uint8_t *src) {
+    Strip &strip = strips[strips_used];
+    size_t pos = strip.in.size();
+    strip.in.resize(pos + row_bytes);
+    uint8_t *dst = &strip.in[pos];
+    *dst++ = PNG_FILTER_VALUE_SUB;
+    for (int c=0; c<bpp; c++) {
+      dst[c] = src[c];
+    }
+    for (int x=1; x<w; x++) {
+      for (int c=0; c<bpp; c++) {
+        dst[x*bpp+c] = src[x*4+c] - src[(x-1)*4+c];
+      }
+    }
+    if (strip.in.size() >= (size_t)strip_rows * row_bytes) {
+      strips_used++;
+    }
+    return strips_used == (int)strips.size();
+  }
+
+  // Compress all pending strips and write them out as IDAT chunks.
+  // May be called with the GIL released. Returns a zlib error code.
+  int flush(png_structp png_ptr, bool last) {
+    int n = strips_used;
+    if (n < (int)strips.size() && !strips[n].in.empty()) {
+      n++; // partially filled strip
+    }
+    if (n == 0 && !last) {
+      return Z_OK;
+    }
+    if (!header_written) {
+      // zlib stream header: deflate with 32KiB window, FLEVEL hint
+      const int flevel = (level < 2) ? 0 : (level < 6) ? 1 : (level == 6) ? 2 : 3;
+      uint8_t header[2];
+      header[0] = 0x78;
+      header[1] = flevel << 6;
+      header[1] |= (31 - (header[0]*256 + header[1]) % 31) % 31;
+      png_write_chunk(png_ptr, (png_const_bytep)"IDAT", header, 2);
+      header_written = true;
+    }
+    int error = Z_OK;
+    #pragma omp parallel for schedule(dynamic)
+    for (int i=0; i<n; i++) {
+      const std::vector<uint8_t> &dict = (i == 0) ? window : strips[i-1].in;
+      size_t dict_len = dict.size() < (size_t)WINDOW_SIZE ? dict.size() : WINDOW_SIZE;
+      const uint8_t *dict_p = dict_len ? &dict[dict.size() - dict_len] : NULL;
+      int res = compress_strip(strips[i], dict_p, dict_len, last && i == n-1);
+      if (res != Z_OK) {
+        #pragma omp critical
+        error = res;
+      }
+    }
+    if (error != Z_OK) {
+      return error;
+    }
+    for (int i=0; i<n; i++) {
+      Strip &strip = strips[i];
+      if (!strip.out.empty()) {
+        png_write_chunk(png_ptr, (png_const_bytep)"IDAT",
+                        &strip.out[0], strip.out.size());
+      }
+      adler = adler32_combine(adler, strip.adler, strip.in.size());
+    }
+    if (n > 0) {
+      // carry the tail of the data over as the next batch's dictionary
+      const std::vector<uint8_t> &tail = strips[n-1].in;
+      size_t len = tail.size() < (size_t)WINDOW_SIZE ? tail.size() : WINDOW_SIZE;
+      window.assign(tail.end() - len, tail.end());
+    }
+    if (last) {
+      if (n == 0) {
+        // no strip carried the final block, so terminate the stream
+        uint8_t empty_final[2] = {0x03, 0x00};
+        png_write_chunk(png_ptr, (png_const_bytep)"IDAT", empty_final, 2);
+      }
+      uint8_t trailer[4];
+      png_save_uint_32(trailer, adler);
+      png_write_chunk(png_ptr, (png_const_bytep)"IDAT", trailer, 4);
+    }
+    for (int i=0; i<n; i++) {
+      strips[i].in.clear();
+      strips[i].out.clear();
+    }
+    strips_used = 0;
+    return Z_OK;
+  }
+
+private:
+  struct Strip {
+    std::vector<uint8_t> in;  // filtered scanlines
+    std::vector<uint8_t> out; // raw deflate data
+    uLong adler;
+  };
+
+  int compress_strip(Strip &strip, const uint8_t *dict, size_t dict_len,
+                     bool last) {
+    z_stream zs;
+    memset(&zs, 0, sizeof(zs));
+    int res = deflateInit2(&zs, level, Z_DEFLATED, -15, 8, Z_DEFAULT_STRATEGY);
+    if (res != Z_OK) {
+      return res;
+    }
+    if (dict_len) {
+      res = deflateSetDictionary(&zs, dict, dict_len);
+      if (res != Z_OK) {
+        deflateEnd(&zs);
+        return res;
+      }
+    }
+    strip.adler = adler32(adler32(0L, Z_NULL, 0), &strip.in[0], strip.in.size());
+    strip.out.resize(deflateBound(&zs, strip.in.size()) + 16);
+    zs.next_in = &strip.in[0];
+    zs.avail_in = strip.in.size();
+    zs.next_out = &strip.out[0];
+    zs.avail_out = strip.out.size();
+    const int flush = last ? Z_FINISH : Z_SYNC_FLUSH;
+    while (true) {
+      res = deflate(&zs, flush);
+      if (last ? (res == Z_STREAM_END) : (res == Z_OK && zs.avail_out > 0)) {
+        break;
+      }
+      if (res != Z_OK && res != Z_BUF_ERROR) {
+        deflateEnd(&zs);
+        return res;
+      }
+      // output buffer exhausted, grow it and continue
+      size_t done = strip.out.size() - zs.avail_out;
+      strip.out.resize(strip.out.size() * 2);
+      zs.next_out = &strip.out[done];
+      zs.avail_out = strip.out.size() - done;
+    }
+    strip.out.resize(strip.out.size() - zs.avail_out);
+    deflateEnd(&zs);
+    return Z_OK;
+  }
+
+  int w, bpp, level;
+  int row_bytes, strip_rows;
+  std::vector<Strip> strips;
+  int strips_used;
+  std::vector<uint8_t> window;
+  bool header_written;
+  uLong adler;
+};
+#endif
+
+/** save_png_fast_progressive:
+ *
+ * @filename: filename to save to, in the system encoding
+ * @w, @h: image size
+ * @has_alpha: whether the data is rgba (or rgbu, alpha ignored)
+ * @data_generator: iterable yielding uint8 arrays of consecutive scanlines
+ * @write_legacy_png: if false, write sRGB colour management chunks
+ * @compression_level: zlib level, 0-9. Low values are much faster.
+ * @parallel_deflate: compress IDAT chunks in parallel (see above)
+ * returns: an empty dict
+ */
 
 PyObject *
 save_png_fast_progressive (char *filename,
                            int w, int h,
                            bool has_alpha,
                            PyObject *data_generator,
-                           bool write_legacy_png)
+                           bool write_legacy_png,
+                           int compression_level = 2,
+                           bool parallel_deflate = false)
 {
   png_structp png_ptr = NULL;
   png_infop info_ptr = NULL;
@@ -31,6 +248,8 @@ save_png_fast_progressive (char *filename,
   int bpc;
   FILE * fp = NULL;
   PyObject *iterator = NULL;
+  PngWriteErrorState error_state = {NULL};
+  PNGParallelDeflater *deflater = NULL;
 
   /* TODO: try if this silliness helps
 #if defined(PNG_LIBPNG_VER) && (PNG_LIBPNG_VER >= 10200)
@@ -51,7 +270,7 @@ save_png_fast_progressive (char *filename,
     goto cleanup;
   }
 
-  png_ptr = png_create_write_struct(PNG_LIBPNG_VER_STRING, (png_voidp)NULL, png_write_error_callback, NULL);
+  png_ptr = png_create_write_struct(PNG_LIBPNG_VER_STRING, (png_voidp)&error_state, png_write_error_callback, NULL);
   if (!png_ptr) {
     PyErr_SetString(PyExc_MemoryError, "png_create_write_struct() failed");
     goto cleanup;
@@ -63,6 +282,10 @@ save_png_fast_progressive (char *filename,
     goto cleanup;
   }
 
+  if (parallel_deflate) {
+    deflater = new PNGParallelDeflater(w, has_alpha, compression_level);
+  }
+
   if (setjmp(png_jmpbuf(png_ptr))) {
     goto cleanup;
   }
@@ -87,10 +310,11 @@ save_png_fast_progressive (char *filename,
   //png_set_filter(png_ptr, 0, PNG_FILTER_PAETH); // 980ms, 3.5MB
   png_set_filter(png_ptr, 0, PNG_FILTER_SUB);     // 760ms, 3.4MB
 
-  //png_set_compression_level(png_ptr, 0); // 0.49s, 32MB
-  //png_set_compression_level(png_ptr, 1); // 0.98s, 9.6MB
-  png_set_compression_level(png_ptr, 2);   // 1.08s, 9.4MB
-  //png_set_compression_level(png_ptr, 9); // 18.6s, 9.3MB
+  // level 0: 0.49s, 32MB
+  // level 1: 0.98s, 9.6MB
+  // level 2: 1.08s, 9.4MB (default)
+  // level 9: 18.6s, 9.3MB
+  png_set_compression_level(png_ptr, compression_level);
 
   png_write_info(png_ptr, info_ptr);
 
@@ -121,11 +345,34 @@ save_png_fast_progressive (char *filename,
       assert(rows > 0);
       y += rows;
       png_bytep p = (png_bytep)PyArray_DATA(arr);
+      const npy_intp row_stride = PyArray_STRIDE(arr, 0);
+      int zlib_error = Z_OK;
+      // Compress without holding the GIL, so that the next rows can
+      // be rendered by other threads meanwhile (see pixbufsurface.py)
+      error_state.saved_thread_state = PyEval_SaveThread();
       for (int row=0; row<rows; row++) {
-        png_write_row (png_ptr, p);
-        p += PyArray_STRIDE(arr, 0);
+        if (deflater) {
+          if (deflater->add_row(p)) {
+            zlib_error = deflater->flush(png_ptr, false);
+            if (zlib_error != Z_OK) break;
+          }
+        }
+        else {
+          png_write_row (png_ptr, p);
+        }
+        p += row_stride;
+      }
+      if (deflater && y == h && zlib_error == Z_OK) {
+        zlib_error = deflater->flush(png_ptr, true);
       }
+      PyEval_RestoreThread(error_state.saved_thread_state);
+      error_state.saved_thread_state = NULL;
       Py_DECREF(arr);
+      if (zlib_error != Z_OK) {
+        PyErr_Format(PyExc_RuntimeError, "Error compressing PNG data: "
+                     "zlib error %d", zlib_error);
+        goto cleanup;
+      }
     }
     assert(y == h);
     PyObject * obj = PyIter_Next(iterator);
@@ -133,7 +380,13 @@ save_png_fast_progressive (char *filename,
     if (PyErr_Occurred()) goto cleanup;
   }
 
-  png_write_end (png_ptr, NULL);
+  if (deflater) {
+    // IDAT data was written as raw chunks, libpng does not know about it
+    png_write_chunk(png_ptr, (png_const_bytep)"IEND", NULL, 0);
+  }
+  else {
+    png_write_end (png_ptr, NULL);
+  }
 
   result = Py_BuildValue("{}");
 
@@ -141,6 +394,7 @@ save_png_fast_progressive (char *filename,
   if (iterator) Py_DECREF(iterator);
   if (info_ptr) png_destroy_write_struct(&png_ptr, &info_ptr);
   if (fp) fclose(fp);
+  if (deflater) delete deflater;
   return result;
 }
 
@@ -174,6 +428,143 @@ log_lcms2_error (cmsContext context_id, cmsUInt32Number err_code,
 }
 
 
+#ifndef SWIG
+static inline int
+floor_div (int a, int b)
+{
+  return (a >= 0) ? a/b : -((b-1-a)/b);
+}
+
+/* Reads the remaining rows of a PNG into tiles, as premultiplied 15-bit
+ * fixed point RGBA, with the first pixel at model coordinates (x, y).
+ *
+ * The rows for one row of tiles are converted into a buffer, and the tile
+ * columns containing any non-transparent pixels are passed to Python in a
+ * single call of
+ *
+ *   dst_arrays = tile_row_callback(ty, [tx, ...])
+ *
+ * which must return one writeable (N, N, 4) uint16 array per tile. 16-bit
+ * images are converted from 16 bits per channel, not via 8 bits.
+ */
+static bool
+png_read_into_tiles (png_structp png_ptr, cmsHTRANSFORM transform,
+                     uint32_t width, uint32_t height, int bit_depth,
+                     int x, int y, PyObject *tile_row_callback)
+{
+  const int N = MYPAINT_TILE_SIZE;
+  const int tx0 = floor_div(x, N);
+  const int buf_x = x - tx0*N;   // buffer column of the first pixel
+  const int tiles_w = (buf_x + width + N-1) / N;
+  const int buf_w = tiles_w * N;
+  const int input_bytes_per_pixel = (bit_depth == 8) ? 4 : 8;
+
+  // Plain malloc() rather than std::vector, because libpng errors
+  // longjmp() out of here. They leak the buffers, like the row buffers of
+  // load_png_fast_progressive().
+  const size_t buf_size = N * buf_w * 4 * sizeof(uint16_t);
+  png_byte *input_row = (png_byte *)malloc(width * input_bytes_per_pixel);
+  uint16_t *cms_row = (uint16_t *)malloc(width * 4 * sizeof(uint16_t));
+  uint16_t *buf = (uint16_t *)calloc(1, buf_size);
+  bool *nonempty = (bool *)calloc(tiles_w, sizeof(bool));
+  bool ok = true;
+
+  int ty = floor_div(y, N);
+  int buf_y = y - ty*N;          // buffer row of the next image row
+  uint32_t rows_left = height;
+
+  while (rows_left) {
+    // Fill one row of tiles, converting to fix15 and premultiplying
+    for (; buf_y < N && rows_left; buf_y++, rows_left--) {
+      png_read_row(png_ptr, input_row, NULL);
+      cmsDoTransform(transform, input_row, cms_row, width);
+      const png_byte *in_p = input_row;
+      uint16_t *dst_p = &buf[(buf_y*buf_w + buf_x) * 4];
+      for (uint32_t i=0; i<width; i++) {
+        uint32_t r, g, b, a;
+        if (bit_depth == 8) {
+          const uint8_t *p = (const uint8_t *)cms_row + i*4;
+          // lcms2 ignores alpha, so take that from the input
+          a = in_p[3];
+          r = (p[0] * (1<<15) + 255/2) / 255;
+          g = (p[1] * (1<<15) + 255/2) / 255;
+          b = (p[2] * (1<<15) + 255/2) / 255;
+          a = (a * (1<<15) + 255/2) / 255;
+        }
+        else {
+          const uint16_t *p = &cms_row[i*4];
+          a = (in_p[6] << 8) | in_p[7];  // big-endian in the PNG
+          r = (p[0] * (1<<15) + 65535/2) / 65535;
+          g = (p[1] * (1<<15) + 65535/2) / 65535;
+          b = (p[2] * (1<<15) + 65535/2) / 65535;
+          a = (a * (1<<15) + 65535/2) / 65535;
+        }
+        in_p += input_bytes_per_pixel;
+        *dst_p++ = (r * a + (1<<15)/2) / (1<<15);
+        *dst_p++ = (g * a + (1<<15)/2) / (1<<15);
+        *dst_p++ = (b * a + (1<<15)/2) / (1<<15);
+        *dst_p++ = a;
+        if (a) nonempty[(buf_x+i) / N] = true;
+      }
+    }
+
+    // Hand the non-transparent tiles over to Python in one go
+    PyObject *txs = PyList_New(0);
+    for (int i=0; i<tiles_w; i++) {
+      if (nonempty[i]) {
+        PyObject *tx = PyInt_FromLong(tx0 + i);
+        PyList_Append(txs, tx);
+        Py_DECREF(tx);
+      }
+    }
+    PyObject *dsts = PyObject_CallFunction(tile_row_callback, "iO", ty, txs);
+    Py_DECREF(txs);
+    PyObject *seq = NULL;
+    if (dsts) {
+      seq = PySequence_Fast(dsts, "tile row callback must return a sequence");
+      Py_DECREF(dsts);
+    }
+    if (!seq) {
+      ok = false;
+      break;
+    }
+    int j = 0;
+    for (int i=0; i<tiles_w; i++) {
+      if (!nonempty[i]) continue;
+      if (j >= PySequence_Fast_GET_SIZE(seq)) {
+        PyErr_SetString(PyExc_ValueError, "tile row callback returned too few arrays");
+        ok = false;
+        break;
+      }
+      PyArrayObject *dst = (PyArrayObject *)PySequence_Fast_GET_ITEM(seq, j++);
+#ifdef HEAVY_DEBUG
+      assert(PyArray_DIM(dst, 0) == N);
+      assert(PyArray_DIM(dst, 1) == N);
+      assert(PyArray_DIM(dst, 2) == 4);
+      assert(PyArray_TYPE(dst) == NPY_UINT16);
+      assert(PyArray_ISCARRAY(dst));
+#endif
+      for (int row=0; row<N; row++) {
+        memcpy(dst->data + row*dst->strides[0], buf + (row*buf_w + i*N) * 4,
+               N * 4 * sizeof(uint16_t));
+      }
+    }
+    Py_DECREF(seq);
+    if (!ok) break;
+
+    memset(buf, 0, buf_size);
+    memset(nonempty, 0, tiles_w * sizeof(bool));
+    buf_y = 0;
+    ty++;
+  }
+  free(input_row);
+  free(cms_row);
+  free(buf);
+  free(nonempty);
+  return ok;
+}
+#endif
+
 /** load_png_fast_progressive:
  *
  * @filename: filename to load, in the system encoding
@@ -196,9 +587,11 @@ log_lcms2_error (cmsContext context_id, cmsUInt32Number err_code,
  * The flag is meaningful in (some) ORA files, not so much when loading a PNG.
  */
 
-PyObject *
-load_png_fast_progressive (char *filename,
-                           PyObject *get_buffer_callback)
+#ifndef SWIG
+static PyObject *
+load_png_fast (char *filename,
+               PyObject *get_buffer_callback,
+               int x, int y, PyObject *tile_row_callback)
 {
   // Note: we are not using the method that libpng calls "Reading PNG
   // files progressively". That method would involve feeding the data
@@ -429,15 +822,27 @@ load_png_fast_progressive (char *filename,
     input_buffer_format = TYPE_RGBA_8;
   }
 
+  // When loading into tiles, 16 bit data stays 16 bit until it gets
+  // converted to fix15.
   input_buffer_to_nparray = cmsCreateTransform
         (input_buffer_profile, input_buffer_format,
-         nparray_data_profile, TYPE_RGBA_8,
+         nparray_data_profile,
+         (tile_row_callback && bit_depth == 16) ? TYPE_RGBA_16 : TYPE_RGBA_8,
          INTENT_PERCEPTUAL, 0);
 
   width = png_get_image_width(png_ptr, info_ptr);
   height = png_get_image_height(png_ptr, info_ptr);
   rows_left = height;
 
+  if (tile_row_callback) {
+    if (! png_read_into_tiles(png_ptr, input_buffer_to_nparray,
+                              width, height, bit_depth,
+                              x, y, tile_row_callback)) {
+      goto cleanup;
+    }
+    rows_left = 0;
+  }
+
   while (rows_left) {
     PyObject *pyarr = NULL;
     uint32_t rows = 0;
@@ -525,3 +930,30 @@ load_png_fast_progressive (char *filename,
 
   return result;
 }
+#endif
+
+PyObject *
+load_png_fast_progressive (char *filename,
+                           PyObject *get_buffer_callback)
+{
+  return load_png_fast(filename, get_buffer_callback, 0, 0, NULL);
+}
+
+/** load_png_fast_into_tiles:
+ *
+ * @filename: filename to load, in the system encoding
+ * @x, @y: model position of the top left pixel
+ * @tile_row_callback: a Python callable returning arrays to write tiles to
+ * returns: a dict of flags describing what was read, as above.
+ *
+ * Like load_png_fast_progressive(), but converts the image straight into
+ * 16-bit premultiplied tiles, skipping fully transparent ones. See
+ * png_read_into_tiles() for the callback.
+ */
+
+PyObject *
+load_png_fast_into_tiles (char *filename, int x, int y,
+                          PyObject *tile_row_callback)
+{
+  return load_png_fast(filename, NULL, x, y, tile_row_callback);
+}
@@ -8,6 +8,7 @@
 
 from math import floor, ceil, isnan
 import os, sys, hashlib, zipfile, colorsys, urllib, gc
+from collections import OrderedDict
 import numpy
 
 # Avoid pulling in PyGTK+ when using GI
@@ -100,6 +101,68 @@ def rotated_rectangle_bbox(corners):
     y2 = int(floor(max(list_y)))
     return x1, y1, x2-x1+1, y2-y1+1
 
+def tiles_in_convex_polygon(corners, N):
+    """Returns the (tx, ty) of all tiles touched by a convex polygon.
+
+    `corners` are the polygon's vertices in order, e.g. a rotated view
+    rectangle. Unlike the bbox of the polygon, this leaves out the tiles in
+    the corners.
+    """
+    list_y = [y for (x, y) in corners]
+    edges = zip(corners, corners[1:] + corners[:1])
+    tiles = []
+    for ty in xrange(int(floor(min(list_y)/N)), int(floor(max(list_y)/N))+1):
+        band_y0, band_y1 = ty*N, (ty+1)*N
+        # x range of the polygon within this row of tiles
+        xs = []
+        for (x0, y0), (x1, y1) in edges:
+            if y0 > y1:
+                x0, y0, x1, y1 = x1, y1, x0, y0
+            if y1 < band_y0 or y0 > band_y1:
+                continue
+            if y0 == y1:
+                xs += [x0, x1]
+                continue
+            for y in (max(y0, band_y0), min(y1, band_y1)):
+                xs.append(x0 + (x1-x0) * (y-y0) / (y1-y0))
+        if not xs:
+            continue
+        for tx in xrange(int(floor(min(xs)/N)), int(floor(max(xs)/N))+1):
+            tiles.append((tx, ty))
+    return tiles
+
+class LRUCache:
+    """Dictionary-like cache which drops the least recently used items.
+
+    Only `get()` counts as a use. At most `max_items` items are kept.
+    """
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = OrderedDict()
+    def get(self, key, default=None):
+        if key not in self._items:
+            return default
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+    def __contains__(self, key):
+        return key in self._items
+    def __len__(self):
+        return len(self._items)
+    def pop(self, key, default=None):
+        return self._items.pop(key, default)
+    def keys(self):
+        return self._items.keys()
+    def values(self):
+        return self._items.values()
+    def clear(self):
+        self._items.clear()
+
 def clamp(x, lo, hi):
     if x < lo: return lo
     if x > hi: return hi
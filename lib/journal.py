@@ -0,0 +1,586 @@
+# This file is part of MyPaint.
+# Copyright (C) 2013 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Crash recovery journal for a document.
+
+The journal is an append-only file which records every change to the
+document's undo stack as it happens, so that unsaved work can be recovered
+after a crash. It starts with an origin record naming the file that the
+document was loaded from (or an ORA checkpoint written by `compact()`),
+followed by records of these types:
+
+* ``'L'``: the layer structure (ids, names, opacities etc.)
+* ``'s'``: a finished brushstroke which can be replayed with the brush engine
+* ``'t'``: compressed tile deltas for all other changes to a layer
+
+Every record is a tag byte followed by a big-endian 32 bit length and the
+payload, like the strokemap format. A truncated record at the end of the file
+(from a crash while writing) is ignored on recovery.
+
+Each running instance keeps its journal in its own subdirectory, which it
+holds an exclusive lock on. The lock goes away with the process, so only
+the journals of instances which are no longer running are ever recovered.
+
+"""
+
+import os, time, struct, zlib, json, threading, traceback
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+from Queue import Queue
+from glob import glob
+from cStringIO import StringIO
+
+import numpy
+
+import tiledsurface, command, stroke, layer, pixbufsurface
+
+N = tiledsurface.N
+
+JOURNAL_HEADER = 'MyPaint journal 1\n'
+JOURNAL_FILENAME = 'journal.dat'
+
+#: Seconds between fsync() calls of the background writer
+FSYNC_INTERVAL = 2.0
+#: Journal size (bytes) above which `compact_if_needed()` writes a checkpoint
+COMPACT_SIZE = 64*1024*1024
+#: zlib level for tile deltas; fast, since it runs while the user paints
+TILE_COMPRESSION_LEVEL = 1
+
+
+class JournalError(Exception):
+    """Raised when a journal cannot be replayed."""
+    pass
+
+
+class Journal:
+    """Append-only crash recovery journal for a `document.Document`.
+
+    The journal observes the command stack of `doc`. Each change is turned
+    into stroke or tile delta records, which are compressed and written by a
+    background thread. The journal file and its checkpoints live in a
+    subdirectory of `dirname` which is locked by this instance. Call
+    `start()` whenever a new document is created or loaded,
+    `document_saved()` after saving, and `remove()` on clean shutdown.
+
+    If a record cannot be written, journaling stops and the journal file is
+    deleted, and `error_observers` get told. It restarts with the next
+    `start()` or `compact()`.
+
+    """
+
+    def __init__(self, doc, dirname):
+        self.doc = doc
+        _makedir(dirname)
+        self._lock_file = None
+        self.dirname = self._claim_instance_dir(dirname)
+        self.filename = os.path.join(self.dirname, JOURNAL_FILENAME)
+        self.origin = None
+        self.size = 0
+        #: Why the background writer failed, or None. See `error_observers`.
+        self.error = None
+        #: Callbacks invoked with the error message after the writer failed.
+        #: They run in the main thread, from `compact_if_needed()` or the
+        #: next change to the document.
+        self.error_observers = []
+        self._error_reported = False
+        self._queue = Queue()
+        self._writer = None
+        self._active = False
+        self._layer_ids = {}    # layer -> journal layer id
+        self._tiledicts = {}    # journal layer id -> last journaled tiledict
+        self._structure = None
+        self._last_command = None
+        self._next_layer_id = 0
+        doc.command_stack_observers.append(self._command_stack_changed_cb)
+
+    # Lifecycle
+
+    def start(self, origin=None):
+        """Start a new journal for the current state of the document.
+
+        :param origin: filename the document was just loaded from or saved
+            to (OpenRaster only), or None for a new empty document.
+
+        Any previous journal is replaced.
+
+        """
+        self.stop()
+        self.doc.split_stroke()
+        self._open(origin)
+
+    def stop(self):
+        """Stop journaling and wait for pending records to be written."""
+        self._active = False
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+        # a failed writer leaves records behind
+        self._queue = Queue()
+
+    def unlock(self):
+        """Releases the instance directory, as if this process had exited.
+
+        The journal can be recovered by another `Journal` afterwards.
+
+        """
+        self.stop()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _claim_instance_dir(self, basedir):
+        i = 0
+        while True:
+            dirname = os.path.join(basedir, 'instance-%d' % i)
+            _makedir(dirname)
+            f = open(os.path.join(dirname, 'lock'), 'a')
+            if _try_lock(f):
+                self._lock_file = f
+                return dirname
+            f.close()
+            i += 1
+
+    def _writer_failed(self, error):
+        # Called in the writer thread. A journal with a gap would recover a
+        # wrong document without any warning, so it is removed instead.
+        self._active = False
+        self.error = error
+        try:
+            os.remove(self.filename)
+        except OSError:
+            traceback.print_exc()
+
+    def _report_error(self):
+        if self.error is None or self._error_reported:
+            return
+        self._error_reported = True
+        for func in self.error_observers:
+            func(self.error)
+
+    def remove(self):
+        """Stop journaling and delete the journal (clean shutdown)."""
+        self.stop()
+        for fn in [self.filename] + self._get_checkpoints():
+            if os.path.exists(fn):
+                os.remove(fn)
+
+    def document_saved(self, filename):
+        """Notify that the document was saved to `filename`.
+
+        After saving to OpenRaster, the saved file becomes the new origin and
+        the journal restarts empty. Other formats don't keep the layers, so
+        the journal only gets compacted if the origin itself was overwritten.
+
+        """
+        if os.path.splitext(filename)[1].lower() == '.ora':
+            self.start(os.path.abspath(filename))
+        elif self.origin and os.path.abspath(filename) == self.origin['path']:
+            self.compact()
+
+    def compact(self):
+        """Write a full ORA checkpoint and start a new, empty journal.
+
+        This is also used to start journaling after `recover()`.
+
+        """
+        self.doc.split_stroke()
+        self.stop()
+        old_checkpoints = self._get_checkpoints()
+        serial = 1
+        while os.path.join(self.dirname, 'checkpoint-%03d.ora' % serial) in old_checkpoints:
+            serial += 1
+        fn = os.path.join(self.dirname, 'checkpoint-%03d.ora' % serial)
+        t0 = time.time()
+        self.doc.save_ora(fn, compression_level=pixbufsurface.FAST_COMPRESSION_LEVEL,
+                          parallel_deflate=True)
+        print '%.3fs journal compaction' % (time.time() - t0)
+        self._open(fn, checkpoint=True)
+        for old in old_checkpoints:
+            os.remove(old)
+
+    def compact_if_needed(self):
+        """Compaction for periodic calls; only compacts a big journal."""
+        self._report_error()
+        if self._active and self.size > COMPACT_SIZE:
+            self.compact()
+        return True
+
+    def _get_checkpoints(self):
+        return glob(os.path.join(self.dirname, 'checkpoint-*.ora'))
+
+    def _open(self, origin, checkpoint=False):
+        self._layer_ids = {}
+        self._tiledicts = {}
+        self._structure = None
+        self._last_command = self.doc.get_last_command()
+        # 'filename' is the user's name for the document, which survives
+        # compaction into checkpoints
+        if checkpoint:
+            filename = self.origin and self.origin['filename']
+        else:
+            filename = origin
+        if origin:
+            self.origin = {'path': origin, 'mtime': os.path.getmtime(origin),
+                           'checkpoint': checkpoint, 'filename': filename}
+        else:
+            self.origin = {'path': None, 'mtime': None, 'checkpoint': False,
+                           'filename': None}
+        # write the head of the new journal to a temporary file and rename
+        # it, so that a crash leaves either the old or the new journal
+        tmp = self.filename + '.new'
+        f = open(tmp, 'wb')
+        f.write(JOURNAL_HEADER)
+        self.size = len(JOURNAL_HEADER)
+        self._write_record(f, 'o', json.dumps(self.origin))
+        # without an origin file, recovery starts with empty layers
+        self._write_record(f, 'L', self._get_structure(initial=True,
+                                                       all_empty=not origin))
+        self._get_structure()
+        initial_tiles = []
+        for l in self.doc.layers:
+            lid = self._layer_ids[l]
+            tiledict = l._surface.save_snapshot().tiledict
+            self._tiledicts[lid] = tiledict
+            if not origin and tiledict:
+                initial_tiles.append(('t', lid, {}, tiledict))
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename) # windows needs that
+        os.rename(tmp, self.filename)
+        self._writer = _JournalWriter(self, open(self.filename, 'ab'))
+        self._writer.start()
+        for item in initial_tiles:
+            self._queue.put(item)
+        self.error = None
+        self._error_reported = False
+        self._active = True
+
+    def _write_record(self, f, tag, data):
+        f.write(tag)
+        f.write(struct.pack('>I', len(data)))
+        f.write(data)
+        self.size += 5 + len(data)
+
+    # Recording
+
+    def _get_structure(self, initial=False, all_empty=False):
+        layers = []
+        for l in self.doc.layers:
+            if l not in self._layer_ids:
+                self._layer_ids[l] = self._next_layer_id
+                self._next_layer_id += 1
+            # the empty flag maps checkpoint layers back, see `recover()`
+            layers.append([self._layer_ids[l], l.name, l.opacity, l.visible,
+                           l.locked, l.compositeop,
+                           initial and (all_empty or l.is_empty())])
+        structure = json.dumps({'layers': layers, 'selected': self.doc.layer_idx})
+        self._structure = structure
+        return structure
+
+    def _command_stack_changed_cb(self, stack):
+        if not self._active:
+            self._report_error()
+            return
+        structure = self._structure
+        if self._get_structure() != structure:
+            self._queue.put(('L', self._structure))
+        # forget layers which are not in the document or the undo stack any more
+        present = set(self._layer_ids[l] for l in self.doc.layers)
+        for lid in self._tiledicts.keys():
+            if lid not in present:
+                del self._tiledicts[lid]
+        self._layer_ids = dict((l, lid) for (l, lid) in self._layer_ids.iteritems()
+                               if lid in present)
+
+        cmd = self._get_changed_command(stack)
+        layers = self._get_touched_layers(cmd)
+        if layers is None:
+            layers = self.doc.layers
+        for l in layers:
+            lid = self._layer_ids[l]
+            old = self._tiledicts.get(lid, {})
+            if l._surface.tiledict == old:
+                continue
+            new = l._surface.save_snapshot().tiledict
+            self._tiledicts[lid] = new
+            if (isinstance(cmd, command.Stroke)
+                    and cmd.before[1].tiledict == old
+                    and cmd.after[1].tiledict == new
+                    and self.doc.get_symmetry_axis() is None):
+                self._queue.put(('s', lid, cmd.stroke))
+            else:
+                self._queue.put(('t', lid, old, new))
+
+    def _get_changed_command(self, stack):
+        # the command which was just done, undone, redone or updated
+        last = self._last_command
+        self._last_command = stack.get_last_command()
+        if stack.redo_stack and stack.redo_stack[-1] is last:
+            return last
+        return self._last_command
+
+    def _get_touched_layers(self, cmd):
+        """Returns the layers whose pixels `cmd` may have changed.
+
+        Returns None for structural or unknown commands; all layers have
+        to be compared then.
+
+        """
+        if isinstance(cmd, (command.Stroke, command.ClearLayer, command.LoadLayer)):
+            return [self.doc.layer]
+        elif isinstance(cmd, command.ConvertLayerToNormalMode):
+            return [cmd.layer]
+        elif isinstance(cmd, command.MoveLayer):
+            return [self.doc.layers[cmd.layer_idx]]
+        elif isinstance(cmd, _PROPERTY_COMMANDS):
+            return []
+        return None
+
+    # Recovery
+
+    def is_recoverable(self):
+        """True if the journal on disk contains any unsaved changes."""
+        if not os.path.exists(self.filename):
+            return False
+        try:
+            records = list(read_records(self.filename))
+        except JournalError:
+            return False
+        origin = json.loads(records[0][1])
+        return origin['checkpoint'] or len(records) > 2
+
+    def recover(self, feedback_cb=None):
+        """Restore the document from the journal on disk.
+
+        Loads the origin file into the document, then replays all complete
+        records. Returns the user's filename of the document (None for a
+        document which was never saved or loaded). Raises `JournalError` if
+        the journal cannot be replayed. Journaling stays stopped; use
+        `compact()` to continue with a checkpoint of the recovered document.
+
+        """
+        self.stop()
+        doc = self.doc
+        records = read_records(self.filename)
+        tag, data = records.next()
+        origin = json.loads(data)
+        path = origin['path']
+        if path:
+            if not os.path.isfile(path) or os.path.getmtime(path) != origin['mtime']:
+                raise JournalError('The file %r was modified since the journal was written' % path)
+            doc.load(path, feedback_cb=feedback_cb)
+        else:
+            doc.clear()
+
+        tag, data = records.next()
+        assert tag == 'L'
+        structure = json.loads(data)
+        loaded = [l for l in doc.layers if not l.is_empty()]
+        loaded.reverse()
+        id2layer = {}
+        for props in structure['layers']:
+            lid, empty = props[0], props[-1]
+            if not empty:
+                if not loaded:
+                    raise JournalError('The origin file does not match the journal')
+                id2layer[lid] = loaded.pop()
+        if loaded:
+            raise JournalError('The origin file does not match the journal')
+        self._apply_structure(structure, id2layer)
+
+        count = 0
+        for tag, data in records:
+            if tag == 'L':
+                self._apply_structure(json.loads(data), id2layer)
+            elif tag == 's':
+                f = StringIO(data)
+                lid, = struct.unpack('>I', f.read(4))
+                fields = []
+                for i in range(3):
+                    length, = struct.unpack('>I', f.read(4))
+                    fields.append(f.read(length))
+                s = stroke.Stroke()
+                s.brush_settings, s.brush_state, s.stroke_data = fields
+                s.total_painting_time, = struct.unpack('>d', f.read(8))
+                s.finished = True
+                l = id2layer[lid]
+                snapshot_before = l.save_snapshot()
+                s.render(l._surface)
+                l.add_stroke(s, snapshot_before)
+                doc.unsaved_painting_time += s.total_painting_time
+            elif tag == 't':
+                f = StringIO(data)
+                lid, n = struct.unpack('>II', f.read(8))
+                l = id2layer[lid]
+                d = l._surface.tiledict.copy()
+                for i in xrange(n):
+                    tx, ty, length = struct.unpack('>iiI', f.read(12))
+                    if length == 0:
+                        d.pop((tx, ty), None)
+                        continue
+                    t = tiledsurface.Tile()
+                    t.rgba[:] = numpy.fromstring(zlib.decompress(f.read(length)),
+                                                 dtype='uint16').reshape((N, N, 4))
+                    d[(tx, ty)] = t
+                sshot = tiledsurface.SurfaceSnapshot()
+                sshot.tiledict = d
+                l._surface.load_snapshot(sshot)
+                # unknown painting time; assume something worth a question
+                doc.unsaved_painting_time += 1.0
+            count += 1
+            if feedback_cb and count % 16 == 0:
+                feedback_cb()
+
+        doc.command_stack.clear()
+        doc.call_doc_observers()
+        doc.invalidate_all()
+        self.origin = origin
+        return origin['filename']
+
+    def _apply_structure(self, structure, id2layer):
+        doc = self.doc
+        doc.layers = []
+        for lid, name, opacity, visible, locked, compositeop, empty in structure['layers']:
+            l = id2layer.get(lid)
+            if l is None:
+                l = layer.Layer(name)
+                l.content_observers.append(doc.layer_modified_cb)
+                l.set_symmetry_axis(doc.get_symmetry_axis())
+                id2layer[lid] = l
+            l.name = name
+            l.opacity = opacity
+            l.visible = visible
+            l.locked = locked
+            l.compositeop = compositeop
+            doc.layers.append(l)
+        doc.layer_idx = structure['selected']
+
+
+#: Commands which change nothing but the structure record
+_PROPERTY_COMMANDS = (command.SelectLayer, command.ReorderSingleLayer,
+                      command.ReorderLayers, command.RenameLayer,
+                      command.SetLayerVisibility, command.SetLayerLocked,
+                      command.SetLayerOpacity, command.SetLayerCompositeOp)
+
+
+def _makedir(dirname):
+    try:
+        os.mkdir(dirname)
+    except OSError:
+        # may have been created by another instance meanwhile
+        if not os.path.isdir(dirname):
+            raise
+
+
+def _try_lock(f):
+    """Takes an exclusive lock on an open file without blocking."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def read_records(filename):
+    """Iterates over the complete (tag, data) records of a journal file."""
+    f = open(filename, 'rb')
+    try:
+        if f.read(len(JOURNAL_HEADER)) != JOURNAL_HEADER:
+            raise JournalError('Not a MyPaint journal: %r' % filename)
+        while True:
+            head = f.read(5)
+            if len(head) < 5:
+                break
+            tag, length = head[0], struct.unpack('>I', head[1:])[0]
+            data = f.read(length)
+            if len(data) < length:
+                print 'Warning: ignoring truncated journal record'
+                break
+            yield tag, data
+    finally:
+        f.close()
+
+
+class _JournalWriter(threading.Thread):
+    """Background thread compressing and appending journal records."""
+
+    def __init__(self, journal, f):
+        threading.Thread.__init__(self, name='JournalWriter')
+        self.daemon = True
+        self.journal = journal
+        self.queue = journal._queue
+        self.f = f
+
+    def run(self):
+        last_fsync = time.time()
+        dirty = False
+        f = self.f
+        while True:
+            if dirty and self.queue.empty():
+                f.flush()
+                if time.time() - last_fsync > FSYNC_INTERVAL:
+                    os.fsync(f.fileno())
+                    last_fsync = time.time()
+                    dirty = False
+            item = self.queue.get()
+            if item is None:
+                break
+            try:
+                tag, data = self.encode(item)
+                self.journal._write_record(f, tag, data)
+                dirty = True
+            except Exception, e:
+                # never take the application down because of the journal,
+                # but don't carry on with a gap in it either
+                traceback.print_exc()
+                f.close()
+                self.journal._writer_failed(str(e) or e.__class__.__name__)
+                return
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+
+    def encode(self, item):
+        tag = item[0]
+        if tag == 'L':
+            return tag, item[1]
+        elif tag == 's':
+            lid, s = item[1:]
+            f = StringIO()
+            f.write(struct.pack('>I', lid))
+            for field in [s.brush_settings, s.brush_state, s.stroke_data]:
+                f.write(struct.pack('>I', len(field)))
+                f.write(field)
+            f.write(struct.pack('>d', s.total_painting_time))
+            return tag, f.getvalue()
+        elif tag == 't':
+            lid, old, new = item[1:]
+            changed = [pos for pos, t in new.iteritems() if old.get(pos) is not t]
+            removed = [pos for pos in old if pos not in new]
+            f = StringIO()
+            f.write(struct.pack('>II', lid, len(changed) + len(removed)))
+            for tx, ty in changed:
+                # tiles in a snapshot are readonly, safe to read from this thread
+                data = zlib.compress(new[(tx, ty)].get_readonly_rgba().tostring(),
+                                     TILE_COMPRESSION_LEVEL)
+                f.write(struct.pack('>iiI', tx, ty, len(data)))
+                f.write(data)
+            for tx, ty in removed:
+                f.write(struct.pack('>iiI', tx, ty, 0))
+            return tag, f.getvalue()
+        raise ValueError, 'unknown journal record %r' % tag
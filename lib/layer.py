@@ -136,6 +136,10 @@ class Layer:
         self.strokes = strokes[:]
         self._surface.load_snapshot(data)
 
+    def save_surface_snapshot(self):
+        """Snapshots the pixels alone, sharing the surface's readonly tiles."""
+        return self._surface.save_snapshot()
+
 
     def translate(self, dx, dy):
         """Translate a layer non-interactively.
@@ -205,6 +209,9 @@ class Layer:
             else:
                 assert False, 'invalid strokemap'
 
+    def blit_tile_into(self, dst, dst_has_alpha, tx, ty, mipmap_level=0):
+        self._surface.blit_tile_into(dst, dst_has_alpha, tx, ty, mipmap_level)
+
     def composite_tile(self, dst, dst_has_alpha, tx, ty, mipmap_level=0):
         self._surface.composite_tile(
             dst, dst_has_alpha, tx, ty,
@@ -213,6 +220,9 @@ class Layer:
             mode=self.compositeop
             )
 
+    def update_mipmaps(self, tiles, mipmap_level):
+        self._surface.update_mipmaps(tiles, mipmap_level)
+
     def merge_into(self, dst):
         """
         Merge this layer into dst, modifying only dst.
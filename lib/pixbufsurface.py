@@ -13,7 +13,8 @@ from gui import pygtkcompat
 from gtk import gdk
 import mypaintlib,  helpers
 from tiledsurface import N
-import sys, contextlib
+import sys, contextlib, threading, multiprocessing
+from collections import deque
 import numpy
 
 class Surface:
@@ -106,6 +107,19 @@ class Surface:
 # throttle excesssive calls to the save/render feedback_cb
 TILES_PER_CALLBACK = 256
 
+# threads compositing tile rows while save_as_png() compresses earlier ones
+try:
+    RENDER_THREADS = multiprocessing.cpu_count()
+except NotImplementedError:
+    RENDER_THREADS = 1
+# maximum number of rendered tile rows waiting for the PNG writer
+RENDER_ROWS_AHEAD = 2*RENDER_THREADS
+
+# zlib level for PNG output: 2 is a good size/speed tradeoff, autosaves
+# may prefer FAST_COMPRESSION_LEVEL (see fastpng.hpp for measurements)
+DEFAULT_COMPRESSION_LEVEL = 2
+FAST_COMPRESSION_LEVEL = 1
+
 def render_as_pixbuf(surface, *rect, **kwargs):
     alpha = kwargs.get('alpha', False)
     mipmap_level = kwargs.get('mipmap_level', 0)
@@ -123,10 +137,100 @@ def render_as_pixbuf(surface, *rect, **kwargs):
             tn += 1
     return s.pixbuf
 
+class _TileRowJob:
+    """A tile row to be rendered by a _TileRowRenderer worker thread."""
+    def __init__(self, ty, arr):
+        self.ty = ty
+        self.arr = arr
+        self.exc_info = None
+        self.done = threading.Event()
+
+
+class _TileRowRenderer:
+    """Renders tile rows on worker threads, in a bounded pipeline.
+
+    The pixel work in mypaintlib releases the GIL, so rows further down
+    can be composited while the consumer (usually libpng compressing in
+    save_png_fast_progressive) is busy with the current one.
+    """
+
+    def __init__(self, render_row, shape, num_threads, rows_ahead):
+        self.render_row = render_row
+        self.shape = shape
+        self.rows_ahead = max(rows_ahead, 1)
+        self.jobs = deque()
+        self.free_arrays = []
+        self.cancelled = False
+        self.cond = threading.Condition()
+        self.todo = deque()
+        self.threads = []
+        for i in xrange(num_threads):
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.todo:
+                    self.cond.wait()
+                job = self.todo.popleft()
+            if job is None:
+                return
+            if not self.cancelled:
+                try:
+                    self.render_row(job.arr, job.ty)
+                except:
+                    job.exc_info = sys.exc_info()
+            job.done.set()
+
+    def _submit(self, job):
+        with self.cond:
+            self.todo.append(job)
+            self.cond.notify()
+
+    def iter_rows(self, rows):
+        """Yields (ty, arr) in order; arr is reused after the next step."""
+        rows = iter(rows)
+        try:
+            while True:
+                while len(self.jobs) < self.rows_ahead:
+                    ty = next(rows, None)
+                    if ty is None:
+                        break
+                    if self.free_arrays:
+                        arr = self.free_arrays.pop()
+                    else:
+                        arr = numpy.empty(self.shape, 'uint8')
+                    job = _TileRowJob(ty, arr)
+                    self.jobs.append(job)
+                    self._submit(job)
+                if not self.jobs:
+                    break
+                job = self.jobs.popleft()
+                job.done.wait()
+                if job.exc_info:
+                    raise job.exc_info[0], job.exc_info[1], job.exc_info[2]
+                yield job.ty, job.arr
+                self.free_arrays.append(job.arr)
+        finally:
+            self.cancelled = True
+            for t in self.threads:
+                self._submit(None)
+            for t in self.threads:
+                t.join()
+
+
 def save_as_png(surface, filename, *rect, **kwargs):
     alpha = kwargs['alpha']
     feedback_cb = kwargs.get('feedback_cb', None)
     write_legacy_png = kwargs.get("write_legacy_png", True)
+    render_threads = kwargs.get('render_threads', RENDER_THREADS)
+    compression_level = kwargs.get('compression_level',
+                                   DEFAULT_COMPRESSION_LEVEL)
+    parallel_deflate = kwargs.get('parallel_deflate', False)
+    single_tile_pattern = kwargs.get('single_tile_pattern', False)
     if not rect:
         rect = surface.get_bbox()
     x, y, w, h = rect
@@ -140,19 +244,31 @@ def save_as_png(surface, filename, *rect, **kwargs):
     render_tw = (x+w-1)/N - render_tx + 1
     render_th = (y+h-1)/N - render_ty + 1
 
-    # buffer for rendering one tile row at a time
-    arr = numpy.empty((1*N, render_tw*N, 4), 'uint8') # rgba or rgbu
-    # view into arr without the horizontal padding
-    arr_xcrop = arr[:,x-render_tx*N:x-render_tx*N+w,:]
-
     first_row = render_ty
     last_row = render_ty+render_th-1
+    row_shape = (1*N, render_tw*N, 4) # rgba or rgbu
+
+    def render_tile_row(arr, ty):
+        for tx_rel in xrange(render_tw):
+            dst = arr[:,tx_rel*N:(tx_rel+1)*N,:]
+            surface.blit_tile_into(dst, alpha, render_tx+tx_rel, ty)
+
+    def crop_scanlines(arr, ty):
+        # a numpy array of the scanline without padding
+        res = arr[:,x-render_tx*N:x-render_tx*N+w,:]
+        if ty == last_row:
+            res = res[:y+h-ty*N,:,:]
+        if ty == first_row:
+            res = res[y-render_ty*N:,:,:]
+        return res
 
     def render_tile_scanlines():
+        # buffer for rendering one tile row at a time
+        arr = numpy.empty(row_shape, 'uint8')
         feedback_counter = 0
         for ty in range(render_ty, render_ty+render_th):
             skip_rendering = False
-            if kwargs.get('single_tile_pattern', False):
+            if single_tile_pattern:
                 # optimization for simple background patterns (e.g. solid color)
                 if ty != first_row:
                     skip_rendering = True
@@ -167,16 +283,30 @@ def save_as_png(surface, filename, *rect, **kwargs):
                     feedback_cb()
                 feedback_counter += 1
 
-            # yield a numpy array of the scanline without padding
-            res = arr_xcrop
-            if ty == last_row:
-                res = res[:y+h-ty*N,:,:]
-            if ty == first_row:
-                res = res[y-render_ty*N:,:,:]
-            yield res
+            yield crop_scanlines(arr, ty)
+
+    def render_tile_scanlines_threaded():
+        renderer = _TileRowRenderer(render_tile_row, row_shape,
+                                    render_threads, RENDER_ROWS_AHEAD)
+        feedback_counter = 0
+        rows = xrange(render_ty, render_ty+render_th)
+        for ty, arr in renderer.iter_rows(rows):
+            # GTK is not thread safe: feedback only from the calling thread
+            if feedback_cb and feedback_counter >= TILES_PER_CALLBACK:
+                feedback_cb()
+                feedback_counter = 0
+            feedback_counter += render_tw
+            yield crop_scanlines(arr, ty)
+
+    if render_threads > 1 and render_th > 1 and not single_tile_pattern:
+        scanlines = render_tile_scanlines_threaded()
+    else:
+        scanlines = render_tile_scanlines()
 
     filename_sys = filename.encode(sys.getfilesystemencoding())
     # FIXME: should not do that, should use open(unicode_object)
     mypaintlib.save_png_fast_progressive(filename_sys, w, h, alpha,
-                                         render_tile_scanlines(),
-                                         write_legacy_png)
+                                         scanlines,
+                                         write_legacy_png,
+                                         compression_level,
+                                         parallel_deflate)
@@ -47,6 +47,163 @@ void tile_downscale_rgba16(PyObject *src, PyObject *dst, int dst_x, int dst_y) {
   }
 }
 
+// Build a mipmap tile from its four child tiles at the next lower level,
+// in one call instead of four. Missing children (None) are transparent.
+// Returns false if all children were missing, and dst was left alone.
+bool tile_downscale_rgba16_children(PyObject *src00, PyObject *src10,
+                                    PyObject *src01, PyObject *src11,
+                                    PyObject *dst) {
+  PyObject * children[4] = {src00, src10, src01, src11};
+  bool any = false;
+  for (int i=0; i<4; i++) {
+    if (children[i] != Py_None) any = true;
+  }
+  if (!any) return false;
+
+  PyArrayObject* dst_arr = ((PyArrayObject*)dst);
+  for (int i=0; i<4; i++) {
+    const int dst_x = (i%2) * MYPAINT_TILE_SIZE/2;
+    const int dst_y = (i/2) * MYPAINT_TILE_SIZE/2;
+    if (children[i] != Py_None) {
+      tile_downscale_rgba16(children[i], dst, dst_x, dst_y);
+    } else {
+      for (int y=0; y<MYPAINT_TILE_SIZE/2; y++) {
+        uint16_t * dst_p = (uint16_t*)(dst_arr->data + (y+dst_y)*dst_arr->strides[0]);
+        memset(dst_p + 4*dst_x, 0, MYPAINT_TILE_SIZE/2*4*sizeof(uint16_t));
+      }
+    }
+  }
+  return true;
+}
+
+
+// Copy a tile into a 2x2 block of target tiles, shifted right and down by
+// (dx, dy) with 0 <= dx, dy < TILE_SIZE. The source rows are split into
+// two slices each, one per target tile. Targets which would receive no
+// pixels, or are None, are skipped. Used for non-integral layer moves.
+void tile_translate_rgba16(PyObject *src,
+                           PyObject *dst00, PyObject *dst10,
+                           PyObject *dst01, PyObject *dst11,
+                           int dx, int dy) {
+  const int N = MYPAINT_TILE_SIZE;
+  assert(dx >= 0 && dx < N && dy >= 0 && dy < N);
+  PyObject * targets[4] = {dst00, dst10, dst01, dst11};
+  char * dst_data[4];
+  npy_intp dst_stride[4];
+  for (int i=0; i<4; i++) {
+    if (targets[i] == Py_None) {
+      dst_data[i] = NULL;
+      continue;
+    }
+#ifdef HEAVY_DEBUG
+    assert(PyArray_TYPE(targets[i]) == NPY_UINT16);
+    assert(PyArray_ISCARRAY(targets[i]));
+#endif
+    dst_data[i] = ((PyArrayObject*)targets[i])->data;
+    dst_stride[i] = ((PyArrayObject*)targets[i])->strides[0];
+  }
+  PyArrayObject* src_arr = ((PyArrayObject*)src);
+  const char * src_data = src_arr->data;
+  const npy_intp src_stride = src_arr->strides[0];
+  const size_t pixel_size = 4*sizeof(uint16_t);
+
+  // plain memory copies from here on, other threads may run meanwhile
+  Py_BEGIN_ALLOW_THREADS
+  for (int y=0; y<N; y++) {
+    const int row = (y+dy >= N) ? 2 : 0;
+    const int dst_y = (y+dy) % N;
+    const char * src_p = src_data + y*src_stride;
+    char * left = dst_data[row];
+    char * right = dst_data[row+1];
+    if (left) {
+      memcpy(left + dst_y*dst_stride[row] + dx*pixel_size,
+             src_p, (N-dx)*pixel_size);
+    }
+    if (right && dx) {
+      memcpy(right + dst_y*dst_stride[row+1],
+             src_p + (N-dx)*pixel_size, dx*pixel_size);
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
+
+// Resample an RGBA8 image into another one through an affine transformation,
+// for rotated, mirrored or zoomed views. The matrix maps dst pixel
+// coordinates to src pixel coordinates, like a cairo matrix:
+//
+//   src_x = xx*dst_x + xy*dst_y + x0
+//   src_y = yx*dst_x + yy*dst_y + y0
+//
+// Pixel centres are at integer coordinates. dst pixels mapping outside of
+// src are made transparent. Interpolation is bilinear, or nearest neighbour
+// if bilinear is false.
+void resample_affine_rgba8(PyObject *src, PyObject *dst,
+                           double xx, double yx, double xy, double yy,
+                           double x0, double y0, bool bilinear)
+{
+#ifdef HEAVY_DEBUG
+  assert(PyArray_TYPE(src) == NPY_UINT8);
+  assert(PyArray_DIM(src, 2) == 4);
+  assert(PyArray_TYPE(dst) == NPY_UINT8);
+  assert(PyArray_DIM(dst, 2) == 4);
+#endif
+  PyArrayObject* src_arr = ((PyArrayObject*)src);
+  PyArrayObject* dst_arr = ((PyArrayObject*)dst);
+  const int src_w = PyArray_DIM(src, 1);
+  const int src_h = PyArray_DIM(src, 0);
+  const int dst_w = PyArray_DIM(dst, 1);
+  const int dst_h = PyArray_DIM(dst, 0);
+  const npy_intp src_stride = src_arr->strides[0];
+  const char * src_data = src_arr->data;
+  char * dst_data = dst_arr->data;
+  const npy_intp dst_stride = dst_arr->strides[0];
+
+  Py_BEGIN_ALLOW_THREADS
+  for (int y=0; y<dst_h; y++) {
+    uint8_t * dst_p = (uint8_t*)(dst_data + y*dst_stride);
+    // step along the row incrementally
+    double sx = xy*y + x0;
+    double sy = yy*y + y0;
+    for (int x=0; x<dst_w; x++, sx+=xx, sy+=yx, dst_p+=4) {
+      if (sx < -0.5 || sy < -0.5 || sx >= src_w-0.5 || sy >= src_h-0.5) {
+        dst_p[0] = dst_p[1] = dst_p[2] = dst_p[3] = 0;
+        continue;
+      }
+      if (!bilinear) {
+        const int ix = (int)(sx + 0.5);
+        const int iy = (int)(sy + 0.5);
+        const uint8_t * s = (const uint8_t*)(src_data + iy*src_stride) + 4*ix;
+        dst_p[0] = s[0]; dst_p[1] = s[1]; dst_p[2] = s[2]; dst_p[3] = s[3];
+        continue;
+      }
+      // 8 bit fixed point weights, clamped to the border pixels
+      const double fx = floor(sx);
+      const double fy = floor(sy);
+      const uint32_t wx = (uint32_t)((sx - fx) * 256);
+      const uint32_t wy = (uint32_t)((sy - fy) * 256);
+      int ix0 = (int)fx, iy0 = (int)fy;
+      int ix1 = ix0 + 1, iy1 = iy0 + 1;
+      if (ix0 < 0) ix0 = 0;
+      if (iy0 < 0) iy0 = 0;
+      if (ix1 > src_w-1) ix1 = src_w-1;
+      if (iy1 > src_h-1) iy1 = src_h-1;
+      const uint8_t * row0 = (const uint8_t*)(src_data + iy0*src_stride);
+      const uint8_t * row1 = (const uint8_t*)(src_data + iy1*src_stride);
+      const uint8_t * p00 = row0 + 4*ix0;
+      const uint8_t * p10 = row0 + 4*ix1;
+      const uint8_t * p01 = row1 + 4*ix0;
+      const uint8_t * p11 = row1 + 4*ix1;
+      for (int c=0; c<4; c++) {
+        const uint32_t top = p00[c]*(256-wx) + p10[c]*wx;
+        const uint32_t bottom = p01[c]*(256-wx) + p11[c]*wx;
+        dst_p[c] = (top*(256-wy) + bottom*wy + (1<<15)) >> 16;
+      }
+    }
+  }
+  Py_END_ALLOW_THREADS
+}
+
 
 #include "compositing.hpp"
 #include "blendmodes.hpp"
@@ -89,6 +246,9 @@ tile_composite_data (PyObject *src,
                                         ((PyArrayObject*)src)->data;
   fix15_short_t*       const dst_p = (fix15_short_t *)
                                         ((PyArrayObject*)dst)->data;
+  // Pure pixel work, so let other Python threads (e.g. the PNG
+  // export pipeline in pixbufsurface.py) run meanwhile.
+  Py_BEGIN_ALLOW_THREADS
   if (dst_has_alpha) {
     BufferComp<BufferCompOutputRGBA, MYPAINT_TILE_SIZE*MYPAINT_TILE_SIZE*4, B>
         ::composite_src_over(src_p, dst_p, opac);
@@ -97,6 +257,7 @@ tile_composite_data (PyObject *src,
     BufferComp<BufferCompOutputRGBX, MYPAINT_TILE_SIZE*MYPAINT_TILE_SIZE*4, B>
         ::composite_src_over(src_p, dst_p, opac);
   }
+  Py_END_ALLOW_THREADS
 }
 
 
@@ -376,6 +537,8 @@ void tile_convert_rgba16_to_rgba8(PyObject * src, PyObject * dst) {
   precalculate_dithering_noise_if_required();
   int noise_idx = 0;
 
+  Py_BEGIN_ALLOW_THREADS
+
   for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
     uint16_t * src_p = (uint16_t*)(src_arr->data + y*src_arr->strides[0]);
     uint8_t  * dst_p = (uint8_t*)(dst_arr->data + y*dst_arr->strides[0]);
@@ -458,6 +621,7 @@ void tile_convert_rgba16_to_rgba8(PyObject * src, PyObject * dst) {
     src_p += src_arr->strides[0];
     dst_p += dst_arr->strides[0];
   }
+  Py_END_ALLOW_THREADS
 }
 
 // used after compositing (when displaying, or when saving solid PNG or JPG)
@@ -486,6 +650,8 @@ void tile_convert_rgbu16_to_rgbu8(PyObject * src, PyObject * dst) {
   precalculate_dithering_noise_if_required();
   int noise_idx = 0;
 
+  Py_BEGIN_ALLOW_THREADS
+
   for (int y=0; y<MYPAINT_TILE_SIZE; y++) {
     uint16_t * src_p = (uint16_t*)(src_arr->data + y*src_arr->strides[0]);
     uint8_t  * dst_p = (uint8_t*)(dst_arr->data + y*dst_arr->strides[0]);
@@ -519,6 +685,7 @@ void tile_convert_rgbu16_to_rgbu8(PyObject * src, PyObject * dst) {
     src_p += src_arr->strides[0];
     dst_p += dst_arr->strides[0];
   }
+  Py_END_ALLOW_THREADS
 }
 
 // used mainly for loading layers (transparent PNG)
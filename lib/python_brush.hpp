@@ -43,6 +43,37 @@ public:
     }
   }
 
+  // Set base values and mappings in bulk, from a float32 array of records
+  //
+  //   setting, -1, base_value
+  //   setting, input, n, x0, y0, ..., x(n-1), y(n-1)
+  //
+  // The records can cover all settings or just the changed ones, see
+  // Brush.update_brushinfo() in brush.py.
+  void set_all_mappings (PyObject * data)
+  {
+    assert(PyArray_NDIM(data) == 1);
+    assert(PyArray_TYPE(data) == NPY_FLOAT32);
+    assert(PyArray_ISCARRAY(data));
+    const npy_float32 * p = (npy_float32*)PyArray_DATA(data);
+    const npy_float32 * end = p + PyArray_DIM(data, 0);
+    while (p < end) {
+      const int id = p[0];
+      const int input = p[1];
+      if (input < 0) {
+        set_base_value(id, p[2]);
+        p += 3;
+        continue;
+      }
+      const int n = p[2];
+      set_mapping_n(id, input, n);
+      for (int i=0; i<n; i++) {
+        set_mapping_point(id, input, i, p[3+2*i], p[4+2*i]);
+      }
+      p += 3 + 2*n;
+    }
+  }
+
   // same as stroke_to() but with exception handling, should an
   // exception happen in the surface code (eg. out-of-memory)
   PyObject* python_stroke_to (Surface * surface, float x, float y, float pressure, float xtilt, float ytilt, double dtime)
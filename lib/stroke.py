@@ -8,6 +8,64 @@
 
 import brush
 import numpy
+import struct, zlib
+
+#: Grid the recorded event values are rounded to, per column:
+#: dtime, x, y, pressure, xtilt, ytilt. Powers of two, so that the
+#: rounded values are stored exactly as integers in the v3 format.
+EVENT_QUANTIZATION = numpy.array([2**-20, 2**-8, 2**-8, 2**-16, 2**-16, 2**-16])
+
+# the same steps as plain floats, for quantizing single events quickly
+_event_steps = [float(q) for q in EVENT_QUANTIZATION]
+
+
+def encode_events(events):
+    """Encodes an (n, 6) float64 array of events as v3 stroke data.
+
+    Each column is stored as int32 deltas of its values in units of
+    EVENT_QUANTIZATION if that represents it exactly, otherwise as the raw
+    float64 values. The result is zlib compressed, and always decodes to
+    exactly the same events.
+    """
+    n = len(events)
+    flags = ''
+    columns = []
+    for i, q in enumerate(EVENT_QUANTIZATION):
+        col = events[:,i]
+        ints = numpy.round(col / q)
+        deltas = numpy.diff(numpy.concatenate([[0], ints]))
+        if (ints * q == col).all() and (abs(deltas) < 2**31).all():
+            flags += 'q'
+            columns.append(deltas.astype('<i4').tostring())
+        else:
+            flags += 'f'
+            columns.append(col.astype('<f8').tostring())
+    return '3' + struct.pack('<I', n) + flags + zlib.compress(''.join(columns))
+
+
+def decode_events(stroke_data):
+    """Returns the events of v2 or v3 stroke data as (n, 6) float64 array."""
+    version, data = stroke_data[0], stroke_data[1:]
+    if version == '2':
+        events = numpy.fromstring(data, dtype='float64')
+        events.shape = (len(events)/6, 6)
+        return events
+    assert version == '3'
+    n, = struct.unpack('<I', data[:4])
+    flags = data[4:10]
+    data = zlib.decompress(data[10:])
+    events = numpy.empty((n, 6), 'float64')
+    pos = 0
+    for i, (flag, q) in enumerate(zip(flags, EVENT_QUANTIZATION)):
+        if flag == 'q':
+            deltas = numpy.fromstring(data[pos:pos+4*n], '<i4')
+            events[:,i] = numpy.cumsum(deltas, dtype='float64') * q
+            pos += 4*n
+        else:
+            events[:,i] = numpy.fromstring(data[pos:pos+8*n], '<f8')
+            pos += 8*n
+    return events
+
 
 class Stroke:
     """
@@ -36,27 +94,30 @@ class Stroke:
         self.brush = brush
         self.brush.new_stroke() # this just resets the stroke_* members of the brush
 
-        self.tmp_event_list = []
+        self._events = []
 
     def record_event(self, dtime, x, y, pressure, xtilt,ytilt):
+        """Records an event, returning the values actually recorded.
+
+        The values get rounded to EVENT_QUANTIZATION. The brush should be
+        given the returned values, so that replays paint exactly the same.
+        """
         assert not self.finished
-        self.tmp_event_list.append((dtime, x, y, pressure, xtilt,ytilt))
+        # (adding 0.0 turns -0.0 into 0.0, which is what a replay gets)
+        row = tuple([round(v / q) * q + 0.0 for v, q in
+                     zip((dtime, x, y, pressure, xtilt, ytilt), _event_steps)])
+        self._events.append(row)
+        return row
 
     def stop_recording(self):
         assert not self.finished
-        # OPTIMIZE 
-        # - for space: just gzip? use integer datatypes?
-        # - for time: maybe already use array storage while recording?
-        data = numpy.array(self.tmp_event_list, dtype='float64')
-        data = data.tostring()
-        version = '2'
-        self.stroke_data = version + data
+        events = numpy.array(self._events, 'float64').reshape((-1, 6))
+        self.stroke_data = encode_events(events)
 
         self.total_painting_time = self.brush.get_total_stroke_painting_time()
         #if not self.empty:
         #    print 'Recorded', len(self.stroke_data), 'bytes. (painting time: %.2fs)' % self.total_painting_time
-        #print 'Compressed size:', len(zlib.compress(self.stroke_data)), 'bytes.'
-        del self.brush, self.tmp_event_list
+        del self.brush, self._events
         self.finished = True
 
     def is_empty(self):
@@ -66,24 +127,20 @@ class Stroke:
     def render(self, surface):
         assert self.finished
 
-        # OPTIMIZE: check if parsing of settings is a performance bottleneck
-        b = brush.Brush(brush.BrushInfo(self.brush_settings))
-
-        states = numpy.fromstring(self.brush_state, dtype='float32')
-        b.set_state(states)
+        data = decode_events(self.stroke_data)
 
-        #b.set_print_inputs(1)
-        #print 'replaying', len(self.stroke_data), 'bytes'
+        # parsing the settings is slow, so configured brushes are reused
+        with brush.brush_cache.brush(self.brush_settings) as b:
+            states = numpy.fromstring(self.brush_state, dtype='float32')
+            b.set_state(states)
 
-        version, data = self.stroke_data[0], self.stroke_data[1:]
-        assert version == '2'
-        data = numpy.fromstring(data, dtype='float64')
-        data.shape = (len(data)/6, 6)
+            #b.set_print_inputs(1)
+            #print 'replaying', len(self.stroke_data), 'bytes'
 
-        surface.begin_atomic()
-        for dtime, x, y, pressure, xtilt,ytilt in data:
-            b.stroke_to (surface, x, y, pressure, xtilt,ytilt, dtime)
-        surface.end_atomic()
+            surface.begin_atomic()
+            for dtime, x, y, pressure, xtilt,ytilt in data:
+                b.stroke_to (surface, x, y, pressure, xtilt,ytilt, dtime)
+            surface.end_atomic()
 
     def copy_using_different_brush(self, brush):
         assert self.finished
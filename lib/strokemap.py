@@ -41,8 +41,8 @@ class StrokeShape:
         for tx, ty in tiles_modified:
             def work(tx=tx, ty=ty):
                 # get the pixel data to compare
-                a_data = a.get((tx, ty), tiledsurface.transparent_tile).rgba
-                b_data = b.get((tx, ty), tiledsurface.transparent_tile).rgba
+                a_data = a.get((tx, ty), tiledsurface.transparent_tile).get_readonly_rgba()
+                b_data = b.get((tx, ty), tiledsurface.transparent_tile).get_readonly_rgba()
 
                 data = empty((N, N), 'uint8')
                 mypaintlib.tile_perceptual_change_strokemap(a_data, b_data, data)
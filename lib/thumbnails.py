@@ -0,0 +1,142 @@
+# This file is part of MyPaint.
+# Copyright (C) 2013 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Thumbnail loading and caching off the main thread."""
+
+import os, threading
+import gobject
+
+import helpers
+
+#: Number of thumbnails kept in memory
+CACHE_SIZE = 256
+
+
+class ThumbnailService:
+    """Loads and stores freedesktop thumbnails with a background thread.
+
+    Thumbnails are fetched with `helpers.freedesktop_thumbnail()` by a worker
+    thread; for OpenRaster files this reads just the embedded
+    ``Thumbnails/thumbnail.png`` from the zip. Loaded thumbnails are kept in
+    an in-memory LRU cache keyed by (uri, mtime), so a modified file is never
+    served a stale thumbnail.
+
+    Results are delivered to callbacks in the main thread, in batches from a
+    single idle handler. Requests made with the same `group` supersede each
+    other, so only the latest file selected in a dialog gets loaded.
+
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self._cache = helpers.LRUCache(cache_size)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._todo = []         # (key, filename, pixbuf or None, callback, group)
+        self._results = []      # (callback, filename, pixbuf, group)
+        self._cancelled = set() # cancelled groups with a job in progress
+        self._busy_group = None
+        self._deliver_pending = False
+        self._worker = None
+
+    @staticmethod
+    def _get_key(filename):
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return None
+        return (helpers.filename2uri(filename), mtime)
+
+    def request(self, filename, callback, group=None):
+        """Requests a thumbnail, calling ``callback(filename, pixbuf)`` later.
+
+        `pixbuf` is None if the file has no usable thumbnail. A cached
+        thumbnail is passed to `callback` immediately.
+
+        """
+        key = self._get_key(filename)
+        if key is None:
+            callback(filename, None)
+            return
+        with self._lock:
+            pixbuf = self._cache.get(key)
+            if pixbuf is None:
+                self._cancelled.discard(group)
+                if group is not None:
+                    self._todo = [job for job in self._todo if job[-1] != group]
+                self._todo.append((key, filename, None, callback, group))
+                self._start_worker()
+                return
+        callback(filename, pixbuf)
+
+    def store(self, filename, pixbuf):
+        """Caches a freshly rendered thumbnail of a just saved file.
+
+        The thumbnail files in ``~/.thumbnails`` are written in the
+        background.
+
+        """
+        key = self._get_key(filename)
+        if key is None:
+            return
+        with self._lock:
+            self._cache[key] = helpers.scale_proportionally(pixbuf, 256, 256)
+            self._todo.append((key, filename, pixbuf, None, None))
+            self._start_worker()
+
+    def cancel(self, group):
+        """Drops all pending requests and results of a group."""
+        with self._lock:
+            if group is not None and group == self._busy_group:
+                self._cancelled.add(group)
+            self._todo = [job for job in self._todo if job[-1] != group]
+            self._results = [r for r in self._results if r[-1] != group]
+
+    def _start_worker(self):
+        # called with the lock held
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._worker_run,
+                                            name='ThumbnailService')
+            self._worker.daemon = True
+            self._worker.start()
+        self._wakeup.notify()
+
+    def _worker_run(self):
+        while True:
+            with self._lock:
+                while not self._todo:
+                    self._wakeup.wait()
+                key, filename, pixbuf, callback, group = self._todo.pop(0)
+                self._busy_group = group
+            try:
+                pixbuf = helpers.freedesktop_thumbnail(filename, pixbuf)
+            except Exception, e:
+                print 'Warning: thumbnail of %r failed: %s' % (filename, e)
+                pixbuf = None
+            with self._lock:
+                self._busy_group = None
+                if callback is None:
+                    continue
+                if pixbuf is not None:
+                    self._cache[key] = pixbuf
+                if group in self._cancelled:
+                    # the group's last job; don't keep it alive any longer
+                    self._cancelled.discard(group)
+                    continue
+                self._results.append((callback, filename, pixbuf, group))
+                if not self._deliver_pending:
+                    self._deliver_pending = True
+                    gobject.idle_add(self._deliver_idle_cb)
+
+    def _deliver_idle_cb(self):
+        with self._lock:
+            results = self._results
+            self._results = []
+            self._deliver_pending = False
+        for callback, filename, pixbuf, group in results:
+            callback(filename, pixbuf)
+        return False
@@ -10,8 +10,8 @@
 
 import numpy
 from numpy import *
-import time, sys, os, contextlib
-import mypaintlib, helpers
+import time, sys, os, atexit, contextlib, hashlib, weakref
+import mypaintlib, helpers, tilestore
 import math
 
 TILE_SIZE = N = mypaintlib.TILE_SIZE
@@ -26,20 +26,79 @@ if not os.environ.get('MYPAINT_ENABLE_GEGL', 0):
     import pixbufsurface
 
 
-class Tile:
+class Tile(object):
     def __init__(self, copy_from=None):
         # note: pixels are stored with premultiplied alpha
         #       15bits are used, but fully opaque or white is stored as 2**15 (requiring 16 bits)
         #       This is to allow many calcuations to divide by 2**15 instead of (2**16-1)
+        #
+        # A solid-colour tile can be stored as a single RGBA value in
+        # `uniform`, without pixel array (see compact()). The pixels are
+        # expanded again when `rgba` is accessed.
+        self.uniform = None
         if copy_from is None:
-            self.rgba = zeros((N, N, 4), 'uint16')
+            self._rgba = zeros((N, N, 4), 'uint16')
+        elif copy_from.uniform is not None:
+            self.uniform = copy_from.uniform
+            self._rgba = None
         else:
-            self.rgba = copy_from.rgba.copy()
+            self._rgba = copy_from._rgba.copy()
         self.readonly = False
+        # slot in the tile_store once the pixels are paged out
+        self._slot = None
 
     def copy(self):
         return Tile(copy_from=self)
 
+    def get_rgba(self):
+        rgba = self._rgba
+        if rgba is None:
+            # fill before publishing: other threads may read the tile
+            rgba = empty((N, N, 4), 'uint16')
+            rgba[:,:] = self.uniform
+            self._rgba = rgba
+        if not self.readonly:
+            # the caller may write to it
+            self.uniform = None
+        elif tile_store is not None:
+            tile_store.touch(self)
+        return rgba
+    rgba = property(get_rgba)
+
+    def get_readonly_rgba(self):
+        """Pixel data for reading, without expanding a solid tile for good.
+
+        Safe to call from other threads on readonly tiles, e.g. the journal
+        writer, while compact() drops expanded pixels: `_rgba` is read once,
+        and `uniform` is always set before `_rgba` is cleared.
+        """
+        rgba = self._rgba
+        if rgba is not None:
+            if self.readonly and tile_store is not None:
+                tile_store.touch(self)
+            return rgba
+        rgba = empty((N, N, 4), 'uint16')
+        rgba[:,:] = self.uniform
+        return rgba
+
+    def compact(self):
+        """Replaces the pixels by a single value if they all have the same colour.
+
+        Must not be called while the pixels may still be written to.
+        """
+        if self.uniform is not None:
+            self._rgba = None # drop an expanded copy
+            return
+        pixels = self._rgba.view('uint64') # one RGBA pixel each
+        if (pixels == pixels.flat[0]).all():
+            self.uniform = self._rgba[0, 0].copy()
+            self._rgba = None
+
+    def is_transparent(self):
+        if self.uniform is not None:
+            return not self.uniform.any()
+        return not self._rgba.any()
+
 
 svg2composite_func = {
     'svg:src-over': mypaintlib.tile_composite_normal,
@@ -64,9 +123,82 @@ svg2composite_func = {
 transparent_tile = Tile()
 transparent_tile.readonly = True
 
-# tile with invalid pixel memory (needs refresh)
-mipmap_dirty_tile = Tile()
-del mipmap_dirty_tile.rgba
+class TilePool:
+    """Content-addressed pool of readonly tiles.
+
+    Tiles with equal pixels are interned to a single Tile object, no matter
+    which surface, snapshot or document (e.g. the scratchpad) they belong to.
+    Only readonly tiles are interned; writing to them makes a private copy as
+    usual. Pooled tiles are held weakly and go away when no longer in use.
+
+    """
+
+    def __init__(self):
+        self._tiles = weakref.WeakValueDictionary()
+        self.interned = 0
+        self.hits = 0
+
+    def intern(self, tile):
+        """Returns the pooled tile with the same pixels as `tile`."""
+        assert tile.readonly
+        if tile.uniform is not None:
+            key = 'u' + tile.uniform.tostring()
+        else:
+            key = hashlib.sha1(tile.get_readonly_rgba().data).digest()
+        self.interned += 1
+        pooled = self._tiles.get(key)
+        if pooled is None:
+            self._tiles[key] = tile
+            return tile
+        self.hits += 1
+        return pooled
+
+    def get_stats(self):
+        """Returns a dict of statistics since the pool was created.
+
+        ``dedup_ratio`` is the number of tiles interned per tile kept.
+        """
+        kept = self.interned - self.hits
+        return {'interned': self.interned, 'hits': self.hits,
+                'pooled': len(self._tiles),
+                'dedup_ratio': float(self.interned) / max(1, kept)}
+
+#: The active TilePool, or None if tiles are not deduplicated.
+#: See `set_tile_pool_enabled()`.
+tile_pool = None
+
+def set_tile_pool_enabled(enabled):
+    global tile_pool
+    if not enabled:
+        tile_pool = None
+    elif tile_pool is None:
+        tile_pool = TilePool()
+
+set_tile_pool_enabled(os.environ.get('MYPAINT_TILE_POOL', 0))
+
+#: The active tilestore.MmapTileStore, or None if all tiles stay in memory.
+#: See `set_tile_store()`.
+tile_store = None
+
+def set_tile_store(store):
+    """Sets where the pixels of cold readonly tiles are kept.
+
+    Tiles finalized from then on are handed to `store`, which pages them out
+    once more than ``store.max_resident`` of them are in use. Pass None to
+    keep new tiles in memory. The store set at exit is removed then; a store
+    which gets replaced must be removed by its owner.
+    """
+    global tile_store
+    tile_store = store
+
+def _remove_tile_store():
+    if tile_store is not None:
+        tile_store.remove()
+
+atexit.register(_remove_tile_store)
+
+if os.environ.get('MYPAINT_TILE_STORE_MAX_TILES'):
+    set_tile_store(tilestore.MmapTileStore(int(os.environ['MYPAINT_TILE_STORE_MAX_TILES'])))
 
 def get_tiles_bbox(tiles):
     res = helpers.Rect()
@@ -74,6 +206,87 @@ def get_tiles_bbox(tiles):
         res.expandToIncludeRect(helpers.Rect(N*tx, N*ty, N, N))
     return res
 
+class TileDict(dict):
+    """Tiles by (tx, ty) position, tracking the bounding box of the positions.
+
+    The bounds grow as tiles are added. Removing a tile on their edge only
+    marks them for recalculation by the next `get_bbox()`, so the bbox of a
+    surface which hasn't shrunk is available in constant time.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        if len(args) == 1 and not kwargs and isinstance(args[0], TileDict):
+            self._bounds = args[0]._bounds
+            self._stale = args[0]._stale
+        else:
+            self._bounds = None # (tx0, ty0, tx1, ty1), inclusive
+            self._stale = bool(self)
+
+    def _include(self, pos):
+        tx, ty = pos
+        b = self._bounds
+        if b is None:
+            self._bounds = (tx, ty, tx, ty)
+        else:
+            self._bounds = (min(b[0], tx), min(b[1], ty),
+                            max(b[2], tx), max(b[3], ty))
+
+    def _exclude(self, pos):
+        b = self._bounds
+        if b is not None:
+            tx, ty = pos
+            if tx == b[0] or tx == b[2] or ty == b[1] or ty == b[3]:
+                self._stale = True
+
+    def __setitem__(self, pos, tile):
+        if not self._stale:
+            self._include(pos)
+        dict.__setitem__(self, pos, tile)
+
+    def __delitem__(self, pos):
+        dict.__delitem__(self, pos)
+        self._exclude(pos)
+
+    def pop(self, pos, *default):
+        if pos in self:
+            self._exclude(pos)
+        return dict.pop(self, pos, *default)
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._exclude(item[0])
+        return item
+
+    def setdefault(self, pos, tile=None):
+        if pos not in self:
+            self[pos] = tile
+        return dict.__getitem__(self, pos)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._stale = True
+
+    def clear(self):
+        dict.clear(self)
+        self._bounds = None
+        self._stale = False
+
+    def copy(self):
+        return TileDict(self)
+
+    def get_bbox(self):
+        if self._stale:
+            self._bounds = None
+            if self:
+                txs = [tx for tx, ty in self]
+                tys = [ty for tx, ty in self]
+                self._bounds = (min(txs), min(tys), max(txs), max(tys))
+            self._stale = False
+        if self._bounds is None:
+            return helpers.Rect()
+        tx0, ty0, tx1, ty1 = self._bounds
+        return helpers.Rect(N*tx0, N*ty0, N*(tx1-tx0+1), N*(ty1-ty0+1))
+
 class SurfaceSnapshot:
     pass
 
@@ -132,12 +345,18 @@ if use_gegl:
         def set_symmetry_state(self, enabled, center_axis):
             pass
 
+        def update_mipmaps(self, tiles, mipmap_level):
+            pass
+
 class MyPaintSurface(mypaintlib.TiledSurface):
     # the C++ half of this class is in tiledsurface.hpp
     def __init__(self, mipmap_level=0, looped=False, looped_size=(0,0)):
         mypaintlib.TiledSurface.__init__(self, self)
-        self.tiledict = {}
+        self.tiledict = TileDict()
         self.observers = []
+        # Tiles handed out for writing, whose alpha may have dropped to zero
+        # since the last remove_empty_tiles()
+        self._maybe_empty = set()
 
         # Used to implement repeating surfaces, like Background
         if looped_size[0] % N or looped_size[1] % N:
@@ -148,6 +367,9 @@ class MyPaintSurface(mypaintlib.TiledSurface):
         self.mipmap_level = mipmap_level
         self.mipmap = None
         self.parent = None
+        # Mipmap tiles needing regeneration from the parent level. If a tile
+        # is in here, so is the tile above it in the next mipmap level.
+        self.mipmap_dirty = set()
 
         if mipmap_level < MAX_MIPMAP_LEVEL:
             self.mipmap = Surface(mipmap_level+1)
@@ -157,9 +379,36 @@ class MyPaintSurface(mypaintlib.TiledSurface):
         for f in self.observers:
             f(*args)
 
+    def _finalize_tiles(self, positions=None):
+        """Makes tiles written since the last snapshot or load readonly.
+
+        They are final now, so this is where solid tiles get compacted, and
+        where tiles are handed to the tile pool and tile store if enabled.
+        """
+        pool = tile_pool
+        store = tile_store
+        if positions is None:
+            self.remove_empty_tiles()
+            items = self.tiledict.items()
+        else:
+            items = [(pos, self.tiledict[pos]) for pos in positions]
+        for pos, t in items:
+            if not t.readonly or t.uniform is not None:
+                t.compact()
+            if t.readonly:
+                continue
+            t.readonly = True
+            if pool is not None:
+                t = pool.intern(t)
+                self.tiledict[pos] = t
+            if store is not None:
+                store.add(t)
+
     def clear(self):
         tiles = self.tiledict.keys()
-        self.tiledict = {}
+        self.tiledict = TileDict()
+        self._maybe_empty = set()
+        self.mipmap_dirty = set()
         self.notify_observers(*get_tiles_bbox(tiles))
         if self.mipmap: self.mipmap.clear()
 
@@ -183,6 +432,9 @@ class MyPaintSurface(mypaintlib.TiledSurface):
             tx = tx % (self.looped_size[0] / N)
             ty = ty % (self.looped_size[1] / N)
 
+        if (tx, ty) in self.mipmap_dirty:
+            self._update_mipmap_tile(tx, ty)
+
         t = self.tiledict.get((tx, ty))
         if t is None:
             if readonly:
@@ -190,21 +442,6 @@ class MyPaintSurface(mypaintlib.TiledSurface):
             else:
                 t = Tile()
                 self.tiledict[(tx, ty)] = t
-        if t is mipmap_dirty_tile:
-            # regenerate mipmap
-            t = Tile()
-            self.tiledict[(tx, ty)] = t
-            empty = True
-            for x in xrange(2):
-                for y in xrange(2):
-                    with self.parent.tile_request(tx*2 + x, ty*2 + y, True) as src:
-                        mypaintlib.tile_downscale_rgba16(src, t.rgba, x*N/2, y*N/2)
-                        if src is not transparent_tile.rgba:
-                            empty = False
-            if empty:
-                # rare case, no need to speed it up
-                del self.tiledict[(tx, ty)]
-                t = transparent_tile
         if t.readonly and not readonly:
             # shared memory, get a private copy for writing
             t = t.copy()
@@ -212,16 +449,83 @@ class MyPaintSurface(mypaintlib.TiledSurface):
         if not readonly:
             # assert self.mipmap_level == 0
             self._mark_mipmap_dirty(tx, ty)
+            self._maybe_empty.add((tx, ty))
+        # A solid tile gets expanded here, also for reading. The expanded
+        # pixels are dropped again by save_snapshot().
         return t.rgba
 
+    def _get_tile_readonly(self, tx, ty):
+        """Returns the Tile at a position for reading only, or None."""
+        if self.looped:
+            tx = tx % (self.looped_size[0] / N)
+            ty = ty % (self.looped_size[1] / N)
+        if (tx, ty) in self.mipmap_dirty:
+            self._update_mipmap_tile(tx, ty)
+        return self.tiledict.get((tx, ty))
+
     def _set_tile_numpy(self, tx, ty, obj, readonly):
         pass # Data can be modified directly, no action needed
 
     def _mark_mipmap_dirty(self, tx, ty):
-        if self.mipmap_level > 0:
-            self.tiledict[(tx, ty)] = mipmap_dirty_tile
-        if self.mipmap:
-            self.mipmap._mark_mipmap_dirty(tx/2, ty/2)
+        # Propagation stops at the first level where the tile is dirty
+        # already, because everything above it is dirty too.
+        mipmap = self.mipmap
+        while mipmap is not None:
+            tx, ty = tx // 2, ty // 2
+            if (tx, ty) in mipmap.mipmap_dirty:
+                break
+            mipmap.mipmap_dirty.add((tx, ty))
+            mipmap = mipmap.mipmap
+
+    def update_mipmaps(self, tiles, mipmap_level):
+        """Regenerates the dirty mipmap tiles needed to draw `tiles`.
+
+        `tiles` are tile positions at `mipmap_level`. The dirty tiles below
+        them are found level by level and then rebuilt bottom-up in a single
+        batch, so drawing a zoomed-out view doesn't have to regenerate its
+        tiles one by one.
+
+        """
+        levels = []
+        s = self
+        while s.mipmap_level < mipmap_level and s.mipmap is not None:
+            s = s.mipmap
+            levels.append(s)
+        if not levels:
+            return
+        todo = [levels[-1].mipmap_dirty.intersection(tiles)]
+        for s in reversed(levels[:-1]):
+            children = set()
+            for tx, ty in todo[-1]:
+                children.update([(2*tx, 2*ty), (2*tx+1, 2*ty),
+                                 (2*tx, 2*ty+1), (2*tx+1, 2*ty+1)])
+            todo.append(s.mipmap_dirty.intersection(children))
+        todo.reverse()
+        for s, positions in zip(levels, todo):
+            s._regenerate_mipmap_tiles(positions)
+
+    def _update_mipmap_tile(self, tx, ty):
+        root = self
+        while root.parent is not None:
+            root = root.parent
+        root.update_mipmaps([(tx, ty)], self.mipmap_level)
+
+    def _regenerate_mipmap_tiles(self, positions):
+        # the parent tiles must be up to date already, see update_mipmaps()
+        src = self.parent.tiledict
+        downscale = mypaintlib.tile_downscale_rgba16_children
+        for tx, ty in positions:
+            children = []
+            for pos in [(2*tx, 2*ty), (2*tx+1, 2*ty), (2*tx, 2*ty+1), (2*tx+1, 2*ty+1)]:
+                child = src.get(pos)
+                children.append(child.get_readonly_rgba() if child is not None else None)
+            t = Tile()
+            if downscale(*(children + [t.rgba])):
+                t.compact()
+                self.tiledict[(tx, ty)] = t
+            else:
+                self.tiledict.pop((tx, ty), None)
+        self.mipmap_dirty.difference_update(positions)
 
     def blit_tile_into(self, dst, dst_has_alpha, tx, ty, mipmap_level=0):
         # used mainly for saving (transparent PNG)
@@ -233,23 +537,25 @@ class MyPaintSurface(mypaintlib.TiledSurface):
 
         assert dst.shape[2] == 4
 
-        with self.tile_request(tx, ty, readonly=True) as src:
-
-            if src is transparent_tile.rgba:
-                #dst[:] = 0 # <-- notably slower than memset()
-                mypaintlib.tile_clear(dst)
-            else:
-
-                if dst.dtype == 'uint16':
-                    # this will do memcpy, not worth to bother skipping the u channel
-                    mypaintlib.tile_copy_rgba16_into_rgba16(src, dst)
-                elif dst.dtype == 'uint8':
-                    if dst_has_alpha:
-                        mypaintlib.tile_convert_rgba16_to_rgba8(src, dst)
-                    else:
-                        mypaintlib.tile_convert_rgbu16_to_rgbu8(src, dst)
+        t = self._get_tile_readonly(tx, ty)
+        if t is None:
+            #dst[:] = 0 # <-- notably slower than memset()
+            mypaintlib.tile_clear(dst)
+        elif t.uniform is not None and dst.dtype == 'uint16':
+            # solid tile, no need to read 4096 pixels
+            dst[:,:,:] = t.uniform
+        else:
+            src = t.get_readonly_rgba()
+            if dst.dtype == 'uint16':
+                # this will do memcpy, not worth to bother skipping the u channel
+                mypaintlib.tile_copy_rgba16_into_rgba16(src, dst)
+            elif dst.dtype == 'uint8':
+                if dst_has_alpha:
+                    mypaintlib.tile_convert_rgba16_to_rgba8(src, dst)
                 else:
-                    raise ValueError, 'Unsupported destination buffer type'
+                    mypaintlib.tile_convert_rgbu16_to_rgbu8(src, dst)
+            else:
+                raise ValueError, 'Unsupported destination buffer type'
 
     def composite_tile(self, dst, dst_has_alpha, tx, ty, mipmap_level=0, opacity=1.0,
                        mode=DEFAULT_COMPOSITE_OP):
@@ -259,17 +565,25 @@ class MyPaintSurface(mypaintlib.TiledSurface):
         """
         if self.mipmap_level < mipmap_level:
             return self.mipmap.composite_tile(dst, dst_has_alpha, tx, ty, mipmap_level, opacity, mode)
-        if not (tx,ty) in self.tiledict:
+        t = self._get_tile_readonly(tx, ty)
+        if t is None:
             return
 
-        with self.tile_request(tx, ty, readonly=True) as src:
-            func = svg2composite_func[mode]
-            func(src, dst, dst_has_alpha, opacity)
+        if t.uniform is not None:
+            # solid tiles: fully transparent ones change nothing, and
+            # opaque ones replace dst in normal mode
+            if not t.uniform[3]:
+                return
+            if t.uniform[3] == 1<<15 and opacity == 1.0 and mode == DEFAULT_COMPOSITE_OP:
+                dst[:,:,:] = t.uniform
+                return
+
+        func = svg2composite_func[mode]
+        func(t.get_readonly_rgba(), dst, dst_has_alpha, opacity)
 
     def save_snapshot(self):
         sshot = SurfaceSnapshot()
-        for t in self.tiledict.itervalues():
-            t.readonly = True
+        self._finalize_tiles()
         sshot.tiledict = self.tiledict.copy()
         return sshot
 
@@ -282,7 +596,7 @@ class MyPaintSurface(mypaintlib.TiledSurface):
             # testcase: comparison above (if equal) takes 0.6ms, code below 30ms
             return
         old = set(self.tiledict.iteritems())
-        self.tiledict = d.copy()
+        self.tiledict = TileDict(d)
         new = set(self.tiledict.iteritems())
         dirty = old.symmetric_difference(new)
         for pos, tile in dirty:
@@ -296,13 +610,16 @@ class MyPaintSurface(mypaintlib.TiledSurface):
 
     def _load_from_pixbufsurface(self, s):
         dirty_tiles = set(self.tiledict.keys())
-        self.tiledict = {}
+        self.tiledict = TileDict()
 
         for tx, ty in s.get_tiles():
             with self.tile_request(tx, ty, readonly=False) as dst:
                 s.blit_tile_into(dst, True, tx, ty)
 
+        self._finalize_tiles()
         dirty_tiles.update(self.tiledict.keys())
+        for pos in dirty_tiles:
+            self._mark_mipmap_dirty(*pos)
         bbox = get_tiles_bbox(dirty_tiles)
         self.notify_observers(*bbox)
 
@@ -322,6 +639,7 @@ class MyPaintSurface(mypaintlib.TiledSurface):
                 for tx in range(w/N):
                     with self.tile_request(tx, ty, readonly=False) as dst:
                         dst[:,:,:] = arr[ty*N:(ty+1)*N, tx*N:(tx+1)*N, :]
+            self._finalize_tiles()
         else:
             raise ValueError
 
@@ -329,65 +647,41 @@ class MyPaintSurface(mypaintlib.TiledSurface):
 
     def load_from_png(self, filename, x, y, feedback_cb=None):
         """Load from a PNG, one tilerow at a time, discarding empty tiles.
+
+        The conversion to tiles happens in C, which asks for the tiles of
+        each tile row in one call. 16-bit PNGs are loaded with full
+        precision.
         """
         dirty_tiles = set(self.tiledict.keys())
-        self.tiledict = {}
-
-        state = {}
-        state['buf'] = None # array of height N, width depends on image
-        state['ty'] = y/N # current tile row being filled into buf
-        state['frame_size'] = None
+        self.tiledict = TileDict()
+        state = {'pending': []}
 
-        def get_buffer(png_w, png_h):
-            state['frame_size'] = x, y, png_w, png_h
+        def get_tile_row(ty, txs):
             if feedback_cb:
                 feedback_cb()
-            buf_x0 = x/N*N
-            buf_x1 = ((x+png_w-1)/N+1)*N
-            buf_y0 = state['ty']*N
-            buf_y1 = buf_y0+N
-            buf_w = buf_x1-buf_x0
-            buf_h = buf_y1-buf_y0
-            assert buf_w % N == 0
-            assert buf_h == N
-            if state['buf'] is not None:
-                consume_buf()
-            else:
-                state['buf'] = empty((buf_h, buf_w, 4), 'uint8')
-
-            png_x0 = x
-            png_x1 = x+png_w
-            subbuf = state['buf'][:,png_x0-buf_x0:png_x1-buf_x0]
-            if 1: # optimize: only needed for first and last
-                state['buf'].fill(0)
-                png_y0 = max(buf_y0, y)
-                png_y1 = min(buf_y0+buf_h, y+png_h)
-                assert png_y1 > png_y0
-                subbuf = subbuf[png_y0-buf_y0:png_y1-buf_y0,:]
-
-            state['ty'] += 1
-            return subbuf
-
-        def consume_buf():
-            ty = state['ty']-1
-            for i in xrange(state['buf'].shape[1]/N):
-                tx = x/N + i
-                src = state['buf'][:,i*N:(i+1)*N,:]
-                if src[:,:,3].any():
-                    with self.tile_request(tx, ty, readonly=False) as dst:
-                        mypaintlib.tile_convert_rgba8_to_rgba16(src, dst)
+            # the previous row has been written by now
+            self._finalize_tiles(state['pending'])
+            state['pending'] = [(tx, ty) for tx in txs]
+            dsts = []
+            for pos in state['pending']:
+                t = Tile()
+                self.tiledict[pos] = t
+                dsts.append(t.rgba)
+            return dsts
 
         filename_sys = filename.encode(sys.getfilesystemencoding()) # FIXME: should not do that, should use open(unicode_object)
-        flags = mypaintlib.load_png_fast_progressive(filename_sys, get_buffer)
-        consume_buf() # also process the final chunk of data
+        flags = mypaintlib.load_png_fast_into_tiles(filename_sys, x, y, get_tile_row)
         print flags
 
+        self._finalize_tiles()
         dirty_tiles.update(self.tiledict.keys())
+        for pos in dirty_tiles:
+            self._mark_mipmap_dirty(*pos)
         bbox = get_tiles_bbox(dirty_tiles)
         self.notify_observers(*bbox)
 
         # return the bbox of the loaded image
-        return state['frame_size']
+        return x, y, flags['width'], flags['height']
 
     def render_as_pixbuf(self, *args, **kwargs):
         if not self.tiledict:
@@ -410,16 +704,25 @@ class MyPaintSurface(mypaintlib.TiledSurface):
         return self.tiledict
 
     def get_bbox(self):
-        return get_tiles_bbox(self.tiledict)
+        return self.tiledict.get_bbox()
 
     def is_empty(self):
         return not self.tiledict
 
     def remove_empty_tiles(self):
-        # Only used in tests
-        for pos, data in self.tiledict.items():
-            if not data.rgba.any():
-                self.tiledict.pop(pos)
+        """Drops tiles which were written to and have become transparent.
+
+        Only the tiles handed out for writing since the last call are
+        checked. This happens for every `save_snapshot()`, so erasing keeps
+        neither the tiles nor the bbox of the erased area around.
+        """
+        tiledict = self.tiledict
+        for pos in self._maybe_empty:
+            t = tiledict.get(pos)
+            if t is not None and t.is_transparent():
+                tiledict.pop(pos)
+                self._mark_mipmap_dirty(*pos)
+        self._maybe_empty = set()
 
     def get_move(self, x, y):
         return _InteractiveMove(self, x, y)
@@ -439,24 +742,38 @@ class _InteractiveMove:
         euclidean = lambda p: math.sqrt((tx - p[0])**2 + (ty - p[1])**2)
         self.chunks.sort(key=manhattan)
         self.chunks_i = 0
+        # Tiles changed since the last cleanup()
+        self.dirty = set()
 
     def update(self, dx, dy):
         # Tiles to be blanked at the end of processing
         self.blanked = set(self.surface.tiledict.keys())
         # Calculate offsets
-        self.slices_x = calc_translation_slices(int(dx))
-        self.slices_y = calc_translation_slices(int(dy))
+        dx = int(dx)
+        dy = int(dy)
+        self.tdx, self.dx = dx // N, dx % N
+        self.tdy, self.dy = dy // N, dy % N
         self.chunks_i = 0
 
     def cleanup(self):
         # called at the end of each set of processing batches
+        tiledict = self.surface.tiledict
         for b in self.blanked:
-            self.surface.tiledict.pop(b, None)
-            self.surface._mark_mipmap_dirty(*b)
-        bbox = get_tiles_bbox(self.blanked)
+            tiledict.pop(b, None)
+        self.dirty.update(self.blanked)
+        self.blanked = set()
+        # Remove empty tiles created by non-integral moves. Shared tiles
+        # were copied unchanged, no need to check those.
+        for pos in self.dirty:
+            t = tiledict.get(pos)
+            if t is not None and not t.readonly and t.is_transparent():
+                tiledict.pop(pos)
+        # Mipmaps are invalidated once per set of batches, not per batch
+        for pos in self.dirty:
+            self.surface._mark_mipmap_dirty(*pos)
+        bbox = get_tiles_bbox(self.dirty)
+        self.dirty = set()
         self.surface.notify_observers(*bbox)
-        # Remove empty tile created by Layer Move
-        self.surface.remove_empty_tiles()
 
     def process(self, n=200):
         if self.chunks_i > len(self.chunks):
@@ -464,32 +781,45 @@ class _InteractiveMove:
         written = set()
         if n <= 0:
             n = len(self.chunks)  # process all remaining
-        for tile_pos in self.chunks[self.chunks_i : self.chunks_i + n]:
-            src_tx, src_ty = tile_pos
-            src_tile = self.snapshot.tiledict[(src_tx, src_ty)]
-            is_integral = len(self.slices_x) == 1 and len(self.slices_y) == 1
-            for (src_x0, src_x1), (targ_tdx, targ_x0, targ_x1) in self.slices_x:
-                for (src_y0, src_y1), (targ_tdy, targ_y0, targ_y1) in self.slices_y:
-                    targ_tx = src_tx + targ_tdx
-                    targ_ty = src_ty + targ_tdy
-                    if is_integral:
-                        self.surface.tiledict[(targ_tx, targ_ty)] = src_tile.copy()
-                    else:
-                        targ_tile = None
-                        if (targ_tx, targ_ty) in self.blanked:
-                            targ_tile = Tile()
-                            self.surface.tiledict[(targ_tx, targ_ty)] = targ_tile
-                            self.blanked.remove( (targ_tx, targ_ty) )
+        tiledict = self.surface.tiledict
+        src_tiledict = self.snapshot.tiledict
+        tdx, tdy = self.tdx, self.tdy
+        if not self.dx and not self.dy:
+            # Integral move: just rekey the tiles. Snapshot tiles are
+            # readonly, so they can be shared; painting on them later
+            # makes a copy.
+            for src_tx, src_ty in self.chunks[self.chunks_i : self.chunks_i + n]:
+                targ_pos = (src_tx + tdx, src_ty + tdy)
+                tiledict[targ_pos] = src_tiledict[(src_tx, src_ty)]
+                written.add(targ_pos)
+        else:
+            translate = mypaintlib.tile_translate_rgba16
+            for src_tx, src_ty in self.chunks[self.chunks_i : self.chunks_i + n]:
+                src_tile = src_tiledict[(src_tx, src_ty)]
+                targets = []
+                for targ_ty in (src_ty + tdy, src_ty + tdy + 1):
+                    for targ_tx in (src_tx + tdx, src_tx + tdx + 1):
+                        if (targ_tx > src_tx + tdx and not self.dx) or \
+                           (targ_ty > src_ty + tdy and not self.dy):
+                            # receives no pixels
+                            targets.append(None)
+                            continue
+                        targ_pos = (targ_tx, targ_ty)
+                        if targ_pos in self.blanked:
+                            # stale content from before this update
+                            targ_tile = None
+                            self.blanked.remove(targ_pos)
                         else:
-                            targ_tile = self.surface.tiledict.get((targ_tx, targ_ty), None)
+                            # already written to during this update
+                            targ_tile = tiledict.get(targ_pos)
                         if targ_tile is None:
                             targ_tile = Tile()
-                            self.surface.tiledict[(targ_tx, targ_ty)] = targ_tile
-                        targ_tile.rgba[targ_y0:targ_y1, targ_x0:targ_x1] = src_tile.rgba[src_y0:src_y1, src_x0:src_x1]
-                    written.add((targ_tx, targ_ty))
+                            tiledict[targ_pos] = targ_tile
+                        targets.append(targ_tile.rgba)
+                        written.add(targ_pos)
+                translate(src_tile.get_readonly_rgba(), *(targets + [self.dx, self.dy]))
         self.blanked -= written
-        for pos in written:
-            self.surface._mark_mipmap_dirty(*pos)
+        self.dirty.update(written)
         bbox = get_tiles_bbox(written) # hopefully relatively contiguous
         self.surface.notify_observers(*bbox)
         self.chunks_i += n
@@ -548,8 +878,9 @@ class Background(Surface):
             mipmap_obj = numpy.zeros((height, width, 4), dtype='uint16')
             for ty in range(height/N*2):
                 for tx in range(width/N*2):
-                    with self.tile_request(tx, ty, readonly=True) as src:
-                        mypaintlib.tile_downscale_rgba16(src, mipmap_obj, tx*N/2, ty*N/2)
+                    t = self._get_tile_readonly(tx, ty) or transparent_tile
+                    src = t.get_readonly_rgba()
+                    mypaintlib.tile_downscale_rgba16(src, mipmap_obj, tx*N/2, ty*N/2)
 
             self.mipmap = Background(mipmap_obj, mipmap_level+1)
             self.mipmap.parent = self
@@ -0,0 +1,120 @@
+# This file is part of MyPaint.
+# Copyright (C) 2013 by the MyPaint Development Team
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+"""Out-of-core storage of tile pixels in memory-mapped files."""
+
+import os, mmap, shutil, tempfile, threading, weakref
+from collections import OrderedDict
+from numpy import frombuffer
+
+import mypaintlib
+
+N = mypaintlib.TILE_SIZE
+TILE_BYTES = N*N*4*2
+
+#: Number of tiles in one slab file
+SLAB_TILES = 256
+#: Default number of readonly tiles kept in the heap (about 128 MB)
+DEFAULT_MAX_RESIDENT = 4096
+
+
+class MmapTileStore:
+    """Keeps the pixels of cold readonly tiles in memory-mapped slab files.
+
+    Readonly tiles are registered with `add()` once they are final (see
+    `tiledsurface.Surface.save_snapshot()`). The most recently used
+    `max_resident` of them keep their pixels in the heap; older ones get
+    their pixels written to a free slot of a slab file, and their pixel
+    array replaced by a NumPy view into the mapping. The kernel pages them
+    in again when a `tile_request()` reads them, and can drop them under
+    memory pressure without swapping.
+
+    Tiles are immutable while readonly, so each one is written at most
+    once. Its slot is freed again when the tile is garbage collected.
+
+    """
+
+    def __init__(self, max_resident=DEFAULT_MAX_RESIDENT, dirname=None):
+        self.max_resident = max_resident
+        if dirname is None:
+            dirname = tempfile.mkdtemp(prefix='mypaint-tiles-')
+        self.dirname = dirname
+        # reentrant: weakref callbacks may run while the lock is held
+        self._lock = threading.RLock()
+        self._resident = OrderedDict() # id(tile) -> weakref, in LRU order
+        self._slabs = []               # mmap objects
+        self._free_slots = []
+        self._slot_refs = {}           # slot -> weakref with finalizer
+
+    def add(self, tile):
+        """Starts managing the pixels of a readonly tile."""
+        assert tile.readonly
+        if tile.uniform is not None or tile._slot is not None:
+            return
+        with self._lock:
+            key = id(tile)
+            if key in self._resident:
+                return
+            def forget(ref, key=key):
+                with self._lock:
+                    if self._resident.get(key) is ref:
+                        del self._resident[key]
+            self._resident[key] = weakref.ref(tile, forget)
+            while len(self._resident) > self.max_resident:
+                key, ref = self._resident.popitem(last=False)
+                t = ref()
+                if t is not None:
+                    self._page_out(t)
+
+    def touch(self, tile):
+        """Marks a resident tile as recently used."""
+        with self._lock:
+            ref = self._resident.pop(id(tile), None)
+            if ref is not None:
+                self._resident[id(tile)] = ref
+
+    def get_resident_count(self):
+        return len(self._resident)
+
+    def _page_out(self, tile):
+        # called with the lock held
+        if not self._free_slots:
+            self._add_slab()
+        slot = self._free_slots.pop()
+        slab, i = divmod(slot, SLAB_TILES)
+        view = frombuffer(self._slabs[slab], 'uint16', N*N*4, i*TILE_BYTES)
+        view = view.reshape((N, N, 4))
+        view[:] = tile._rgba
+        tile._rgba = view
+        tile._slot = slot
+        def free(ref, slot=slot):
+            with self._lock:
+                del self._slot_refs[slot]
+                self._free_slots.append(slot)
+        self._slot_refs[slot] = weakref.ref(tile, free)
+
+    def _add_slab(self):
+        slab = len(self._slabs)
+        filename = os.path.join(self.dirname, 'slab-%04d' % slab)
+        size = SLAB_TILES*TILE_BYTES
+        with open(filename, 'w+b') as f:
+            f.truncate(size)
+            self._slabs.append(mmap.mmap(f.fileno(), size))
+        first = slab*SLAB_TILES
+        self._free_slots.extend(reversed(xrange(first, first+SLAB_TILES)))
+
+    def remove(self):
+        """Deletes the slab files, e.g. at exit."""
+        shutil.rmtree(self.dirname, ignore_errors=True)
+
+    def get_stats(self):
+        with self._lock:
+            used = len(self._slot_refs)
+            return {'resident': len(self._resident), 'paged_out': used,
+                    'slabs': len(self._slabs),
+                    'mapped_bytes': len(self._slabs)*SLAB_TILES*TILE_BYTES}
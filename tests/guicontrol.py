@@ -15,13 +15,20 @@ class GUI:
         if self.tempdir:
             os.system('rm -rf ' + self.tempdir)
 
-    def setup(self):
-        self.tempdir = tempfile.mkdtemp()
+    def setup(self, confpath=None):
+        """Starts the application.
+
+        If `confpath` is given, that configuration directory is used and
+        kept, otherwise a temporary one with the test brushes.
+        """
+        if confpath is None:
+            self.tempdir = tempfile.mkdtemp()
+            os.system('cp -a brushes ' + self.tempdir)
+            confpath = self.tempdir
         from gui import application
-        os.system('cp -a brushes ' + self.tempdir)
         self.app = application.Application(datapath=u'..',
                                            extradata='../desktop',
-                                           confpath=unicode(self.tempdir),
+                                           confpath=unicode(confpath),
                                            filenames=[])
 
         # ignore mouse movements during testing (creating extra strokes)
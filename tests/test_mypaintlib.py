@@ -7,6 +7,7 @@ os.chdir(os.path.dirname(sys.argv[0]))
 sys.path.insert(0, '..')
 
 from lib import mypaintlib, tiledsurface, brush, document, command, helpers
+from lib import journal
 
 def tileConversions():
     # fully transparent tile stays fully transparent (without noise)
@@ -119,6 +120,386 @@ def brushPaint():
 
     s.save_as_png('test_brushPaint.png')
 
+def brushSwitching():
+    # a brush switched through other settings paints like a new one
+    events = loadtxt('painting30sec.dat')[:300]
+    def paint(b):
+        s = tiledsurface.Surface()
+        t_old = events[0][0]
+        for t, x, y, pressure in events:
+            s.begin_atomic()
+            b.stroke_to(s, x, y, pressure, 0.0, 0.0, t - t_old)
+            s.end_atomic()
+            t_old = t
+        return s.save_snapshot().tiledict
+
+    bi = brush.BrushInfo(open('brushes/charcoal.myb').read())
+    b = brush.Brush(bi)
+    for name in ['watercolor', 'redbrush', 's008']:
+        bi.load_from_string(open('brushes/%s.myb' % name).read())
+    tiles1 = paint(b)
+    tiles2 = paint(brush.Brush(brush.BrushInfo(open('brushes/s008.myb').read())))
+    assert set(tiles1) == set(tiles2)
+    for pos, t in tiles1.iteritems():
+        assert (t.get_readonly_rgba() == tiles2[pos].get_readonly_rgba()).all()
+
+def strokeEncoding():
+    from lib import stroke
+    b = brush.Brush(brush.BrushInfo(open('brushes/charcoal.myb').read()))
+    events = loadtxt('painting30sec.dat')
+    s = stroke.Stroke()
+    s.start_recording(b)
+    recorded = []
+    t_old = events[0][0]
+    for t, x, y, pressure in events:
+        recorded.append(s.record_event(t - t_old, x*1.37, y/3.0, pressure, 0.0, 0.0))
+        t_old = t
+    s.stop_recording()
+    recorded = array(recorded)
+    v2 = '2' + recorded.tostring()
+    print 'stroke data: %d bytes, %d bytes as v2' % (len(s.stroke_data), len(v2))
+    assert s.stroke_data[0] == '3'
+    assert len(s.stroke_data) < len(v2) / 4
+    # replays get exactly the events the brush got while recording
+    decoded = stroke.decode_events(s.stroke_data)
+    assert decoded.tostring() == stroke.decode_events(v2).tostring()
+
+    # values off the quantization grid are stored as they are
+    events = rand(100, 6)
+    decoded = stroke.decode_events(stroke.encode_events(events))
+    assert decoded.tostring() == events.tostring()
+
+def brushCache():
+    cache = brush.BrushCache(max_items=2)
+    settings = open('brushes/charcoal.myb').read()
+    with cache.brush(settings) as b1:
+        # in use, so not handed out twice
+        with cache.brush(settings) as b2:
+            assert b2 is not b1
+        b1.set_state(ones_like(b1.get_state()))
+    with cache.brush(settings) as b3:
+        assert b3 in (b1, b2)
+        assert not b3.get_state().any()
+    assert cache.get_brushinfo(settings) is b1.brushinfo
+    # cached brushes don't hang on to their shared info
+    assert b1.update_brushinfo not in b1.brushinfo.observers
+
+    # an exception while replaying doesn't lose the brush
+    try:
+        with cache.brush(settings) as b4:
+            raise ValueError
+    except ValueError:
+        pass
+    with cache.brush(settings) as b5:
+        assert b5 is b4
+
+def resampleAffine():
+    h, w = 5, 7
+    src = randint(0, 256, (h, w, 4)).astype('uint8')
+    for bilinear in [False, True]:
+        # identity
+        dst = ones((h, w, 4), 'uint8')
+        mypaintlib.resample_affine_rgba8(src, dst, 1, 0, 0, 1, 0, 0, bilinear)
+        assert (dst == src).all()
+
+        # 90 degrees: dst[y, x] = src[h-1-x, y]
+        dst = ones((w, h, 4), 'uint8')
+        mypaintlib.resample_affine_rgba8(src, dst, 0, -1, 1, 0, 0, h-1, bilinear)
+        assert (dst == src[::-1].transpose(1, 0, 2)).all()
+
+    # edge pixels: outside of src becomes transparent
+    dst = ones((h, w, 4), 'uint8')
+    mypaintlib.resample_affine_rgba8(src, dst, 1, 0, 0, 1, -0.6, 0, False)
+    assert not dst[:,0].any()
+    assert (dst[:,1] == src[:,0]).all()
+    dst = ones((h, w, 4), 'uint8')
+    mypaintlib.resample_affine_rgba8(src, dst, 1, 0, 0, 1, 0.5, 0, True)
+    assert not dst[:,w-1].any()
+    # bilinear sampling is clamped to the border pixels
+    dst = ones((h, w, 4), 'uint8')
+    mypaintlib.resample_affine_rgba8(src, dst, 1, 0, 0, 1, 0.4, 0, True)
+    assert (dst[:,w-1] == src[:,w-1]).all()
+
+def convexPolygonTiles():
+    N = 64
+    # diamond in the middle of 3x3 tiles, missing the corner tiles
+    c = 1.5*N
+    r = 0.9*N
+    corners = [(c, c-r), (c+r, c), (c, c+r), (c-r, c)]
+    tiles = helpers.tiles_in_convex_polygon(corners, N)
+    assert sorted(tiles) == [(0, 1), (1, 0), (1, 1), (1, 2), (2, 1)]
+    # an axis-aligned rectangle gets its bbox
+    corners = [(1, 1), (2*N-1, 1), (2*N-1, N-1), (1, N-1)]
+    assert sorted(helpers.tiles_in_convex_polygon(corners, N)) == [(0, 0), (1, 0)]
+
+def saveParallelDeflate():
+    s = tiledsurface.Surface()
+    s.load_from_png('biglayer.png', 0, 0)
+    s.save_as_png('test_saveParallelDeflate_a.png')
+    s.save_as_png('test_saveParallelDeflate_b.png', parallel_deflate=True)
+    assert pngs_equal('test_saveParallelDeflate_a.png',
+                      'test_saveParallelDeflate_b.png')
+
+def uniformTiles():
+    N = tiledsurface.N
+    s = tiledsurface.Surface()
+    arr = zeros((3*N, 3*N, 4), 'uint8')
+    arr[:,:] = (255, 0, 0, 255)
+    arr[N+5, N+5] = (0, 255, 0, 255)
+    s.load_from_numpy(arr, 0, 0)
+    uniform = [pos for pos, t in s.tiledict.iteritems() if t.uniform is not None]
+    assert len(uniform) == 8, 'only the middle tile has more than one colour'
+    s.save_as_png('test_uniformTiles_a.png')
+
+    # writing expands a solid tile again
+    with s.tile_request(0, 0, readonly=False) as rgba:
+        rgba[0, 0] = 0
+    assert s.tiledict[(0, 0)].uniform is None
+    s.save_snapshot()
+    assert s.tiledict[(0, 0)].uniform is None
+    assert s.tiledict[(1, 0)].uniform is not None
+
+    arr2 = imread('test_uniformTiles_a.png')
+    assert arr2.shape[:2] == (3*N, 3*N)
+    assert (arr2[N+5, N+5] == (0, 1, 0, 1)).all()
+    assert (arr2[0, 0] == (1, 0, 0, 1)).all()
+
+def tilePool():
+    tiledsurface.set_tile_pool_enabled(True)
+    try:
+        s1 = tiledsurface.Surface()
+        s1.load_from_png('biglayer.png', 0, 0)
+        s2 = tiledsurface.Surface()
+        s2.load_from_png('biglayer.png', 0, 0)
+        # identical content is stored only once
+        for pos, t in s1.tiledict.iteritems():
+            assert s2.tiledict[pos] is t
+        stats = tiledsurface.tile_pool.get_stats()
+        print 'tile pool stats:', stats
+        assert stats['dedup_ratio'] >= 2.0
+
+        # modification is copy-on-write
+        pos = s1.tiledict.keys()[0]
+        with s1.tile_request(pos[0], pos[1], readonly=False) as rgba:
+            rgba[0, 0, 3] = 123
+        assert s1.tiledict[pos] is not s2.tiledict[pos]
+        assert s2.tiledict[pos].rgba[0, 0, 3] != 123
+    finally:
+        tiledsurface.set_tile_pool_enabled(False)
+
+def write_png16(filename, arr):
+    # minimal writer for a 16-bit RGBA PNG without colour management chunks
+    import zlib, struct
+    h, w, channels = arr.shape
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+    raw = ''.join('\0' + arr[y].astype('>u2').tostring() for y in range(h))
+    f = open(filename, 'wb')
+    f.write('\x89PNG\r\n\x1a\n')
+    f.write(chunk('IHDR', struct.pack('>IIBBBBB', w, h, 16, 6, 0, 0, 0)))
+    f.write(chunk('IDAT', zlib.compress(raw)))
+    f.write(chunk('IEND', ''))
+    f.close()
+
+def pngLoading():
+    # unaligned positions
+    s = tiledsurface.Surface()
+    bbox = s.load_from_png('biglayer.png', -37, 45)
+    assert bbox == (-37, 45, 2240, 1664)
+    s.save_as_png('test_pngLoading.png', *bbox)
+    assert pngs_equal('test_pngLoading.png', 'biglayer.png')
+
+    # 16-bit PNGs do not go through 8 bits
+    N = tiledsurface.N
+    arr = zeros((N, 2*N, 4), 'uint16')
+    arr[:,:,0] = arange(2*N*N).reshape(N, 2*N) * 7
+    arr[:,:,3] = 0xffff
+    write_png16('test_pngLoading16.png', arr)
+    s = tiledsurface.Surface()
+    s.load_from_png('test_pngLoading16.png', 0, 0)
+    assert len(s.tiledict) == 2
+    red = concatenate([s.tiledict[(i, 0)].rgba[:,:,0] for i in range(2)], 1)
+    expected = (arr[:,:,0].astype('uint32') * (1<<15) + 0xffff/2) / 0xffff
+    assert len(unique(red)) > 256
+    assert abs(red.astype('int32') - expected).max() <= 2
+
+def layerMove():
+    N = tiledsurface.N
+    s = tiledsurface.Surface()
+    arr = randint(0, 256, (2*N, 3*N, 4)).astype('uint8')
+    arr[:,:,3] = 255
+    s.load_from_numpy(arr, 0, 0)
+
+    def get_pixels(x, y, w, h):
+        res = zeros((h, w, 4), 'uint16')
+        for ty in range(h/N):
+            for tx in range(w/N):
+                with s.tile_request(x/N+tx, y/N+ty, readonly=True) as rgba:
+                    res[ty*N:(ty+1)*N, tx*N:(tx+1)*N] = rgba
+        return res
+    orig = get_pixels(0, 0, 3*N, 2*N)
+
+    # integral moves share the tiles
+    tiles = s.save_snapshot().tiledict
+    move = s.get_move(0, 0)
+    move.update(N, 2*N)
+    move.process(n=-1)
+    move.cleanup()
+    assert len(s.tiledict) == len(tiles)
+    for (tx, ty), t in tiles.iteritems():
+        assert s.tiledict[(tx+1, ty+2)] is t
+
+    # non-integral moves copy the pixels over
+    move = s.get_move(0, 0)
+    move.update(5-N, 7-2*N)
+    move.process(n=-1)
+    move.cleanup()
+    moved = get_pixels(0, 0, 4*N, 3*N)
+    assert (moved[7:7+2*N, 5:5+3*N] == orig).all()
+    assert not moved[:7].any() and not moved[:, :5].any()
+    assert (0, 0) in s.tiledict and (3, 2) in s.tiledict
+    assert (4, 2) not in s.tiledict
+
+def surfaceBbox():
+    s = tiledsurface.Surface()
+    N = mypaintlib.TILE_SIZE
+    assert s.get_bbox().empty()
+    for tx, ty in [(0, 0), (3, -2)]:
+        with s.tile_request(tx, ty, readonly=False) as rgba:
+            rgba[:] = 1<<15
+    assert tuple(s.get_bbox()) == (0, -2*N, 4*N, 3*N)
+
+    # erased tiles are dropped by the next snapshot, shrinking the bbox
+    with s.tile_request(3, -2, readonly=False) as rgba:
+        rgba[:] = 0
+    sshot = s.save_snapshot()
+    assert tuple(s.get_bbox()) == (0, 0, N, N)
+    assert (3, -2) not in sshot.tiledict
+
+    s.clear()
+    assert s.get_bbox().empty()
+    s.load_snapshot(sshot)
+    assert tuple(s.get_bbox()) == (0, 0, N, N)
+
+def mipmapUpdate():
+    N = tiledsurface.N
+    s = tiledsurface.Surface()
+    painted = [(0, 0), (1, 0), (2, 1), (3, 3)]
+    for tx, ty in painted:
+        with s.tile_request(tx, ty, readonly=False) as rgba:
+            rgba[:] = randint(0, 1<<15, (N, N, 4))
+
+    def downscale(get_child, tx, ty):
+        dst = zeros((N, N, 4), 'uint16')
+        for i, (cx, cy) in enumerate([(0, 0), (1, 0), (0, 1), (1, 1)]):
+            child = get_child(2*tx+cx, 2*ty+cy)
+            if child is not None:
+                mypaintlib.tile_downscale_rgba16(child, dst, cx*N/2, cy*N/2)
+        return dst
+    def level0(tx, ty):
+        if (tx, ty) in painted:
+            with s.tile_request(tx, ty, readonly=True) as rgba:
+                return rgba.copy()
+    def level1(tx, ty):
+        return downscale(level0, tx, ty)
+    expected = downscale(level1, 0, 0)
+
+    dst = zeros((N, N, 4), 'uint16')
+    s.blit_tile_into(dst, True, 0, 0, mipmap_level=2)
+    assert (dst == expected).all()
+    assert (1, 1) in s.mipmap.tiledict
+
+    # erase the only tile below a mipmap tile
+    with s.tile_request(3, 3, readonly=False) as rgba:
+        rgba[:] = 0
+    s.blit_tile_into(dst, True, 0, 0, mipmap_level=2)
+    s.save_snapshot()
+    assert (3, 3) not in s.tiledict
+    s.blit_tile_into(dst, True, 0, 0, mipmap_level=2)
+    assert (1, 1) not in s.mipmap.tiledict
+    assert (0, 0) in s.mipmap.mipmap.tiledict
+
+def tileCompactRace():
+    # the journal writer reads readonly tiles while the main thread's
+    # compact() drops the expanded pixels of solid ones
+    import threading
+    N = tiledsurface.N
+    t = tiledsurface.Tile()
+    t.rgba[:] = 1<<15
+    t.compact()
+    t.readonly = True
+    errors = []
+    done = threading.Event()
+    def reader():
+        try:
+            while not done.is_set():
+                assert t.get_readonly_rgba()[N-1, N-1, 3] == 1<<15
+        except Exception, e:
+            errors.append(e)
+    thread = threading.Thread(target=reader)
+    thread.start()
+    try:
+        for i in range(20000):
+            t.get_rgba() # expands, as rendering does
+            t.compact()
+    finally:
+        done.set()
+        thread.join()
+    assert not errors, errors
+
+def anonymous_mem():
+    # resident pages not backed by a file (memory-mapped tiles are),
+    # None where /proc is not available
+    if not os.path.exists('/proc/self/statm'):
+        return None
+    size, resident, shared = open('/proc/self/statm').read().split()[:3]
+    return (int(resident) - int(shared)) * os.sysconf('SC_PAGE_SIZE')
+
+def tileStore():
+    # load biglayer.png eight times, about 240 MB of tiles, while keeping
+    # only 256 tiles (8 MB) in the heap
+    from lib import tilestore
+    store = tilestore.MmapTileStore(max_resident=256)
+    tiledsurface.set_tile_store(store)
+    try:
+        gc.collect()
+        m0 = anonymous_mem()
+        surfaces = []
+        for i in range(8):
+            s = tiledsurface.Surface()
+            s.load_from_png('biglayer.png', (i%4)*1000, (i/4)*1000)
+            surfaces.append(s)
+            assert store.get_resident_count() <= 256
+        gc.collect()
+        stats = store.get_stats()
+        print 'tile store stats:', stats
+        assert stats['paged_out'] > 0
+        if m0 is not None:
+            growth = anonymous_mem() - m0
+            print 'heap growth: %.1f MB' % (growth / 1e6)
+            assert growth < 80e6
+
+        # paged out tiles read back unchanged
+        x, y, w, h = 0, 0, 2240, 1664
+        surfaces[0].save_as_png('test_tileStore.png', x, y, w, h)
+        assert pngs_equal('test_tileStore.png', 'biglayer.png')
+
+        # writing to a paged out tile makes a heap copy
+        pos = surfaces[0].tiledict.keys()[0]
+        assert surfaces[0].tiledict[pos]._slot is not None
+        with surfaces[0].tile_request(pos[0], pos[1], readonly=False) as rgba:
+            rgba[0, 0, 3] = 123
+        assert surfaces[0].tiledict[pos]._slot is None
+
+        # slots are freed with their tiles
+        del surfaces, s
+        gc.collect()
+        assert store.get_stats()['paged_out'] == 0
+    finally:
+        tiledsurface.set_tile_store(None)
+        store.remove()
+
 def files_equal(a, b):
     return open(a, 'rb').read() == open(b, 'rb').read()
 
@@ -270,6 +651,167 @@ def docPaint():
     assert pngs_equal('test_docPaint_flat.png', 'correct_docPaint_flat.png')
     assert pngs_equal('test_docPaint_alpha.png', 'correct_docPaint_alpha.png')
 
+def journalRecovery():
+    import tempfile, shutil
+    b = brush.BrushInfo(open('brushes/s008.myb').read())
+    dirname = tempfile.mkdtemp('mypaint')
+
+    doc = document.Document(b)
+    j = journal.Journal(doc, dirname)
+    j.start()
+    events = loadtxt('painting30sec.dat')
+    events = events[:len(events)/8]
+    t_old = events[0][0]
+    n = len(events)
+    for i, (t, x, y, pressure) in enumerate(events):
+        dtime = t - t_old
+        t_old = t
+        doc.stroke_to(dtime, x, y, pressure, 0.0, 0.0)
+        if i == n*1/4:
+            doc.add_layer(1)
+        if i == n*2/4:
+            doc.undo() # recorded as tile deltas
+        if i == n*3/4:
+            j.compact()
+            doc.set_layer_opacity(0.5)
+    doc.split_stroke()
+    j.stop()
+
+    # a running instance's journal is never offered to another instance
+    other = journal.Journal(document.Document(), dirname)
+    assert other.dirname != j.dirname
+    assert not other.is_recoverable()
+    other.unlock()
+
+    j.unlock() # like a crash: the journal stays on disk
+    doc2 = document.Document()
+    j2 = journal.Journal(doc2, dirname)
+    assert j2.is_recoverable()
+    j2.recover()
+    assert len(doc2.layers) == len(doc.layers)
+    assert doc2.layer_idx == doc.layer_idx
+    for l in doc.layers + doc2.layers:
+        l._surface.remove_empty_tiles() # see docPaint()
+    for i, (l, l2) in enumerate(zip(doc.layers, doc2.layers)):
+        assert l.opacity == l2.opacity
+        assert l.is_empty() == l2.is_empty()
+        if l.is_empty():
+            continue
+        l.save_as_png('test_journalRecovery_a%d.png' % i)
+        l2.save_as_png('test_journalRecovery_b%d.png' % i)
+        assert pngs_equal('test_journalRecovery_a%d.png' % i,
+                          'test_journalRecovery_b%d.png' % i)
+    j2.remove()
+    shutil.rmtree(dirname)
+
+def journalWriteFailure():
+    import tempfile, shutil
+    dirname = tempfile.mkdtemp('mypaint')
+    doc = document.Document()
+    j = journal.Journal(doc, dirname)
+    errors = []
+    j.error_observers.append(errors.append)
+    j.start()
+    j._queue.put(('s', 0, None)) # cannot be encoded
+    j.stop()
+    # a journal with a gap must not be offered for recovery
+    assert j.error and not j.is_recoverable()
+    j.compact_if_needed()
+    j.compact_if_needed()
+    assert len(errors) == 1
+    j.start()
+    assert j.error is None
+    j.remove()
+    shutil.rmtree(dirname)
+
+def docPickColor():
+    doc = document.Document()
+    s = doc.layer._surface
+    s.begin_atomic()
+    s.draw_dab(100, 100, 20, 1.0, 0.0, 0.0, 1.0, 1.0)
+    s.end_atomic()
+
+    r, g, b = doc.pick_color(100, 100, 3)
+    assert r > 0.99 and g < 0.01 and b < 0.01
+    r, g, b = doc.pick_color(500, 500, 3) # background
+    assert min(r, g, b) > 0.99
+    assert doc.pick_color(500, 500, 3, document.PICK_CURRENT_LAYER) is None
+    r, g, b = doc.pick_color(100, 100, 3, document.PICK_CURRENT_LAYER)
+    assert r > 0.99 and g < 0.01 and b < 0.01
+
+    # cached tiles must follow changes to the canvas
+    s.begin_atomic()
+    s.draw_dab(100, 100, 20, 0.0, 0.0, 1.0, 1.0, 1.0)
+    s.end_atomic()
+    r, g, b = doc.pick_color(100, 100, 3)
+    assert r < 0.01 and g < 0.01 and b > 0.99
+    doc.layer.visible = False
+    doc.invalidate_all()
+    r, g, b = doc.pick_color(100, 100, 3)
+    assert min(r, g, b) > 0.99
+
+def flattenedTileCache():
+    doc = document.Document()
+    s = doc.layer._surface
+    s.begin_atomic()
+    s.draw_dab(10, 10, 5, 1.0, 0.0, 0.0, 1.0, 1.0)
+    s.end_atomic()
+    doc.add_layer(1)
+
+    bg1 = doc.get_rendered_image_behind_current_layer(0, 0)
+    assert doc.get_rendered_image_behind_current_layer(0, 0) is bg1
+    assert bg1[10, 10, 0] > bg1[10, 10, 2]
+
+    # painting below the current layer invalidates the composite
+    s.begin_atomic()
+    s.draw_dab(10, 10, 5, 0.0, 0.0, 1.0, 1.0, 1.0)
+    s.end_atomic()
+    bg2 = doc.get_rendered_image_behind_current_layer(0, 0)
+    assert bg2 is not bg1
+    assert bg2[10, 10, 2] > bg2[10, 10, 0]
+
+    # removed layers are dropped from the cache, not just their area
+    removed = doc.layer
+    s2 = removed._surface
+    s2.begin_atomic()
+    s2.draw_dab(1000, 1000, 5, 1.0, 0.0, 0.0, 1.0, 1.0)
+    s2.end_atomic()
+    doc.get_flattened_tile(doc.layers, 0, 0)
+    doc.remove_layer()
+    for pos in doc._tile_cache.keys():
+        for source in doc._tile_cache.get(pos):
+            assert removed not in source
+    # composites of the remaining layers stay cached
+    assert doc.get_flattened_tile(doc.layers, 0, 0) is bg2
+
+def layerSnapshotPaste():
+    doc = document.Document()
+    s = doc.layer._surface
+    s.begin_atomic()
+    s.draw_dab(100, 100, 50, 1.0, 0.0, 0.0, 1.0, 1.0)
+    s.end_atomic()
+    sshot = doc.layer.save_surface_snapshot()
+
+    doc.add_layer(1)
+    assert doc.layer.is_empty()
+    doc.load_layer_from_surface_snapshot(sshot)
+    pasted = doc.layer._surface.tiledict
+    assert set(pasted) == set(s.tiledict)
+    for pos, tile in pasted.iteritems():
+        assert tile is s.tiledict[pos] # shared, not copied
+    doc.undo()
+    assert doc.layer.is_empty()
+
+    # pasting somewhere else moves the pixels
+    N = tiledsurface.N
+    doc.load_layer_from_surface_snapshot(sshot, N, 2*N)
+    x, y, w, h = doc.layer.get_bbox()
+    x0, y0, w0, h0 = s.get_bbox()
+    assert (x, y, w, h) == (x0+N, y0+2*N, w0, h0)
+    pasted = doc.layer._surface.tiledict
+    for (tx, ty), tile in s.tiledict.iteritems():
+        assert pasted[(tx+1, ty+2)] is tile
+
 def saveFrame():
     print 'test-saving various frame sizes...'
     cnt=0
@@ -304,6 +846,25 @@ options, tests = parser.parse_args()
 #layerModes()
 directPaint()
 brushPaint()
+brushSwitching()
+strokeEncoding()
+brushCache()
+resampleAffine()
+convexPolygonTiles()
+saveParallelDeflate()
+uniformTiles()
+tilePool()
+pngLoading()
+layerMove()
+surfaceBbox()
+mipmapUpdate()
+tileCompactRace()
+tileStore()
+journalRecovery()
+journalWriteFailure()
+docPickColor()
+flattenedTileCache()
+layerSnapshotPaste()
 
 # FIXME: make these tests pass with MyPaint+GEGL
 #if not os.environ.get('MYPAINT_ENABLE_GEGL', 0):
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-import sys, os, tempfile, subprocess, gc, cProfile
+import sys, os, tempfile, subprocess, gc, cProfile, shutil
 from time import time, sleep
 
 import gtk, glib
@@ -60,6 +60,55 @@ def startup(gui):
     gui.wait_for_idle()
     yield stop_measurement
 
+def make_2000_brushes_confpath():
+    """Creates a fresh configuration directory with 2000 user brushes.
+
+    The brush directories are backdated, because the brush catalogue
+    doesn't trust directory listings which are only seconds old.
+    """
+    confpath = tempfile.mkdtemp('mypaint-perf')
+    library = os.path.join(confpath, 'brushes', 'library')
+    os.makedirs(library)
+    for i in range(2000):
+        for suffix in ['.myb', '_prev.png']:
+            src = 'brushes/charcoal' + suffix
+            dst = '%s/b%04d%s' % (library, i, suffix)
+            open(dst, 'wb').write(open(src, 'rb').read())
+    t = time() - 60
+    for path in [library, os.path.dirname(library)]:
+        os.utime(path, (t, t))
+    return confpath
+
+@gui_test
+def startup_2000_brushes_cold(gui):
+    """
+    Startup with 2000 brushes in the user's library, listing the library
+    and building the brush catalogue.
+    """
+    confpath = make_2000_brushes_confpath()
+    yield start_measurement
+    gui.setup(confpath)
+    gui.wait_for_idle()
+    yield stop_measurement
+    shutil.rmtree(confpath)
+
+@gui_test
+def startup_2000_brushes_warm(gui):
+    """
+    Startup with 2000 brushes in the user's library, with the brush
+    catalogue of a previous (unmeasured) startup present.
+    """
+    confpath = make_2000_brushes_confpath()
+    previous = guicontrol.GUI()
+    previous.setup(confpath)
+    previous.wait_for_idle()
+    assert os.path.exists(os.path.join(confpath, 'brushcatalogue.json'))
+    yield start_measurement
+    gui.setup(confpath)
+    gui.wait_for_idle()
+    yield stop_measurement
+    shutil.rmtree(confpath)
+
 @gui_test
 def paint(gui):
     """
@@ -83,6 +132,7 @@ def paint(gui):
 
     events = loadtxt('painting30sec.dat')
     events = list(events)
+    tdw.renderer.reset_redraw_stats()
     yield start_measurement
     t_old = 0.0
     t_last_redraw = 0.0
@@ -95,6 +145,8 @@ def paint(gui):
         x, y = tdw.display_to_model(x, y)
         gui_doc.model.stroke_to(dtime, x, y, pressure, 0.0, 0.0)
     yield stop_measurement
+    stats = tdw.renderer.get_redraw_stats()
+    print 'redraws: %(repaints)d (%(repaints_per_sec).1f/s), %(flushes)d flushes for %(notifications)d notifications' % stats
 
 @gui_test
 def paint_zoomed_out_5x(gui):